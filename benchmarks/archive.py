@@ -0,0 +1,28 @@
+import os, time
+from datetime import datetime, timezone
+
+def generate_archive(storage_dirpath:str, monitors:int, segments_per_monitor:int, segment_duration_sec:int=300, segment_bytes:int=50_000_000, end_time:float|None=None):
+    # Lays out videos/<date>/<epoch>.mp4 per monitor like the recorder does. Files are sparse, so
+    # millions of them take inodes but next to no space, while stat still reports segment_bytes
+    end_time = int(end_time if end_time is not None else time.time())
+    start_time = end_time - segments_per_monitor * segment_duration_sec
+
+    monitor_names = [ f'camera-{i:04d}' for i in range(monitors) ]
+
+    for (n, name) in enumerate(monitor_names):
+        video_dirpath = os.path.join(storage_dirpath, name, 'videos')
+        current_dirpath = None
+
+        for i in range(segments_per_monitor):
+            # Stagger monitors a little, real cameras never start segments in lockstep
+            timestamp = start_time + i * segment_duration_sec + (n * 7) % segment_duration_sec
+            day_dirpath = os.path.join(video_dirpath, datetime.fromtimestamp(timestamp, tz=timezone.utc).date().isoformat())
+
+            if day_dirpath != current_dirpath:
+                os.makedirs(day_dirpath, exist_ok=True)
+                current_dirpath = day_dirpath
+
+            with open(os.path.join(day_dirpath, f'{timestamp}.mp4'), 'wb') as f:
+                f.truncate(segment_bytes)
+
+    return monitor_names
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import os, sys, json, time, shutil, argparse, tempfile, subprocess, threading
+
+from utils.logger import Logger, LogWriter
+from utils.recorder import Recorder, FFmpegProfile
+from utils.finalizer import Finalizer
+from utils.limit_manager import RecorderLimitManager, GlobalLimitManager
+from utils.supervisor import Supervisor
+from utils.metrics import Registry
+
+from .archive import generate_archive
+from .measure import Measurement
+
+BENCHMARK_DIR = os.path.abspath(os.path.dirname(__file__))
+REFERENCE_FILE = os.path.join(BENCHMARK_DIR, 'reference.json')
+
+def setup_recorders(logger:Logger, storage_dirpath:str, names:list[str], segment_duration_sec:int, **kwargs):
+    return { name: Recorder(logger, os.path.join(storage_dirpath, name), name, f'file:{name}', segment_duration_sec, **kwargs) for name in names }
+
+def bench_retention(args, work_dirpath:str):
+    logger = Logger(os.path.join(work_dirpath, 'logs', 'retention.log'))
+    storage_dirpath = os.path.join(work_dirpath, 'storage')
+    results = []
+
+    def measure(name:str, function):
+        with Measurement(name) as measurement:
+            value = function()
+
+        print(f'{name}: {measurement.get_results()}', file=sys.stderr)
+        results.append((name, measurement.get_results()))
+
+        return value
+
+    names = measure('generate_archive', lambda: generate_archive(storage_dirpath, args.monitors, args.segments, segment_duration_sec=args.segment_duration_sec))
+    recorders = setup_recorders(logger, storage_dirpath, names, args.segment_duration_sec)
+    total_segments = args.monitors * args.segments
+
+    # Cold builds every index from the disk, warm is a restart with nothing changed
+    measure('reconcile_cold', lambda: [ recorder.reconcile_index() for recorder in recorders.values() ])
+    measure('reconcile_warm', lambda: [ recorder.reconcile_index() for recorder in recorders.values() ])
+
+    measure('get_videos_all_monitors', lambda: sum(len(recorder.get_videos()) for recorder in recorders.values()))
+
+    global_manager = GlobalLimitManager(logger, recorders.values(), max_disk_bytes=None)
+    measure('global_oldest_1000', lambda: [ video for (_, video) in zip(range(1000), global_manager._iter_videos()) ])
+    measure('global_total_bytes', global_manager._get_total_bytes)
+
+    # Steady state of incremental retention, one new segment on a monitor that is within its limits
+    recorder = next(iter(recorders.values()))
+    recorder_manager = RecorderLimitManager(logger, recorder, max_age_sec=args.segments * args.segment_duration_sec * 2, max_disk_bytes=10**18)
+    measure('incremental_check_within_limits', lambda: (recorder_manager.is_over_storage_limit(), recorder_manager.get_next_expiry()))
+
+    # Oldest day of every monitor goes over the age limit
+    age_managers = [ RecorderLimitManager(logger, recorder, max_age_sec=(args.segments - 288) * args.segment_duration_sec) for recorder in recorders.values() ]
+    measure('age_limit_drop_oldest_day', lambda: [ manager.run() for manager in age_managers ])
+
+    # Global limit cut by a tenth, deletes the oldest across all monitors
+    global_manager = GlobalLimitManager(logger, recorders.values(), max_disk_bytes=int(global_manager._get_total_bytes() * 0.9))
+    measure('global_storage_limit_free_10pct', global_manager.run)
+
+    for recorder in recorders.values():
+        recorder.close()
+
+    return {
+        'params': { 'monitors': args.monitors, 'segments_per_monitor': args.segments, 'total_segments': total_segments },
+        'results': dict(results),
+    }
+
+def generate_sample(filepath:str, seconds:int, width:int, height:int, fps:int):
+    # Encoded once, every simulated camera then loops it in real time without any network
+    ffmpeg_cmd = [
+        'ffmpeg', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=size={width}x{height}:rate={fps}',
+        '-f', 'lavfi', '-i', 'sine=frequency=1000:sample_rate=8000',
+        '-t', str(seconds),
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', str(fps * 2),
+        '-c:a', 'pcm_mulaw',
+        '-y', filepath
+    ]
+
+    proc = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise Exception(f'Failed to generate sample: {proc.stderr.decode("utf-8")}')
+
+def bench_ingest(args, work_dirpath:str):
+    logger = Logger(os.path.join(work_dirpath, 'logs', 'ingest.log'))
+    storage_dirpath = os.path.join(work_dirpath, 'storage')
+
+    sample_filepath = os.path.join(work_dirpath, 'sample.mkv')
+    generate_sample(sample_filepath, 60, args.width, args.height, args.fps)
+
+    # Read at real time speed and looped forever, which is what a camera looks like to FFmpeg
+    profile = FFmpegProfile(input_args=[ '-re', '-stream_loop', '-1' ])
+    finalizer = Finalizer(logger)
+
+    names = [ f'camera-{i:04d}' for i in range(args.cameras) ]
+    recorders = {
+        name: Recorder(logger, os.path.join(storage_dirpath, name), name, sample_filepath, args.segment_duration_sec, direct_mp4=args.direct_mp4, finalizer=finalizer, profile=profile)
+        for name in names
+    }
+
+    supervisor = Supervisor(logger, recorders, [], finalizer=finalizer)
+    timer = threading.Timer(args.seconds, supervisor.stop)
+    cpu_samples = []
+
+    def sample_cpu():
+        # Same reading as the nvr_ffmpeg_cpu_percent gauge, once a second
+        while timer.is_alive():
+            cpu_samples.append(sum(recorder._get_ffmpeg_cpu_percent() for recorder in recorders.values()))
+            time.sleep(1)
+
+    with Measurement('ingest') as measurement:
+        timer.start()
+        threading.Thread(target=sample_cpu, daemon=True).start()
+        supervisor.start()
+
+    metrics = parse_metrics(Registry.get_default().collect())
+    segments = sum(value for (name, value) in metrics if name.startswith('nvr_segments_total'))
+    finalize_sum = sum(value for (name, value) in metrics if name.startswith('nvr_finalize_seconds_sum'))
+    wait_sum = sum(value for (name, value) in metrics if name.startswith('nvr_finalizer_wait_seconds_sum'))
+    wait_count = sum(value for (name, value) in metrics if name.startswith('nvr_finalizer_wait_seconds_count'))
+
+    # Skip the first seconds, FFmpeg probing the input is not steady state
+    steady_cpu = cpu_samples[3:] if len(cpu_samples) > 3 else cpu_samples
+
+    return {
+        'params': { 'cameras': args.cameras, 'seconds': args.seconds, 'resolution': f'{args.width}x{args.height}', 'fps': args.fps, 'direct_mp4': args.direct_mp4 },
+        'results': {
+            'ingest': {
+                'segments': segments,
+                'finalize_mean_sec': round(finalize_sum / segments, 4) if segments > 0 else None,
+                'mover_wait_mean_sec': round(wait_sum / wait_count, 4) if wait_count > 0 else None,
+                'ffmpeg_cpu_percent_total': round(sum(steady_cpu) / len(steady_cpu), 1) if len(steady_cpu) > 0 else None,
+                'ffmpeg_cpu_percent_per_camera': round(sum(steady_cpu) / len(steady_cpu) / args.cameras, 2) if len(steady_cpu) > 0 else None,
+                'nvr_cpu_sec': measurement.get_results()['cpu_sec'],
+            },
+        },
+    }
+
+def parse_metrics(text:str):
+    samples = []
+    for line in text.splitlines():
+        if line.startswith('#') or not line.strip():
+            continue
+
+        (name, value) = line.rsplit(' ', 1)
+        samples.append((name, float(value)))
+
+    return samples
+
+def compare(report:dict, reference:dict, tolerance:float):
+    # Only timings of runs with the same parameters are comparable
+    regressions = []
+
+    for (benchmark, run) in report.items():
+        reference_run = reference.get(benchmark)
+        if reference_run is None or reference_run['params'] != run['params']:
+            print(f'{benchmark}: no reference for these parameters, not compared', file=sys.stderr)
+            continue
+
+        for (step, results) in run['results'].items():
+            reference_results = reference_run['results'].get(step, {})
+
+            for key in [ 'wall_sec', 'finalize_mean_sec', 'mover_wait_mean_sec', 'ffmpeg_cpu_percent_per_camera' ]:
+                if results.get(key) is None or reference_results.get(key) is None:
+                    continue
+
+                # Tiny timings are all noise, give them an absolute floor
+                limit = max(reference_results[key] * (1 + tolerance), reference_results[key] + 0.01)
+                if results[key] > limit:
+                    regressions.append(f'{benchmark}.{step}.{key}: {results[key]} vs reference {reference_results[key]}')
+
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks for retention, the mover and ingest, without any network or cameras')
+    parser.add_argument('--work-dir', default=None, help='Directory for the synthetic archive, a temporary one by default')
+    parser.add_argument('--keep', action='store_true', help='Keep the work directory afterwards')
+    parser.add_argument('--output', default=None, help='Write the report as JSON to this file')
+    parser.add_argument('--compare', nargs='?', const=REFERENCE_FILE, default=None, help='Compare against a reference report, the bundled one by default')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the reference before it counts as a regression')
+
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    retention_parser = subparsers.add_parser('retention', help='Index, listing and limit checks over a synthetic archive of sparse files')
+    retention_parser.add_argument('--monitors', type=int, default=20)
+    retention_parser.add_argument('--segments', type=int, default=5000, help='Segments per monitor')
+    retention_parser.add_argument('--segment-duration-sec', type=int, default=300)
+
+    ingest_parser = subparsers.add_parser('ingest', help='Simulated cameras looping a lavfi test pattern through real recorders')
+    ingest_parser.add_argument('--cameras', type=int, default=4)
+    ingest_parser.add_argument('--seconds', type=int, default=60)
+    ingest_parser.add_argument('--segment-duration-sec', type=int, default=10)
+    ingest_parser.add_argument('--width', type=int, default=1280)
+    ingest_parser.add_argument('--height', type=int, default=720)
+    ingest_parser.add_argument('--fps', type=int, default=15)
+    ingest_parser.add_argument('--direct-mp4', action='store_true', help='Record fragmented MP4 instead of remuxing MKV')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Stdout carries the report
+    LogWriter.get_default().configure(console=False)
+
+    work_dirpath = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='nvr-bench-')
+    os.makedirs(work_dirpath, exist_ok=True)
+
+    try:
+        if args.benchmark == 'retention':
+            report = { 'retention': bench_retention(args, work_dirpath) }
+        else:
+            report = { 'ingest': bench_ingest(args, work_dirpath) }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dirpath, ignore_errors=True)
+
+    print(json.dumps(report, indent=4))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+
+        if len(regressions) > 0:
+            exit(1)
@@ -0,0 +1,43 @@
+import gc, resource, time
+
+class Measurement:
+    # Wall time, CPU time, read/write calls and peak RSS growth of one block of code
+    def __init__(self, name:str):
+        self._name = name
+        self._results = {}
+
+    def get_name(self):
+        return self._name
+
+    def get_results(self):
+        return dict(self._results)
+
+    def __enter__(self):
+        gc.collect()
+
+        self._io = self._read_proc_io()
+        self._usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._started = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *args):
+        wall_sec = time.perf_counter() - self._started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        io = self._read_proc_io()
+
+        self._results = {
+            'wall_sec': round(wall_sec, 4),
+            'cpu_sec': round((usage.ru_utime + usage.ru_stime) - (self._usage.ru_utime + self._usage.ru_stime), 4),
+            # Only the read and write families from /proc, stat, getdents and unlink are not counted anywhere in it
+            'read_write_calls': (io['syscr'] + io['syscw']) - (self._io['syscr'] + self._io['syscw']) if io and self._io else None,
+            # Growth of the peak, so only meaningful for blocks that set a new one
+            'max_rss_growth_mb': round((usage.ru_maxrss - self._usage.ru_maxrss) / 1024, 1),
+        }
+
+    def _read_proc_io(self):
+        try:
+            with open('/proc/self/io', 'r') as f:
+                return { key: int(value) for (key, value) in (line.split(':') for line in f) }
+        except (OSError, ValueError):
+            return None
@@ -1,70 +1,423 @@
 #!/usr/bin/env python3
 
-import os, sys, yaml, time, threading
-
-from utils.logger import Logger
-from utils.recorder import Recorder
-from utils.limit_manager import LimitManager, RecorderLimitManager, GlobalLimitManager
+import os, sys, time, yaml, asyncio, argparse, tempfile
+from datetime import datetime
+
+from utils.logger import Logger, LogWriter
+from utils.recorder import Recorder, FFmpegProfile, ProxyOutput, ThumbnailOutput
+from utils.finalizer import Finalizer
+from utils.limit_manager import RecorderLimitManager, GlobalLimitManager, DiskSpaceLimitManager, OutputLimitManager
+from utils.supervisor import Supervisor
+from utils.metrics import Registry, MetricsServer
+from utils.exporter import Exporter
+from utils.migrator import TierMigrator
+from utils.playback import PlaybackServer
+from utils.shard import ShardCoordinator, ShardWorker
+from utils.scheduling import SchedulingClass, Throttle
+from utils.video import Video
 
 SCRIPT_DIR = os.path.abspath(os.path.dirname(sys.argv[0]))
 LOG_DIRPATH = os.path.join(SCRIPT_DIR, 'logs')
 DEFAULT_CONFIG_FILE = os.path.join(SCRIPT_DIR, 'config.yml')
 
+# How often shard workers send their metrics to the coordinator
+SHARD_METRICS_INTERVAL_SEC = 5
+
 main_logger = Logger(os.path.join(LOG_DIRPATH, 'main.log'))
 
-def create_threads(targets:list):
-    return [ threading.Thread(target=target, daemon=True) for target in targets ]
+def setup_logging(config:dict):
+    LOGGING_KEY = 'logging'
+    CONSOLE_KEY = 'console'
+    MAX_SIZE_KEY = 'max-size-mb'
+    BACKUPS_KEY = 'backups'
+    ROTATE_HOURS_KEY = 'rotate-hours'
+    FLUSH_INTERVAL_KEY = 'flush-interval-sec'
+    RATE_LIMIT_KEY = 'rate-limit-per-sec'
+
+    CONSOLE_DEFAULT = True
+    MAX_SIZE_DEFAULT = 10
+    BACKUPS_DEFAULT = 5
+    FLUSH_INTERVAL_DEFAULT = 1
+    RATE_LIMIT_DEFAULT = 50
+
+    try:
+        logging_config = config[LOGGING_KEY] if LOGGING_KEY in config and config[LOGGING_KEY] is not None else {}
+
+        console = bool(logging_config[CONSOLE_KEY]) if CONSOLE_KEY in logging_config else CONSOLE_DEFAULT
+        max_size_mb = logging_config[MAX_SIZE_KEY] if MAX_SIZE_KEY in logging_config else MAX_SIZE_DEFAULT
+        backups = int(logging_config[BACKUPS_KEY]) if BACKUPS_KEY in logging_config else BACKUPS_DEFAULT
+        rotate_hours = logging_config[ROTATE_HOURS_KEY] if ROTATE_HOURS_KEY in logging_config else None
+        flush_interval_sec = float(logging_config[FLUSH_INTERVAL_KEY]) if FLUSH_INTERVAL_KEY in logging_config else FLUSH_INTERVAL_DEFAULT
+        rate_limit_per_sec = logging_config[RATE_LIMIT_KEY] if RATE_LIMIT_KEY in logging_config else RATE_LIMIT_DEFAULT
+
+        if backups < 0:
+            raise Exception(f'Log backups cannot be negative!')
+
+        if flush_interval_sec <= 0:
+            raise Exception(f'Log flush interval cannot be negative or zero!')
+
+        LogWriter.get_default().configure(
+            console=console,
+            max_bytes=int(float(max_size_mb) * 1e6) if max_size_mb is not None else None,
+            backups=backups,
+            rotate_interval_sec=float(rotate_hours) * 3600 if rotate_hours is not None else None,
+            flush_interval_sec=flush_interval_sec,
+            rate_limit_per_sec=int(rate_limit_per_sec) if rate_limit_per_sec is not None else None
+        )
+    except Exception as e:
+        raise Exception(f'Failed to setup logging: {e}')
+
+def setup_scheduling(config:dict):
+    SCHEDULING_KEY = 'scheduling'
+    INGEST_KEY = 'ingest'
+    FINALIZE_KEY = 'finalize'
+    RETENTION_KEY = 'retention'
+    NICE_KEY = 'nice'
+    IO_CLASS_KEY = 'io-class'
+    IO_LEVEL_KEY = 'io-level'
+    MAX_MB_PER_SEC_KEY = 'max-mb-per-sec'
+    MAX_UNLINKS_PER_SEC_KEY = 'max-unlinks-per-sec'
+
+    # (nice, I/O class, I/O level) per kind of work. Background work yields by default, raising ingest needs CAP_SYS_NICE
+    CLASS_DEFAULTS = {
+        INGEST_KEY: (None, None, None),
+        FINALIZE_KEY: (10, 'best-effort', 7),
+        RETENTION_KEY: (10, 'best-effort', 7),
+    }
+
+    # Throttle key and unit of the kinds of work that have one
+    THROTTLES = {
+        FINALIZE_KEY: (MAX_MB_PER_SEC_KEY, 1e6),
+        RETENTION_KEY: (MAX_UNLINKS_PER_SEC_KEY, 1),
+    }
+
+    # Kind of work to (scheduling class, throttle), either None to leave it alone
+    scheduling = {}
+
+    try:
+        scheduling_config = config[SCHEDULING_KEY] if SCHEDULING_KEY in config and config[SCHEDULING_KEY] is not None else {}
+
+        for work, (nice_default, io_class_default, io_level_default) in CLASS_DEFAULTS.items():
+            work_config = scheduling_config[work] if work in scheduling_config and scheduling_config[work] is not None else {}
+
+            nice = work_config[NICE_KEY] if NICE_KEY in work_config else nice_default
+            io_class = work_config[IO_CLASS_KEY] if IO_CLASS_KEY in work_config else io_class_default
+            io_level = work_config[IO_LEVEL_KEY] if IO_LEVEL_KEY in work_config else io_level_default
+
+            try:
+                scheduling_class = None
+                if nice is not None or io_class is not None:
+                    scheduling_class = SchedulingClass(work, nice=int(nice) if nice is not None else None, io_class=io_class, io_level=int(io_level) if io_level is not None else None)
 
-def start_threads(threads:list):
-    for thread in threads:
-        thread.start()
+                throttle = None
+                if work in THROTTLES:
+                    (throttle_key, unit) = THROTTLES[work]
+                    rate = work_config[throttle_key] if throttle_key in work_config else None
+
+                    if rate is not None:
+                        if float(rate) <= 0:
+                            raise Exception(f'Rate limit cannot be negative or zero!')
+
+                        throttle = Throttle(work, float(rate) * unit)
+            except Exception as e:
+                raise Exception(f'Invalid {work} scheduling: {e}')
+
+            scheduling[work] = (scheduling_class, throttle)
+    except Exception as e:
+        raise Exception(f'Failed to setup scheduling: {e}')
+
+    return scheduling
+
+def setup_finalizer(config:dict, log_dirpath:str=LOG_DIRPATH):
+    FINALIZER_KEY = 'finalizer'
+    MAX_WORKERS_KEY = 'max-workers'
+    MAX_PER_DISK_KEY = 'max-per-disk'
+
+    MAX_WORKERS_DEFAULT = 4
+    MAX_PER_DISK_DEFAULT = 2
+
+    try:
+        finalizer_config = config[FINALIZER_KEY] if FINALIZER_KEY in config and config[FINALIZER_KEY] is not None else {}
+
+        max_workers = int(finalizer_config[MAX_WORKERS_KEY]) if MAX_WORKERS_KEY in finalizer_config else MAX_WORKERS_DEFAULT
+        max_per_disk = int(finalizer_config[MAX_PER_DISK_KEY]) if MAX_PER_DISK_KEY in finalizer_config else MAX_PER_DISK_DEFAULT
+
+        if max_workers <= 0 or max_per_disk <= 0:
+            raise Exception(f'Finalizer limits cannot be negative or zero!')
+
+        (scheduling_class, throttle) = setup_scheduling(config)['finalize']
+
+        logger = Logger(os.path.join(log_dirpath, 'finalizer.log'))
+
+        return Finalizer(logger, max_workers=max_workers, max_per_disk=max_per_disk, scheduling_class=scheduling_class, throttle=throttle)
+    except Exception as e:
+        raise Exception(f'Failed to setup finalizer: {e}')
+
+def setup_profile(settings:dict):
+    PROFILE_KEYS = {
+        'audio-codec': ('audio_codec', str),
+        'rtsp-transport': ('rtsp_transport', str),
+        'loglevel': ('loglevel', str),
+        'timeout-sec': ('timeout_sec', float),
+        'probesize': ('probesize', int),
+        'analyzeduration-sec': ('analyzeduration_sec', float),
+        'fflags': ('fflags', str),
+        'use-wallclock-as-timestamps': ('use_wallclock_as_timestamps', bool),
+        'input-args': ('input_args', list),
+        'output-args': ('output_args', list),
+    }
+
+    kwargs = {}
+    for key, value in settings.items():
+        if key not in PROFILE_KEYS:
+            raise Exception(f'Unknown FFmpeg profile option "{key}"!')
+
+        (name, value_type) = PROFILE_KEYS[key]
+        kwargs[name] = value_type(value) if value is not None else None
+
+    return FFmpegProfile(**kwargs)
+
+def get_profile_settings(config:dict, monitor_config:dict):
+    PROFILES_KEY = 'profiles'
+    PROFILE_KEY = 'profile'
+    FFMPEG_KEY = 'ffmpeg'
+
+    profiles = config[PROFILES_KEY] if PROFILES_KEY in config and config[PROFILES_KEY] is not None else {}
+
+    settings = {}
+    if PROFILE_KEY in monitor_config and monitor_config[PROFILE_KEY] is not None:
+        profile_name = monitor_config[PROFILE_KEY]
+
+        if profile_name not in profiles:
+            raise Exception(f'Profile "{profile_name}" does not exist!')
+
+        settings.update(profiles[profile_name] or {})
+
+    # Monitor specific options win over the named profile
+    if FFMPEG_KEY in monitor_config and monitor_config[FFMPEG_KEY] is not None:
+        settings.update(monitor_config[FFMPEG_KEY])
+
+    return settings
+
+def get_retention_limits(config:dict):
+    MAX_AGE_KEY = 'max-age-hours'
+    MAX_DISK_KEY = 'max-disk-gb'
+
+    max_age_sec = float(config[MAX_AGE_KEY]) * 3600 if MAX_AGE_KEY in config and config[MAX_AGE_KEY] is not None else None
+    max_disk_bytes = float(config[MAX_DISK_KEY]) * 1e9 if MAX_DISK_KEY in config and config[MAX_DISK_KEY] is not None else None
+
+    if (max_age_sec is not None and max_age_sec < 0) or (max_disk_bytes is not None and max_disk_bytes < 0):
+        raise Exception(f'Max age and max disk cannot be negative!')
+
+    return (max_age_sec, max_disk_bytes)
+
+def setup_outputs(monitor_dirpath:str, config:dict, segment_duration_sec:int):
+    PROXY_KEY = 'proxy'
+    THUMBNAILS_KEY = 'thumbnails'
+    HEIGHT_KEY = 'height'
+    BITRATE_KEY = 'bitrate-kbps'
+    SEGMENT_DURATION_KEY = 'segment-duration-sec'
+    INTERVAL_KEY = 'interval-sec'
+    WIDTH_KEY = 'width'
+    QUALITY_KEY = 'quality'
+
+    HEIGHT_DEFAULT = 360
+    BITRATE_DEFAULT = 500
+    INTERVAL_DEFAULT = 10
+    WIDTH_DEFAULT = 320
+    QUALITY_DEFAULT = 5
+
+    outputs = []
+
+    for output_name, output_config in config.items():
+        output_config = output_config if output_config is not None else {}
+        (max_age_sec, max_disk_bytes) = get_retention_limits(output_config)
+        dirpath = os.path.join(monitor_dirpath, output_name)
+
+        if output_name == PROXY_KEY:
+            outputs.append(ProxyOutput(
+                dirpath,
+                int(output_config[SEGMENT_DURATION_KEY]) if SEGMENT_DURATION_KEY in output_config else segment_duration_sec,
+                height=int(output_config[HEIGHT_KEY]) if HEIGHT_KEY in output_config else HEIGHT_DEFAULT,
+                bitrate_kbps=int(output_config[BITRATE_KEY]) if BITRATE_KEY in output_config else BITRATE_DEFAULT,
+                max_age_sec=max_age_sec,
+                max_disk_bytes=max_disk_bytes
+            ))
+        elif output_name == THUMBNAILS_KEY:
+            outputs.append(ThumbnailOutput(
+                dirpath,
+                interval_sec=float(output_config[INTERVAL_KEY]) if INTERVAL_KEY in output_config else INTERVAL_DEFAULT,
+                width=int(output_config[WIDTH_KEY]) if WIDTH_KEY in output_config else WIDTH_DEFAULT,
+                quality=int(output_config[QUALITY_KEY]) if QUALITY_KEY in output_config else QUALITY_DEFAULT,
+                max_age_sec=max_age_sec,
+                max_disk_bytes=max_disk_bytes
+            ))
+        else:
+            raise Exception(f'Unknown output "{output_name}", must be one of {[ PROXY_KEY, THUMBNAILS_KEY ]}!')
 
-def join_threads(threads:list):
-    for thread in threads:
-        thread.join()
+    return outputs
 
-def setup_recorder(storage_dirpath:str, name:str, config:dict):
+def setup_recorder(storage_dirpath:str, name:str, config:dict, finalizer:Finalizer|None=None, remux_threads:int=2, profile:FFmpegProfile|None=None, tier_dirpaths:list[str]|None=None, ingest_class:SchedulingClass|None=None):
     try:
         SOURCE_KEY = 'source'
         SEGMENT_DURATION_KEY = 'segment-duration-sec'
         RECORD_AUDIO_KEY = 'record-audio'
+        SEGMENT_FORMAT_KEY = 'segment-format'
+        OUTPUTS_KEY = 'outputs'
+        STALL_TIMEOUT_KEY = 'stall-timeout-sec'
+        ACTIVITY_KEY = 'activity'
 
         RECORD_AUDIO_DEFAULT = True
+        STALL_TIMEOUT_DEFAULT = 30
+        ACTIVITY_DEFAULT = False
+        SEGMENT_FORMAT_DEFAULT = 'mkv'
+        SEGMENT_FORMATS = [ 'mkv', 'mp4' ]
 
         monitor_dirpath = os.path.join(storage_dirpath, name)
         source = config[SOURCE_KEY]
         segment_duration_sec = int(config[SEGMENT_DURATION_KEY])
         record_audio = config[RECORD_AUDIO_KEY] if RECORD_AUDIO_KEY in config else RECORD_AUDIO_DEFAULT
+        segment_format = config[SEGMENT_FORMAT_KEY] if SEGMENT_FORMAT_KEY in config else SEGMENT_FORMAT_DEFAULT
+        stall_timeout_sec = config[STALL_TIMEOUT_KEY] if STALL_TIMEOUT_KEY in config else STALL_TIMEOUT_DEFAULT
+        activity = bool(config[ACTIVITY_KEY]) if ACTIVITY_KEY in config else ACTIVITY_DEFAULT
 
         if segment_duration_sec <= 0:
             raise Exception(f'Segment duration cannot be negative or zero!')
 
+        if stall_timeout_sec is not None and float(stall_timeout_sec) <= 0:
+            raise Exception(f'Stall timeout cannot be negative or zero!')
+
+        if segment_format not in SEGMENT_FORMATS:
+            raise Exception(f'Segment format must be one of {SEGMENT_FORMATS}!')
+
+        try:
+            outputs = setup_outputs(monitor_dirpath, config[OUTPUTS_KEY] if OUTPUTS_KEY in config and config[OUTPUTS_KEY] is not None else {}, segment_duration_sec)
+        except Exception as e:
+            raise Exception(f'Invalid outputs: {e}')
+
         logger = Logger(os.path.join(LOG_DIRPATH, name, 'recorder.log'))
 
-        return Recorder(logger, monitor_dirpath, name, source, segment_duration_sec, record_audio)
+        return Recorder(logger, monitor_dirpath, name, source, segment_duration_sec, record_audio, direct_mp4=(segment_format == 'mp4'), finalizer=finalizer, remux_threads=remux_threads, profile=profile, outputs=outputs, tier_dirpaths=tier_dirpaths, stall_timeout_sec=float(stall_timeout_sec) if stall_timeout_sec is not None else None, activity=activity, ingest_class=ingest_class)
     except Exception as e:
         raise Exception(f'Failed to setup recorder {name}: {e}')
 
-def setup_recorders(config:dict):
+def setup_tiers(config:dict):
+    TIERS_KEY = 'tiers'
     STORAGE_DIRPATH_KEY = 'storage'
+
+    # Storage tiers below the recording one, as (storage dirpath, max age sec, max disk bytes)
+    tiers = []
+
+    try:
+        for i, tier_config in enumerate(config[TIERS_KEY] if TIERS_KEY in config and config[TIERS_KEY] is not None else []):
+            storage_dirpath = tier_config[STORAGE_DIRPATH_KEY]
+            if not storage_dirpath.startswith('/'):
+                storage_dirpath = os.path.join(SCRIPT_DIR, storage_dirpath)
+
+            (max_age_sec, max_disk_bytes) = get_retention_limits(tier_config)
+            tiers.append((storage_dirpath, max_age_sec, max_disk_bytes))
+    except Exception as e:
+        raise Exception(f'Failed to setup storage tiers: {e}')
+
+    return tiers
+
+def setup_migrator(recorders:dict, config:dict):
+    MIGRATION_KEY = 'migration'
+    RATE_LIMIT_KEY = 'rate-limit-mb-per-sec'
+
+    RATE_LIMIT_DEFAULT = 50
+
+    if len(setup_tiers(config)) == 0:
+        return None
+
+    try:
+        migration_config = config[MIGRATION_KEY] if MIGRATION_KEY in config and config[MIGRATION_KEY] is not None else {}
+        rate_limit_mb = migration_config[RATE_LIMIT_KEY] if RATE_LIMIT_KEY in migration_config else RATE_LIMIT_DEFAULT
+
+        if rate_limit_mb is not None and float(rate_limit_mb) <= 0:
+            raise Exception(f'Migration rate limit cannot be negative or zero!')
+
+        (scheduling_class, _) = setup_scheduling(config)['retention']
+
+        logger = Logger(os.path.join(LOG_DIRPATH, 'migrator.log'))
+
+        return TierMigrator(logger, recorders.values(), rate_limit_bytes_per_sec=float(rate_limit_mb) * 1e6 if rate_limit_mb is not None else None, scheduling_class=scheduling_class)
+    except Exception as e:
+        raise Exception(f'Failed to setup migrator: {e}')
+
+def get_storage_dirpath(config:dict):
+    STORAGE_DIRPATH_KEY = 'storage'
+
+    storage_dirpath = config[STORAGE_DIRPATH_KEY]
+    if not storage_dirpath.startswith('/'):
+        storage_dirpath = os.path.join(SCRIPT_DIR, storage_dirpath)
+
+    return storage_dirpath
+
+def get_recorder_specs(config:dict):
+    # Everything a recorder is built from, a recorder only needs replacing on reload when its spec changed
     MONITORS_KEY = 'monitors'
+    FINALIZER_KEY = 'finalizer'
+    REMUX_THREADS_KEY = 'remux-threads'
+
+    # Handled by the limit checkers, changing them never restarts a recorder
+    LIMIT_KEYS = [ 'max-age-hours', 'max-disk-gb' ]
+
+    REMUX_THREADS_DEFAULT = 2
+
+    storage_dirpath = get_storage_dirpath(config)
+
+    finalizer_config = config[FINALIZER_KEY] if FINALIZER_KEY in config and config[FINALIZER_KEY] is not None else {}
+    remux_threads = int(finalizer_config[REMUX_THREADS_KEY]) if REMUX_THREADS_KEY in finalizer_config else REMUX_THREADS_DEFAULT
+
+    tiers = setup_tiers(config)
+
+    specs = {}
+    for monitor_name, monitor_config in config[MONITORS_KEY].items():
+        try:
+            profile_settings = get_profile_settings(config, monitor_config)
+        except Exception as e:
+            raise Exception(f'Invalid FFmpeg profile for {monitor_name}: {e}')
+
+        specs[monitor_name] = {
+            'storage_dirpath': storage_dirpath,
+            'remux_threads': remux_threads,
+            'tier_dirpaths': [ os.path.join(tier_dirpath, monitor_name) for (tier_dirpath, max_age_sec, max_disk_bytes) in tiers ],
+            'profile_settings': profile_settings,
+            'config': { key: value for key, value in monitor_config.items() if key not in LIMIT_KEYS },
+        }
+
+    return specs
+
+def setup_recorders(config:dict, finalizer:Finalizer|None=None, running:dict|None=None):
+    # Running maps monitor names to (spec, recorder), recorders whose spec is unchanged are reused as they are
+    running = running if running is not None else {}
 
     try:
-        storage_dirpath = config[STORAGE_DIRPATH_KEY]
-        if not storage_dirpath.startswith('/'):
-            storage_dirpath = os.path.join(SCRIPT_DIR, storage_dirpath)
+        (ingest_class, _) = setup_scheduling(config)['ingest']
 
         recorders = {}
-        for monitor_name, monitor_config in config[MONITORS_KEY].items():
-            recorders[monitor_name] = setup_recorder(storage_dirpath, monitor_name, monitor_config)
+        for monitor_name, spec in get_recorder_specs(config).items():
+            if monitor_name in running and running[monitor_name][0] == spec:
+                recorders[monitor_name] = running[monitor_name][1]
+                continue
+
+            try:
+                profile = setup_profile(spec['profile_settings'])
+            except Exception as e:
+                raise Exception(f'Invalid FFmpeg profile for {monitor_name}: {e}')
+
+            recorders[monitor_name] = setup_recorder(spec['storage_dirpath'], monitor_name, spec['config'], finalizer=finalizer, remux_threads=spec['remux_threads'], profile=profile, tier_dirpaths=spec['tier_dirpaths'], ingest_class=ingest_class)
         
         return recorders
     except Exception as e:
         raise Exception(f'Failed to setup recorders: {e}')
 
-def setup_limit_checkers(recorders:dict, config:dict):
+def setup_limit_checkers(recorders:dict, config:dict, migrator:TierMigrator|None=None, unlink_throttle:Throttle|None=None):
     MONITORS_KEY = 'monitors'
     GLOBAL_MAX_DISK_KEY = 'max-disk-gb'
+    GLOBAL_MIN_FREE_KEY = 'min-free-gb'
+    GLOBAL_TARGET_FREE_KEY = 'target-free-gb'
     RECORDER_MAX_AGE_KEY = 'max-age-hours'
     RECORDER_MAX_DISK_KEY = 'max-disk-gb'
 
@@ -75,6 +428,23 @@ def setup_limit_checkers(recorders:dict, config:dict):
     if global_max_disk_bytes < 0:
         raise Exception(f'Global max disk limit cannot be negative!')
 
+    # Get free space watermarks
+    if GLOBAL_MIN_FREE_KEY not in config or config[GLOBAL_MIN_FREE_KEY] is None:
+        min_free_bytes = None
+    else:
+        min_free_bytes = float(config[GLOBAL_MIN_FREE_KEY]) * 1e9
+
+        if GLOBAL_TARGET_FREE_KEY not in config or config[GLOBAL_TARGET_FREE_KEY] is None:
+            target_free_bytes = min_free_bytes
+        else:
+            target_free_bytes = float(config[GLOBAL_TARGET_FREE_KEY]) * 1e9
+
+        if min_free_bytes < 0 or target_free_bytes < 0:
+            raise Exception(f'Free space watermarks cannot be negative!')
+
+        if target_free_bytes < min_free_bytes:
+            raise Exception(f'Target free space cannot be below min free space!')
+
     for name, recorder in recorders.items():
         recorder_config = config[MONITORS_KEY][name]
 
@@ -97,110 +467,461 @@ def setup_limit_checkers(recorders:dict, config:dict):
 
         # Create recorder limit checker
         limit_logger = Logger(os.path.join(LOG_DIRPATH, name, 'limit.log'))
-        limit_checkers.append(RecorderLimitManager(limit_logger, recorder, max_age_sec=max_age_sec, max_disk_bytes=max_disk_bytes))
+        limit_checkers.append(RecorderLimitManager(limit_logger, recorder, max_age_sec=max_age_sec, max_disk_bytes=max_disk_bytes, migrator=migrator, unlink_throttle=unlink_throttle))
+
+        # Each extra output keeps to its own limits
+        for output in recorder.get_outputs():
+            limit_checkers.append(OutputLimitManager(limit_logger, recorder, output, unlink_throttle=unlink_throttle))
 
     # Create global limit checker
     # Do this last so it checks after the individual recorders do their thing
     global_limit_logger = Logger(os.path.join(LOG_DIRPATH, 'limit.log'))
-    limit_checkers.append(GlobalLimitManager(global_limit_logger, recorders.values(), max_disk_bytes=global_max_disk_bytes))
+    limit_checkers.append(GlobalLimitManager(global_limit_logger, recorders.values(), max_disk_bytes=global_max_disk_bytes, migrator=migrator, unlink_throttle=unlink_throttle))
+
+    # Each lower tier keeps to its own limits, only the last one deletes
+    for i, (tier_dirpath, max_age_sec, max_disk_bytes) in enumerate(setup_tiers(config)):
+        limit_checkers.append(GlobalLimitManager(global_limit_logger, recorders.values(), max_disk_bytes=max_disk_bytes, tier=i + 1, max_age_sec=max_age_sec, migrator=migrator, unlink_throttle=unlink_throttle))
+
+    # Free space last, the other limits may already have freed enough
+    if min_free_bytes is not None:
+        limit_checkers.append(DiskSpaceLimitManager(global_limit_logger, recorders.values(), min_free_bytes=min_free_bytes, target_free_bytes=target_free_bytes, migrator=migrator, unlink_throttle=unlink_throttle))
 
     return limit_checkers
 
-def start_limit_checkers(limit_checkers:list[LimitManager], stop_event:threading.Event, idle_event:threading.Event):
-    while not stop_event.is_set():
-        idle_event.clear()
+def setup_retention(config:dict):
+    RETENTION_KEY = 'retention'
+    MODE_KEY = 'mode'
+    INTERVAL_KEY = 'interval-sec'
 
-        for limit_checker in limit_checkers:
-            try:
-                limit_checker.run()
-            except Exception as e:
-                main_logger.log_warning(f'Failed to check limits: {e}')
+    MODE_DEFAULT = 'incremental'
+    INTERVAL_DEFAULT = 60
+    MODES = [ 'incremental', 'periodic' ]
+
+    retention_config = config[RETENTION_KEY] if RETENTION_KEY in config and config[RETENTION_KEY] is not None else {}
+
+    mode = retention_config[MODE_KEY] if MODE_KEY in retention_config else MODE_DEFAULT
+    interval_sec = float(retention_config[INTERVAL_KEY]) if INTERVAL_KEY in retention_config else INTERVAL_DEFAULT
 
-        # Wait for a minute or until event is set
-        stop_event.wait(60)
-        idle_event.set()
+    if mode not in MODES:
+        raise Exception(f'Retention mode must be one of {MODES}!')
+
+    if interval_sec <= 0:
+        raise Exception(f'Retention interval cannot be negative or zero!')
+
+    # Limit check interval, None for incremental
+    return interval_sec if mode == 'periodic' else None
+
+def setup_metrics(config:dict):
+    METRICS_KEY = 'metrics'
+    LISTEN_KEY = 'listen'
+    TEXTFILE_KEY = 'textfile'
+    TEXTFILE_INTERVAL_KEY = 'textfile-interval-sec'
+
+    TEXTFILE_INTERVAL_DEFAULT = 15
+
+    try:
+        metrics_config = config[METRICS_KEY] if METRICS_KEY in config and config[METRICS_KEY] is not None else {}
+
+        listen = metrics_config[LISTEN_KEY] if LISTEN_KEY in metrics_config else None
+        textfile = metrics_config[TEXTFILE_KEY] if TEXTFILE_KEY in metrics_config else None
+        textfile_interval_sec = float(metrics_config[TEXTFILE_INTERVAL_KEY]) if TEXTFILE_INTERVAL_KEY in metrics_config else TEXTFILE_INTERVAL_DEFAULT
+
+        if listen is None and textfile is None:
+            return None
+
+        (host, port) = (None, None)
+        if listen is not None:
+            (host, _, port) = str(listen).rpartition(':')
+            port = int(port)
+
+        if textfile is not None and not textfile.startswith('/'):
+            textfile = os.path.join(SCRIPT_DIR, textfile)
+
+        if textfile_interval_sec <= 0:
+            raise Exception(f'Metrics textfile interval cannot be negative or zero!')
+
+        return MetricsServer(main_logger, Registry.get_default(), host=host or None, port=port, textfile=textfile, textfile_interval_sec=textfile_interval_sec)
+    except Exception as e:
+        raise Exception(f'Failed to setup metrics: {e}')
+
+def setup_playback(recorders:dict[str, Recorder], config:dict):
+    PLAYBACK_KEY = 'playback'
+    LISTEN_KEY = 'listen'
+    MAX_REMUXES_KEY = 'max-remuxes'
+
+    MAX_REMUXES_DEFAULT = 2
+
+    try:
+        playback_config = config[PLAYBACK_KEY] if PLAYBACK_KEY in config and config[PLAYBACK_KEY] is not None else {}
+
+        listen = playback_config[LISTEN_KEY] if LISTEN_KEY in playback_config else None
+        if listen is None:
+            return None
+
+        (host, _, port) = str(listen).rpartition(':')
+        max_remuxes = playback_config[MAX_REMUXES_KEY] if MAX_REMUXES_KEY in playback_config else MAX_REMUXES_DEFAULT
+
+        # Zero would answer every remuxed segment with a 503
+        if max_remuxes is not None and int(max_remuxes) <= 0:
+            raise Exception(f'Max remuxes cannot be negative or zero!')
+
+        return PlaybackServer(main_logger, recorders, host=host or None, port=int(port), max_remuxes=int(max_remuxes) if max_remuxes is not None else None)
+    except Exception as e:
+        raise Exception(f'Failed to setup playback: {e}')
+
+def setup_sharding(config:dict):
+    SHARDING_KEY = 'sharding'
+    MONITORS_KEY = 'monitors'
+    WORKERS_KEY = 'workers'
+    PIN_CPUS_KEY = 'pin-cpus'
+
+    PIN_CPUS_DEFAULT = False
+
+    try:
+        sharding_config = config[SHARDING_KEY] if SHARDING_KEY in config and config[SHARDING_KEY] is not None else {}
+
+        workers = sharding_config[WORKERS_KEY] if WORKERS_KEY in sharding_config else None
+        pin_cpus = bool(sharding_config[PIN_CPUS_KEY]) if PIN_CPUS_KEY in sharding_config else PIN_CPUS_DEFAULT
+
+        available_cpus = sorted(os.sched_getaffinity(0))
+        workers = len(available_cpus) if workers == 'auto' else int(workers) if workers is not None else 1
+
+        if workers <= 0:
+            raise Exception(f'Shard workers cannot be negative or zero!')
+
+        # No point in workers without monitors
+        monitor_names = list(config[MONITORS_KEY].keys())
+        workers = min(workers, len(monitor_names))
+
+        if workers <= 1:
+            return None
+
+        # Same config, same shards, so a monitor keeps its worker across restarts
+        shards = [ monitor_names[i::workers] for i in range(workers) ]
+
+        cpus = None
+        if pin_cpus:
+            # Each worker gets its own share of the cores, or shares one when there are more workers than cores
+            if workers <= len(available_cpus):
+                cpus = [ available_cpus[i::workers] for i in range(workers) ]
+            else:
+                cpus = [ [ available_cpus[i % len(available_cpus)] ] for i in range(workers) ]
+
+        return (shards, cpus)
+    except Exception as e:
+        raise Exception(f'Failed to setup sharding: {e}')
+
+def run_shard(config:dict, metrics_interval_sec:float|None, shard:int, monitor_names:list[str], cpus:list[int]|None, events):
+    # Entry point of a worker process, records its own monitors and leaves retention to the coordinator
+    ShardWorker.setup_process(cpus)
+
+    setup_logging(config)
+
+    log_dirpath = os.path.join(LOG_DIRPATH, f'shard-{shard}')
+    logger = Logger(os.path.join(log_dirpath, 'main.log'))
+
+    try:
+        finalizer = setup_finalizer(config, log_dirpath=log_dirpath)
+        recorders = setup_recorders({ **config, 'monitors': { name: config['monitors'][name] for name in monitor_names } }, finalizer)
+    except Exception as e:
+        logger.log_error(f'Failed to setup shard {shard}: {e}')
+        LogWriter.get_default().close()
+        exit(1)
+
+    worker = ShardWorker(logger, shard, recorders, events, metrics_interval_sec=metrics_interval_sec)
+    supervisor = Supervisor(logger, recorders, [], finalizer=finalizer)
+
+    worker.start()
+    try:
+        supervisor.start()
+    finally:
+        worker.stop()
+        LogWriter.get_default().close()
+
+def setup_reload(config:dict):
+    RELOAD_KEY = 'reload'
+    WATCH_CONFIG_KEY = 'watch-config'
+
+    WATCH_CONFIG_DEFAULT = False
+
+    reload_config = config[RELOAD_KEY] if RELOAD_KEY in config and config[RELOAD_KEY] is not None else {}
+
+    # Whether to reload as soon as the config file changes, SIGHUP always works
+    return bool(reload_config[WATCH_CONFIG_KEY]) if WATCH_CONFIG_KEY in reload_config else WATCH_CONFIG_DEFAULT
+
+def create_reloader(config:dict, config_filepath:str, finalizer:Finalizer, migrator:TierMigrator|None, playback_server:PlaybackServer|None, unlink_throttle:Throttle|None):
+    # Only monitors, profiles, limits and logging can change, the rest is set up once
+    RESTART_KEYS = [ 'finalizer', 'retention', 'metrics', 'migration', 'reload', 'playback', 'scheduling' ]
+
+    state = { 'config': config, 'specs': get_recorder_specs(config) }
+
+    def reload(current_recorders:dict):
+        old_config = state['config']
+        new_config = read_config(config_filepath)
+
+        # Storage layout decides where everything already recorded lives, it cannot move under running recorders
+        if get_storage_dirpath(new_config) != get_storage_dirpath(old_config) or [ tier[0] for tier in setup_tiers(new_config) ] != [ tier[0] for tier in setup_tiers(old_config) ]:
+            raise Exception(f'Storage and tier directories cannot change without a restart!')
+
+        for key in RESTART_KEYS:
+            if new_config.get(key) != old_config.get(key):
+                main_logger.log_warning(f'Changes to "{key}" only apply after a restart')
+
+        setup_logging(new_config)
+
+        specs = get_recorder_specs(new_config)
+        running = { name: (state['specs'][name], recorder) for name, recorder in current_recorders.items() if name in state['specs'] }
+
+        recorders = setup_recorders(new_config, finalizer, running=running)
+        limit_checkers = setup_limit_checkers(recorders, new_config, migrator=migrator, unlink_throttle=unlink_throttle)
+
+        if migrator is not None:
+            migrator.set_recorders(recorders.values())
+
+        if playback_server is not None:
+            playback_server.set_recorders(recorders)
+
+        state['config'] = new_config
+        state['specs'] = specs
+
+        return (recorders, limit_checkers)
+
+    return reload
+
+def setup(config:dict, config_filepath:str|None=None):
+    setup_logging(config)
 
-def setup(config:dict):
     main_logger.log_info(f'Setting up NVR...')
 
+    sharding = setup_sharding(config)
+
+    # Ingest and finalization classes are set up along with the recorders and finalizer, in the workers when sharded
+    main_logger.log_info(f'Setting up scheduling...')
+    (retention_class, unlink_throttle) = setup_scheduling(config)['retention']
+
+    # Sharded, the workers record and finalize while this process only enforces the limits through the shared indexes
+    main_logger.log_info(f'Setting up finalizer...')
+    finalizer = setup_finalizer(config) if sharding is None else None
+
     main_logger.log_info(f'Setting up recorders...')
-    recorders = setup_recorders(config)
+    recorders = setup_recorders(config, finalizer)
+
+    main_logger.log_info(f'Setting up storage tiers...')
+    migrator = setup_migrator(recorders, config)
 
     main_logger.log_info(f'Setting up limit checkers...')
-    limit_checkers = setup_limit_checkers(recorders, config)
+    limit_checkers = setup_limit_checkers(recorders, config, migrator=migrator, unlink_throttle=unlink_throttle)
+    limit_interval_sec = setup_retention(config)
+
+    main_logger.log_info(f'Setting up metrics...')
+    metrics_server = setup_metrics(config)
+
+    main_logger.log_info(f'Setting up playback...')
+    playback_server = setup_playback(recorders, config)
+
+    coordinator = None
+    if sharding is not None:
+        (shards, cpus) = sharding
+        main_logger.log_info(f'Setting up {len(shards)} shards...')
 
-    # Event for when the limits thread should stop
-    # Needs to be a set-to-stop for the sleep to work
-    stop_event = threading.Event()
-    are_checkers_idle = threading.Event()
+        coordinator = ShardCoordinator(main_logger, run_shard, shards, args=(config, SHARD_METRICS_INTERVAL_SEC if metrics_server is not None else None), cpus=cpus)
 
-    # Stopped by default
-    stop_event.set()
+        # Workers are handed the config they started with, a reload is turned down rather than SIGHUP ending the process
+        def reloader(current_recorders:dict):
+            raise Exception(f'Config reload is not supported with sharding, changes only apply after a restart')
 
-    limit_threads = create_threads([ lambda: start_limit_checkers(limit_checkers, stop_event, are_checkers_idle) ])
-    recorder_start_threads = create_threads([ recorder.start for recorder in recorders.values() ])
-    recorder_stop_threads = create_threads([ recorder.stop for recorder in recorders.values() ])
+        watch_filepath = None
+    else:
+        reloader = create_reloader(config, config_filepath, finalizer, migrator, playback_server, unlink_throttle) if config_filepath is not None else None
+        watch_filepath = config_filepath if config_filepath is not None and setup_reload(config) else None
+
+    # One event loop supervises every recorder and the limit checkers, or the shards recording them
+    supervisor = Supervisor(main_logger, recorders if coordinator is None else {}, limit_checkers, finalizer=finalizer, limit_interval_sec=limit_interval_sec, migrator=migrator, reloader=reloader, watch_filepath=watch_filepath, coordinator=coordinator, retention_class=retention_class)
 
     def start():
-        main_logger.log_info('Starting NVR...')
+        if metrics_server is not None:
+            metrics_server.start()
 
-        # If not stopped, aka running
-        if not stop_event.is_set():
-            raise Exception(f'NVR is already running!')
-        
-        # Clear stop, aka start
-        stop_event.clear()
+        if playback_server is not None:
+            playback_server.start()
 
-        main_logger.log_info('Starting recorders...')
-        start_threads(recorder_start_threads)
-        
-        main_logger.log_info('Starting limit checkers...')
-        start_threads(limit_threads)
+        try:
+            supervisor.start()
+        finally:
+            if playback_server is not None:
+                playback_server.stop()
 
-        main_logger.log_info('NVR has started!')
+            if metrics_server is not None:
+                metrics_server.stop()
 
-        join_threads([ *limit_threads, *recorder_start_threads ])
+    return (start, supervisor.stop)
 
-    def stop():
-        main_logger.log_info('Stopping NVR...')
-        stop_event.set()
+def cpu_check(config:dict, seconds:float, monitor_names:list[str]|None=None, compare_audio_copy:bool=False):
+    recorders = setup_recorders(config)
 
-        main_logger.log_info('Stopping recorders...')
-        start_threads(recorder_stop_threads)
-        join_threads(recorder_stop_threads)
+    if monitor_names is not None:
+        missing = [ name for name in monitor_names if name not in recorders ]
+        if len(missing) > 0:
+            raise Exception(f'Unknown monitors: {", ".join(missing)}')
 
-        main_logger.log_info('Waiting for limit checkers to stop...')
-        are_checkers_idle.wait()
+        recorders = { name: recorders[name] for name in monitor_names }
 
-        main_logger.log_info('NVR has stopped!')
+    async def measure_all(scratch_dirpath:str):
+        checks = []
+        for name, recorder in recorders.items():
+            checks.append((name, 'configured', recorder.measure_ffmpeg_cost(seconds, os.path.join(scratch_dirpath, name, 'configured'))))
 
-    return (start, stop)
+            if compare_audio_copy:
+                profile = recorder.get_profile().with_audio_codec('copy')
+                checks.append((name, 'audio copy', recorder.measure_ffmpeg_cost(seconds, os.path.join(scratch_dirpath, name, 'copy'), profile=profile)))
 
-if __name__ == '__main__':
+        # All at once, the same as when recording for real
+        results = await asyncio.gather(*[ check for (name, variant, check) in checks ], return_exceptions=True)
+
+        return [ (name, variant, result) for ((name, variant, check), result) in zip(checks, results) ]
+
+    print(f'Measuring FFmpeg CPU cost of {len(recorders)} monitors for {seconds} seconds...')
+
+    with tempfile.TemporaryDirectory(prefix='nvr-cpu-check-') as scratch_dirpath:
+        results = asyncio.run(measure_all(scratch_dirpath))
+
+    total_cpu_percent = 0
+    for (name, variant, result) in results:
+        if isinstance(result, Exception):
+            print(f'{name} ({variant}): failed to run FFmpeg: {result}')
+            continue
+
+        cpu = f'{result["cpu_percent"]:.1f}% CPU' if result['cpu_percent'] is not None else 'CPU unknown'
+        status = 'OK' if result['ok'] else f'NOT WORKING ({result["error"] or "no output"})'
+        print(f'{name} ({variant}): {cpu}, {result["output_bytes"] / seconds / 1000:.1f} kB/s written, {status}')
+
+        if variant == 'configured' and result['cpu_percent'] is not None:
+            total_cpu_percent += result['cpu_percent']
+
+    print(f'Total for configured pipelines: {total_cpu_percent:.1f}% CPU ({total_cpu_percent / 100:.2f} cores)')
+
+def parse_time(value:str):
+    # Argparse only shows its own message for a ValueError
     try:
-        main_logger.log_info(f'Reading config from {DEFAULT_CONFIG_FILE}...')
-        
-        try:
-            config = yaml.safe_load(open(DEFAULT_CONFIG_FILE, 'r'))
-        except FileNotFoundError as e:
-            raise Exception(f'Config file at "{DEFAULT_CONFIG_FILE}" does not exist!')
-        except Exception as e:
-            raise Exception(f'Failed to parse config: {e}')
+        return Video.parse_time(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-        try:
-            (start, stop) = setup(config)
-        except Exception as e:
-            raise Exception(f'Failed to setup NVR: {e}')
+def export(config:dict, monitor_name:str, start:float, end:float, output:str):
+    recorders = setup_recorders(config)
 
-        try:
-            start()
-        except KeyboardInterrupt as e:
-            print(f'Received keyboard interrupt, stopping NVR!')
-            stop()
-        except Exception as e:
-            raise Exception(f'Failed to start NVR: {e}')
+    if monitor_name not in recorders:
+        raise Exception(f'Unknown monitor: {monitor_name}')
+
+    exporter = Exporter(main_logger, recorders[monitor_name])
+    exporter.export(start, end, output)
+
+def list_gaps(config:dict, monitor_name:str, start:float, end:float, min_gap_sec:float):
+    recorders = setup_recorders(config)
+
+    if monitor_name not in recorders:
+        raise Exception(f'Unknown monitor: {monitor_name}')
+
+    gaps = recorders[monitor_name].get_gaps(start, end, min_gap_sec=min_gap_sec)
+
+    for (gap_start, gap_end) in gaps:
+        print(f'{datetime.fromtimestamp(gap_start).isoformat(timespec="seconds")} - {datetime.fromtimestamp(gap_end).isoformat(timespec="seconds")} ({gap_end - gap_start:.0f} seconds)')
+
+    print(f'{len(gaps)} gaps, {sum(gap_end - gap_start for (gap_start, gap_end) in gaps):.0f} seconds without recording')
+
+def list_activity(config:dict, monitor_name:str, start:float, end:float, sensitivity:float, min_gap_sec:float):
+    recorders = setup_recorders(config)
+
+    if monitor_name not in recorders:
+        raise Exception(f'Unknown monitor: {monitor_name}')
+
+    ranges = recorders[monitor_name].get_activity(start, end, sensitivity=sensitivity, min_gap_sec=min_gap_sec)
+
+    for (range_start_ms, range_end_ms, videos) in ranges:
+        filenames = ', '.join(video.get_filename() for video in videos)
+        print(f'{datetime.fromtimestamp(range_start_ms / 1000).isoformat(timespec="milliseconds")} - {datetime.fromtimestamp(range_end_ms / 1000).isoformat(timespec="milliseconds")} ({(range_end_ms - range_start_ms) / 1000:.1f} seconds) in {filenames}')
+
+    print(f'{len(ranges)} active ranges, {sum(range_end_ms - range_start_ms for (range_start_ms, range_end_ms, videos) in ranges) / 1000:.0f} seconds with activity')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='A stupidly simple NVR')
+    parser.add_argument('-c', '--config', default=DEFAULT_CONFIG_FILE, help='Path to config file')
+
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help='Record all monitors (default)')
+
+    cpu_parser = subparsers.add_parser('cpu-check', help='Measure the CPU cost of each monitor\'s FFmpeg pipeline')
+    cpu_parser.add_argument('--seconds', type=float, default=30, help='How long to record each monitor for')
+    cpu_parser.add_argument('--monitor', action='append', help='Only check this monitor, can be repeated')
+    cpu_parser.add_argument('--compare-audio-copy', action='store_true', help='Also measure each monitor with audio stream copied instead of transcoded')
+
+    export_parser = subparsers.add_parser('export', help='Export a time range of one monitor as a single MP4, without re-encoding')
+    export_parser.add_argument('--monitor', required=True, help='Monitor to export')
+    export_parser.add_argument('--start', required=True, type=parse_time, help='Start time, unix time or ISO 8601')
+    export_parser.add_argument('--end', required=True, type=parse_time, help='End time, unix time or ISO 8601')
+    export_parser.add_argument('-o', '--output', default=Exporter.STDOUT, help='File to write, stdout by default')
+
+    gaps_parser = subparsers.add_parser('gaps', help='List stretches of time a monitor has no recording for')
+    gaps_parser.add_argument('--monitor', required=True, help='Monitor to check')
+    gaps_parser.add_argument('--start', required=True, type=parse_time, help='Start time, unix time or ISO 8601')
+    gaps_parser.add_argument('--end', type=parse_time, default=time.time(), help='End time, unix time or ISO 8601, now by default')
+    gaps_parser.add_argument('--min-gap-sec', type=float, default=5, help='Ignore gaps shorter than this')
+
+    activity_parser = subparsers.add_parser('activity', help='List stretches of time with motion, for monitors recording activity')
+    activity_parser.add_argument('--monitor', required=True, help='Monitor to search')
+    activity_parser.add_argument('--start', required=True, type=parse_time, help='Start time, unix time or ISO 8601')
+    activity_parser.add_argument('--end', type=parse_time, default=time.time(), help='End time, unix time or ISO 8601, now by default')
+    activity_parser.add_argument('--sensitivity', type=float, default=4, help='How many times busier than a typical second a second must be to count, lower finds more')
+    activity_parser.add_argument('--min-gap-sec', type=float, default=5, help='Merge active stretches closer than this')
+
+    return parser.parse_args()
+
+def read_config(config_filepath:str):
+    main_logger.log_info(f'Reading config from {config_filepath}...')
+
+    try:
+        return yaml.safe_load(open(config_filepath, 'r'))
+    except FileNotFoundError as e:
+        raise Exception(f'Config file at "{config_filepath}" does not exist!')
     except Exception as e:
-        print(e)
-        exit(1)
+        raise Exception(f'Failed to parse config: {e}')
+
+def run(config:dict, config_filepath:str|None=None):
+    try:
+        (start, stop) = setup(config, config_filepath)
+    except Exception as e:
+        raise Exception(f'Failed to setup NVR: {e}')
+
+    try:
+        start()
+    except KeyboardInterrupt as e:
+        print(f'Received keyboard interrupt, stopping NVR!')
+        stop()
+    except Exception as e:
+        raise Exception(f'Failed to start NVR: {e}')
     finally:
-        print('NVR has stopped!')
\ No newline at end of file
+        print('NVR has stopped!')
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.command == 'export' and args.output == Exporter.STDOUT:
+        # Stdout carries the video, log lines would corrupt it
+        LogWriter.get_default().configure(console=False)
+
+    try:
+        config = read_config(args.config)
+
+        if args.command == 'cpu-check':
+            cpu_check(config, args.seconds, monitor_names=args.monitor, compare_audio_copy=args.compare_audio_copy)
+        elif args.command == 'gaps':
+            list_gaps(config, args.monitor, args.start, args.end, args.min_gap_sec)
+        elif args.command == 'activity':
+            list_activity(config, args.monitor, args.start, args.end, args.sensitivity, args.min_gap_sec)
+        elif args.command == 'export':
+            export(config, args.monitor, args.start, args.end, args.output)
+        else:
+            run(config, os.path.abspath(args.config))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        exit(1)
\ No newline at end of file
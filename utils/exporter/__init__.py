@@ -0,0 +1,3 @@
+from .exporter import Exporter
+
+__all__ = [ 'Exporter' ]
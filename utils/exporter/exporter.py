@@ -0,0 +1,89 @@
+import subprocess, tempfile
+
+from ..logger import Logger
+from ..recorder import Recorder
+from ..video import Video, KeyframeSidecar
+
+class Exporter:
+    STDOUT = '-'
+
+    def __init__(self, logger:Logger, recorder:Recorder):
+        self._logger = logger
+        self._recorder = recorder
+
+    def find_videos(self, start:float, end:float):
+        # Segments overlapping [start, end), oldest first
+        if end <= start:
+            raise Exception(f'Export end must be after its start!')
+
+        # A range scan on each tier's index, the rest of the archive is never loaded
+        return self._recorder.get_videos_between(start, end)
+
+    def export(self, start:float, end:float, output:str=STDOUT):
+        # Blocking, writes one MP4 to output, a file path or STDOUT
+        videos = self.find_videos(start, end)
+        if len(videos) == 0:
+            raise Exception(f'No videos of {self._recorder.get_name()} between {start} and {end}!')
+
+        self._log_info(f'Exporting {len(videos)} videos between {start} and {end} to {"stdout" if output == self.STDOUT else output}...')
+
+        with tempfile.NamedTemporaryFile('w', prefix='nvr-export-', suffix='.ffconcat') as concat_file:
+            concat_file.write(self._generate_concat_list(videos, start, end))
+            concat_file.flush()
+
+            # Output is not redirected, so a stdout export streams straight from FFmpeg to the pipe
+            proc = subprocess.run(self._generate_ffmpeg_command(concat_file.name, output), stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        if proc.returncode != 0:
+            stderr = proc.stderr.decode('utf-8', errors='replace').strip()
+            raise Exception(f'Failed to export videos: {stderr}')
+
+        self._log_info(f'Exported {len(videos)} videos!')
+
+    def _log_info(self, message):
+        self._logger.log_info(f'{self._recorder.get_name()}: {message}')
+
+    def _get_duration(self, video:Video):
+        duration = video.get_duration()
+
+        return duration if duration is not None else self._recorder.get_segment_duration_sec()
+
+    def _get_inpoint(self, video:Video, offset_sec:float):
+        # Snap to the keyframe ourselves when the sidecar knows where it is, so the export starts exactly there
+        try:
+            keyframe = KeyframeSidecar.read(video.get_sidecar_filepath()).find_keyframe(offset_sec)
+        except Exception:
+            return offset_sec
+
+        return keyframe[0] if keyframe is not None else offset_sec
+
+    def _generate_concat_list(self, videos:list[Video], start:float, end:float):
+        lines = [ 'ffconcat version 1.0' ]
+
+        for i, video in enumerate(videos):
+            escaped_path = video.get_filepath().replace("'", "'\\''")
+            lines.append(f"file '{escaped_path}'")
+
+            # Only the edges are trimmed, stream copy starts at the keyframe before the inpoint
+            if i == 0 and start > video.get_timestamp():
+                lines.append(f'inpoint {self._get_inpoint(video, start - video.get_timestamp()):.3f}')
+
+            if i == len(videos) - 1 and end < video.get_timestamp() + self._get_duration(video):
+                lines.append(f'outpoint {end - video.get_timestamp():.3f}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _generate_ffmpeg_command(self, concat_filepath:str, output:str):
+        INPUT_ARGS = ['-f', 'concat', '-safe', '0', '-i', concat_filepath]
+        CODEC_ARGS = ['-c', 'copy']
+        # A pipe cannot be seeked back into to write the index, so fragment it instead
+        PIPE_ARGS = ['-movflags', '+frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', 'pipe:1']
+        FILE_ARGS = ['-f', 'mp4', '-y', output]
+
+        cmd = ['ffmpeg', '-loglevel', 'error']
+
+        for arg_list in [ INPUT_ARGS, CODEC_ARGS, PIPE_ARGS if output == self.STDOUT else FILE_ARGS ]:
+            for arg in arg_list:
+                cmd.append(arg)
+
+        return cmd
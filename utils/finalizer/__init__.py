@@ -0,0 +1,3 @@
+from .finalizer import Finalizer
+
+__all__ = [ 'Finalizer' ]
\ No newline at end of file
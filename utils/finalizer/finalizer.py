@@ -0,0 +1,200 @@
+import threading, time
+from collections import deque
+
+from ..logger import Logger
+from ..metrics import Registry
+from ..scheduling import SchedulingClass, Throttle
+
+_METRICS = Registry.get_default()
+_QUEUED = _METRICS.gauge('nvr_finalizer_queued', 'Segments waiting for a finalizer worker')
+_RUNNING = _METRICS.gauge('nvr_finalizer_running', 'Segments being finalized right now')
+_MONITOR_QUEUED = _METRICS.gauge('nvr_finalizer_monitor_queued', 'Segments of one monitor waiting for a finalizer worker', [ 'monitor' ])
+_DISK_RUNNING = _METRICS.gauge('nvr_finalizer_disk_running', 'Segments being finalized right now from one disk', [ 'disk' ])
+_OLDEST_WAIT = _METRICS.gauge('nvr_finalizer_oldest_wait_seconds', 'Time the longest waiting segment has been queued')
+_WAIT_SECONDS = _METRICS.histogram('nvr_finalizer_wait_seconds', 'Time a segment waited in the finalizer queue')
+_FAILED = _METRICS.counter('nvr_finalizer_failed_total', 'Finalizer jobs that failed')
+
+class Finalizer:
+    _BACKLOG_WARNING = 100
+
+    def __init__(self, logger:Logger, max_workers:int=4, max_per_disk:int=2, scheduling_class:SchedulingClass|None=None, throttle:Throttle|None=None):
+        self._logger = logger
+        self._max_workers = max_workers
+        self._max_per_disk = max_per_disk
+
+        # Applied to the workers, the remuxes and probes they run inherit it, so live recording keeps the disk first
+        self._scheduling_class = scheduling_class
+        self._is_scheduling_warned = False
+
+        # Bytes per second of segments finalized across all workers, None for no limit
+        self._throttle = throttle
+
+        self._condition = threading.Condition()
+        self._is_running = False
+        self._stop_event = threading.Event()
+        self._threads = []
+
+        # Per-monitor FIFO queues, served round robin so one busy camera cannot starve the rest
+        self._queues = {}
+        self._turns = deque()
+        self._pending = set()
+        self._active_per_disk = {}
+
+        self._running_jobs = 0
+        self._is_backlogged = False
+
+        _QUEUED.set_function(lambda: len(self._pending) - self._running_jobs)
+        _RUNNING.set_function(lambda: self._running_jobs)
+        _OLDEST_WAIT.set_function(self._get_oldest_wait_sec)
+
+    def is_running(self):
+        return self._is_running
+
+    def start(self):
+        with self._condition:
+            if self._is_running:
+                raise Exception(f'Finalizer is already running!')
+
+            self._is_running = True
+
+        self._stop_event.clear()
+        self._log_info(f'Starting {self._max_workers} finalizer workers{f" with scheduling class {self._scheduling_class}" if self._scheduling_class is not None else ""}...')
+
+        self._threads = [ threading.Thread(target=self._work, daemon=True) for _ in range(self._max_workers) ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._log_info('Stopping finalizer workers...')
+
+        with self._condition:
+            self._is_running = False
+            self._condition.notify_all()
+
+        # Workers waiting on the throttle give up their segment, it stays in temp until the next start
+        self._stop_event.set()
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+
+        self._log_info('Finalizer workers stopped!')
+
+    def submit(self, monitor:str, key:str, disk:int, job, size:int=0):
+        with self._condition:
+            # Already queued or in progress
+            if key in self._pending:
+                return False
+
+            if monitor not in self._queues:
+                self._queues[monitor] = deque()
+                _MONITOR_QUEUED.set_function(lambda queue=self._queues[monitor]: len(queue), monitor=monitor)
+
+            if len(self._queues[monitor]) == 0:
+                self._turns.append(monitor)
+
+            self._queues[monitor].append((key, disk, job, size, time.monotonic()))
+            self._pending.add(key)
+
+            self._check_backlog()
+            self._condition.notify()
+
+        return True
+
+    def _log_info(self, message):
+        self._logger.log_info(f'Finalizer: {message}')
+
+    def _log_warning(self, message):
+        self._logger.log_warning(f'Finalizer: {message}')
+
+    def _get_oldest_wait_sec(self):
+        with self._condition:
+            now = time.monotonic()
+            return max([ now - queue[0][4] for queue in self._queues.values() if len(queue) > 0 ], default=0.0)
+
+    def _check_backlog(self):
+        queued = len(self._pending) - self._running_jobs
+
+        if queued >= self._BACKLOG_WARNING and not self._is_backlogged:
+            self._is_backlogged = True
+            self._log_warning(f'{queued} segments waiting to be finalized, workers cannot keep up!')
+        elif queued < self._BACKLOG_WARNING // 2 and self._is_backlogged:
+            self._is_backlogged = False
+            self._log_info(f'Finalization backlog cleared')
+
+    def _take_job(self):
+        # Next monitor in turn whose disk has a free slot
+        for _ in range(len(self._turns)):
+            monitor = self._turns.popleft()
+            queue = self._queues[monitor]
+            (key, disk, job, size, submitted) = queue[0]
+
+            if self._active_per_disk.get(disk, 0) >= self._max_per_disk:
+                self._turns.append(monitor)
+                continue
+
+            queue.popleft()
+            if len(queue) > 0:
+                self._turns.append(monitor)
+
+            return (key, disk, job, size, submitted)
+
+        return None
+
+    def _work(self):
+        if self._scheduling_class is not None:
+            try:
+                self._scheduling_class.apply()
+            except Exception as e:
+                # Every worker fails the same way, once is enough
+                with self._condition:
+                    warn = not self._is_scheduling_warned
+                    self._is_scheduling_warned = True
+
+                if warn:
+                    self._log_warning(f'{e}')
+
+        while True:
+            with self._condition:
+                taken = None
+                while self._is_running:
+                    taken = self._take_job()
+                    if taken is not None:
+                        break
+
+                    self._condition.wait()
+
+                if taken is None:
+                    return
+
+                (key, disk, job, size, submitted) = taken
+                if disk not in self._active_per_disk:
+                    _DISK_RUNNING.set_function(lambda disk=disk: self._active_per_disk[disk], disk=str(disk))
+
+                self._active_per_disk[disk] = self._active_per_disk.get(disk, 0) + 1
+                self._running_jobs += 1
+
+                _WAIT_SECONDS.observe(time.monotonic() - submitted)
+
+            try:
+                # Holds on to the disk slot while waiting, the throttle is there to leave that disk alone
+                if self._throttle is not None:
+                    self._throttle.acquire(size, stop_event=self._stop_event)
+
+                # Stopping while throttled, the segment stays in temp until the next start
+                if not self._stop_event.is_set():
+                    job()
+            except Exception as e:
+                self._log_warning(f'Job {key} failed: {e}')
+                _FAILED.inc()
+            finally:
+                with self._condition:
+                    self._active_per_disk[disk] -= 1
+                    self._running_jobs -= 1
+                    self._pending.discard(key)
+
+                    self._check_backlog()
+
+                    # A disk slot opened up, waiting workers may be able to proceed
+                    self._condition.notify_all()
\ No newline at end of file
@@ -0,0 +1,5 @@
+from .segment_index import SegmentIndex
+from .activity_index import ActivityIndex
+from .output_index import OutputIndex
+
+__all__ = [ 'SegmentIndex', 'ActivityIndex', 'OutputIndex' ]
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os, sqlite3, threading
+
+class ActivityIndex:
+    # Per second activity of a monitor, time indexed so searches never open a video
+    BUCKET_MS = 1000
+
+    def __init__(self, filepath:str, monitor:str|None=None):
+        self._filepath = filepath
+        self._monitor = monitor
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def get_filepath(self):
+        return self._filepath
+
+    def add(self, segment_start:int, interframe_bytes:list[int]):
+        # One row per second of the segment, replaced if the segment is finalized again
+        rows = [ ((segment_start + i) * self.BUCKET_MS, size, segment_start) for (i, size) in enumerate(interframe_bytes) ]
+
+        with self._lock:
+            connection = self._connect()
+
+            with connection:
+                connection.execute('BEGIN')
+                connection.executemany('INSERT OR REPLACE INTO activity (start_ms, bytes, segment) VALUES (?, ?, ?)', rows)
+
+    def remove_before(self, timestamp:float):
+        # Activity of footage that retention already deleted, a range scan on the primary key
+        with self._lock:
+            self._connect().execute('DELETE FROM activity WHERE start_ms < ?', (int(timestamp * 1000),))
+
+    def get_activity(self, start_ms:int, end_ms:int):
+        # (start ms, bytes, segment start) of every second in [start, end), oldest first
+        with self._lock:
+            return self._connect().execute(
+                'SELECT start_ms, bytes, segment FROM activity WHERE start_ms >= ? AND start_ms < ? ORDER BY start_ms',
+                (start_ms - start_ms % self.BUCKET_MS, end_ms)
+            ).fetchall()
+
+    def get_active_ranges(self, start_ms:int, end_ms:int, sensitivity:float=4, min_gap_ms:int=5000):
+        # Stretches of [start, end) busier than the window's typical second, as (start ms, end ms, segment starts).
+        # Most of any long window is a static scene, so its median is the baseline that motion stands out from
+        rows = self.get_activity(start_ms, end_ms)
+        if len(rows) == 0:
+            return []
+
+        sizes = sorted(size for (bucket_ms, size, segment) in rows)
+        threshold = max(sizes[len(sizes) // 2], 1) * sensitivity
+
+        ranges = []
+        for (bucket_ms, size, segment) in rows:
+            if size < threshold:
+                continue
+
+            # Close enough to the previous range to be the same event
+            if len(ranges) > 0 and bucket_ms - ranges[-1][1] <= min_gap_ms:
+                ranges[-1][1] = bucket_ms + self.BUCKET_MS
+                if segment not in ranges[-1][2]:
+                    ranges[-1][2].append(segment)
+            else:
+                ranges.append([ bucket_ms, bucket_ms + self.BUCKET_MS, [ segment ] ])
+
+        return [ (max(range_start, start_ms), min(range_end, end_ms), segments) for (range_start, range_end, segments) in ranges ]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self._filepath), exist_ok=True)
+
+            # Autocommit, transactions are opened explicitly where batching matters
+            connection = sqlite3.connect(self._filepath, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS activity (start_ms INTEGER PRIMARY KEY, bytes INTEGER NOT NULL, segment INTEGER NOT NULL) WITHOUT ROWID')
+
+            self._connection = connection
+
+        return self._connection
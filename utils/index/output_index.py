@@ -0,0 +1,112 @@
+import os, heapq, threading
+
+from ..video import Video
+
+class OutputIndex:
+    # Files of one extra output, kept in memory. FFmpeg writes these straight into their directory with no finalize
+    # step to hook, so the directory is only listed again once its mtime changes and only files not seen before are
+    # stat'ed. Rebuilt from one listing after a restart
+    def __init__(self, dirpath:str, extension:str, monitor:str|None=None):
+        self._dirpath = dirpath
+        self._extension = extension
+        self._monitor = monitor
+        self._lock = threading.Lock()
+
+        # Ordered by date, FFmpeg names them after their start time
+        self._videos = []
+        self._filenames = set()
+        self._total_bytes = 0
+        self._dir_mtime_ns = None
+
+    def get_videos(self):
+        with self._lock:
+            self._refresh()
+            return list(self._videos)
+
+    def iter_videos(self):
+        return iter(self.get_videos())
+
+    def get_oldest_video(self):
+        with self._lock:
+            self._refresh()
+            return self._videos[0] if len(self._videos) > 0 else None
+
+    def get_total_size(self):
+        with self._lock:
+            self._refresh()
+            return self._total_bytes
+
+    def remove(self, video:Video):
+        self.remove_many([ video ])
+
+    def remove_many(self, videos:list[Video]):
+        with self._lock:
+            self._forget({ video.get_filename() for video in videos })
+
+    def _refresh(self):
+        try:
+            dir_mtime_ns = os.stat(self._dirpath).st_mtime_ns
+        except FileNotFoundError:
+            self._forget(set(self._filenames))
+            self._dir_mtime_ns = None
+            return
+
+        if dir_mtime_ns != self._dir_mtime_ns:
+            self._dir_mtime_ns = dir_mtime_ns
+
+            with os.scandir(self._dirpath) as entries:
+                filenames = { entry.name for entry in entries if entry.name.endswith(self._extension) and entry.name.split('.')[0].isdigit() }
+
+            self._forget(self._filenames - filenames)
+
+            # The newest file was still being written when last seen, it is complete once another one follows
+            added = filenames - self._filenames
+            if len(added) > 0 and len(self._videos) > 0:
+                self._restat(len(self._videos) - 1)
+
+            self._add(added)
+
+        # Sizes only change while FFmpeg is writing, which is only ever the newest file
+        if len(self._videos) > 0:
+            self._restat(len(self._videos) - 1)
+
+    def _add(self, filenames:set[str]):
+        videos = []
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(self._dirpath, filename))
+            except FileNotFoundError:
+                continue
+
+            videos.append(Video(os.path.join(self._dirpath, filename), index=self, size=stat.st_size, mtime=stat.st_mtime, monitor=self._monitor))
+            self._filenames.add(filename)
+            self._total_bytes += stat.st_size
+
+        videos.sort()
+
+        # New files are nearly always newer than everything known, so this is an append
+        if len(self._videos) == 0 or len(videos) == 0 or not videos[0] < self._videos[-1]:
+            self._videos.extend(videos)
+        else:
+            self._videos = list(heapq.merge(self._videos, videos))
+
+    def _restat(self, i:int):
+        video = self._videos[i]
+
+        try:
+            stat = os.stat(video.get_filepath())
+        except FileNotFoundError:
+            self._forget({ video.get_filename() })
+            return
+
+        if stat.st_size != video.get_size():
+            self._total_bytes += stat.st_size - video.get_size()
+            self._videos[i] = Video(video.get_filepath(), index=self, timestamp=video.get_timestamp(), size=stat.st_size, mtime=stat.st_mtime, monitor=self._monitor)
+
+    def _forget(self, filenames:set[str]):
+        if len(filenames & self._filenames) == 0:
+            return
+
+        self._total_bytes -= sum(video.get_size() for video in self._videos if video.get_filename() in filenames)
+        self._videos = [ video for video in self._videos if video.get_filename() not in filenames ]
+        self._filenames -= filenames
@@ -0,0 +1,219 @@
+import os, sqlite3, threading
+
+from ..video import Video, KeyframeSidecar
+
+class SegmentIndex:
+    def __init__(self, filepath:str, monitor:str|None=None):
+        self._filepath = filepath
+        self._monitor = monitor
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def get_filepath(self):
+        return self._filepath
+
+    def add(self, video:Video, duration:float|None=None):
+        with self._lock:
+            self._connect().execute(
+                'INSERT INTO segments (path, start, size, duration) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (path) DO UPDATE SET start = excluded.start, size = excluded.size, duration = excluded.duration',
+                (video.get_filepath(), video.get_timestamp(), video.get_size(), duration)
+            )
+
+    def remove(self, video:Video):
+        with self._lock:
+            self._connect().execute('DELETE FROM segments WHERE path = ?', (video.get_filepath(),))
+
+    def remove_many(self, videos:list[Video]):
+        with self._lock:
+            connection = self._connect()
+
+            with connection:
+                connection.execute('BEGIN')
+                connection.executemany('DELETE FROM segments WHERE path = ?', [ (video.get_filepath(),) for video in videos ])
+
+    def remove_dirpath(self, dirpath:str):
+        # Every segment under a directory, as a range scan on the primary key
+        with self._lock:
+            self._connect().execute('DELETE FROM segments WHERE path >= ? AND path < ?', self._get_prefix_range(dirpath))
+
+    def get_videos(self):
+        with self._lock:
+            rows = self._connect().execute('SELECT start, path, size, duration FROM segments ORDER BY start, path').fetchall()
+
+        return [ self._to_video(row) for row in rows ]
+
+    def iter_videos(self, batch_size:int=256):
+        # Oldest first, fetched lazily in pages so callers only pay for what they consume
+        last = (-1, '')
+        while True:
+            with self._lock:
+                rows = self._connect().execute(
+                    'SELECT start, path, size, duration FROM segments WHERE start > ? OR (start = ? AND path > ?) ORDER BY start, path LIMIT ?',
+                    (last[0], last[0], last[1], batch_size)
+                ).fetchall()
+
+            for row in rows:
+                yield self._to_video(row)
+
+            if len(rows) < batch_size:
+                return
+
+            last = rows[-1]
+
+    def get_videos_between(self, start:float, end:float, default_duration:float):
+        # Segments overlapping [start, end), oldest first, without reading the rest of the archive. The muxer cuts
+        # segments on time, so none starting more than twice the segment duration earlier can still overlap
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT start, path, size, duration FROM segments WHERE start > ? AND start < ? AND start + COALESCE(duration, ?) > ? ORDER BY start, path',
+                (start - 2 * default_duration, end, default_duration, start)
+            ).fetchall()
+
+        return [ self._to_video(row) for row in rows ]
+
+    def get_oldest_video(self):
+        with self._lock:
+            row = self._connect().execute('SELECT start, path, size, duration FROM segments ORDER BY start, path LIMIT 1').fetchone()
+
+        return self._to_video(row) if row is not None else None
+
+    def get_gaps(self, start:float, end:float, default_duration:float, min_gap_sec:float=0):
+        # Stretches of [start, end) with no recording, from segment starts and durations alone
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT start, start + COALESCE(duration, ?) FROM segments WHERE start < ? AND start + COALESCE(duration, ?) > ? ORDER BY start, path',
+                (default_duration, end, default_duration, start)
+            ).fetchall()
+
+        gaps = []
+        covered_until = start
+        for (segment_start, segment_end) in rows:
+            if segment_start - covered_until > min_gap_sec:
+                gaps.append((covered_until, segment_start))
+
+            covered_until = max(covered_until, segment_end)
+
+        if end - covered_until > min_gap_sec:
+            gaps.append((covered_until, end))
+
+        return gaps
+
+    def get_total_size(self):
+        # Running total kept up to date by triggers
+        with self._lock:
+            (total,) = self._connect().execute('SELECT size FROM totals').fetchone()
+
+        return total
+
+    def reconcile(self, video_dirpath:str, extension:str):
+        # Repair any drift between the index and the files. Segments are never modified in place, so a day
+        # directory whose mtime matches the one recorded last time still holds exactly what the index says
+        day_mtimes = {}
+        if os.path.isdir(video_dirpath):
+            with os.scandir(video_dirpath) as day_entries:
+                for day_entry in day_entries:
+                    if day_entry.is_dir():
+                        day_mtimes[day_entry.path] = day_entry.stat().st_mtime_ns
+
+        with self._lock:
+            known_mtimes = dict(self._connect().execute('SELECT path, mtime FROM days').fetchall())
+
+        changed_days = [ dirpath for dirpath, mtime in day_mtimes.items() if known_mtimes.get(dirpath) != mtime ]
+        removed_days = [ dirpath for dirpath in known_mtimes if dirpath not in day_mtimes ]
+
+        on_disk = {}
+        for dirpath in changed_days:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(extension):
+                        on_disk[entry.path] = entry.stat().st_size
+
+        with self._lock:
+            connection = self._connect()
+
+            if len(known_mtimes) == 0:
+                # Nothing verified yet, compare everything
+                indexed = dict(connection.execute('SELECT path, size FROM segments').fetchall())
+            else:
+                # Only rows under days that changed or disappeared
+                indexed = {}
+                for dirpath in changed_days + removed_days:
+                    indexed.update(connection.execute('SELECT path, size FROM segments WHERE path >= ? AND path < ?', self._get_prefix_range(dirpath)).fetchall())
+
+            stale = [ (path,) for path in indexed if path not in on_disk ]
+            missing = []
+            for path, size in on_disk.items():
+                if indexed.get(path) != size:
+                    missing.append((path, int(os.path.basename(path).split('.')[0]), size, self._read_sidecar_duration(path)))
+
+            with connection:
+                connection.execute('BEGIN')
+                connection.executemany('DELETE FROM segments WHERE path = ?', stale)
+                connection.executemany(
+                    'INSERT INTO segments (path, start, size, duration) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (path) DO UPDATE SET size = excluded.size, duration = COALESCE(excluded.duration, duration)',
+                    missing
+                )
+
+                # Remember what was verified, the next reconcile skips these days unless they change
+                connection.executemany('DELETE FROM days WHERE path = ?', [ (dirpath,) for dirpath in removed_days ])
+                connection.executemany(
+                    'INSERT INTO days (path, mtime) VALUES (?, ?) ON CONFLICT (path) DO UPDATE SET mtime = excluded.mtime',
+                    [ (dirpath, day_mtimes[dirpath]) for dirpath in changed_days ]
+                )
+
+        return (len(missing), len(stale))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _to_video(self, row):
+        (start, path, size, duration) = row
+
+        return Video(path, index=self, timestamp=start, size=size, monitor=self._monitor, duration=duration)
+
+    def _get_prefix_range(self, dirpath:str):
+        # Bounds of every path under a directory, for range scans on the primary key
+        prefix = os.path.join(dirpath, '')
+
+        return (prefix, prefix[:-1] + chr(ord(os.sep) + 1))
+
+    def _read_sidecar_duration(self, video_filepath:str):
+        try:
+            return KeyframeSidecar.read_duration(KeyframeSidecar.get_filepath(video_filepath))
+        except Exception:
+            # No sidecar yet, or an unreadable one
+            return None
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self._filepath), exist_ok=True)
+
+            # Autocommit, transactions are opened explicitly where batching matters
+            connection = sqlite3.connect(self._filepath, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS segments (path TEXT PRIMARY KEY, start INTEGER NOT NULL, size INTEGER NOT NULL, duration REAL);
+                CREATE INDEX IF NOT EXISTS segments_order ON segments (start, path);
+
+                CREATE TABLE IF NOT EXISTS days (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL);
+
+                CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL);
+                INSERT OR IGNORE INTO totals (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM segments;
+
+                CREATE TRIGGER IF NOT EXISTS segments_insert AFTER INSERT ON segments
+                BEGIN UPDATE totals SET size = size + NEW.size; END;
+                CREATE TRIGGER IF NOT EXISTS segments_delete AFTER DELETE ON segments
+                BEGIN UPDATE totals SET size = size - OLD.size; END;
+                CREATE TRIGGER IF NOT EXISTS segments_update AFTER UPDATE OF size ON segments
+                BEGIN UPDATE totals SET size = size + NEW.size - OLD.size; END;
+            ''')
+
+            self._connection = connection
+
+        return self._connection
\ No newline at end of file
@@ -1,5 +1,7 @@
 from .limit_manager import LimitManager
 from .recorder_limit_manager import RecorderLimitManager
 from .global_limit_manager import GlobalLimitManager
+from .disk_space_limit_manager import DiskSpaceLimitManager
+from .output_limit_manager import OutputLimitManager
 
-__all__ = [ 'LimitManager', 'RecorderLimitManager', 'GlobalLimitManager' ]
\ No newline at end of file
+__all__ = [ 'LimitManager', 'RecorderLimitManager', 'GlobalLimitManager', 'DiskSpaceLimitManager', 'OutputLimitManager' ]
\ No newline at end of file
@@ -0,0 +1,82 @@
+import os, heapq
+
+from ..logger import Logger
+from ..recorder import Recorder
+from ..video import Video
+from ..migrator import TierMigrator
+from ..scheduling import Throttle
+from ..limit_manager import LimitManager
+
+class DiskSpaceLimitManager(LimitManager):
+    def __init__(self, logger:Logger, recorders:list[Recorder], min_free_bytes:int, target_free_bytes:int, migrator:TierMigrator|None=None, unlink_throttle:Throttle|None=None):
+        super().__init__(logger, migrator=migrator, unlink_throttle=unlink_throttle)
+
+        self._recorders = recorders
+
+        # Start deleting below the low watermark, stop once back above the high one
+        self._min_free_bytes = min_free_bytes
+        self._target_free_bytes = max(target_free_bytes, min_free_bytes)
+
+    def get_name(self):
+        return 'free-space'
+
+    def get_monitors(self):
+        return set(recorder.get_name() for recorder in self._recorders)
+
+    def is_over_storage_limit(self):
+        return any(self._get_free_bytes(dirpath) < self._min_free_bytes for (dirpath, tiers) in self._get_mounts())
+
+    def _get_videos(self):
+        return list(self._iter_videos())
+
+    def _iter_videos(self):
+        return heapq.merge(*[ recorder.iter_videos() for recorder in self._recorders ], key=Video.get_timestamp)
+
+    def _can_migrate(self, video:Video):
+        # A move to a tier on the same mount frees nothing there, those videos are deleted instead
+        return super()._can_migrate(video) and self._migrator.is_cross_device(video)
+
+    def _check_storage_limit(self):
+        try:
+            # Each mount is handled on its own, deleting from one does not free another
+            for (dirpath, tiers) in self._get_mounts():
+                free_bytes = self._get_free_bytes(dirpath)
+                if free_bytes >= self._min_free_bytes:
+                    continue
+
+                videos = heapq.merge(*[ recorder.iter_videos(tier=tier) for (recorder, tier) in tiers ], key=Video.get_timestamp)
+                self._free_bytes(videos, self._target_free_bytes - free_bytes, f'free space on {dirpath} below watermark')
+        except Exception as e:
+            raise Exception(f'Failed to handle free space limit: {e}')
+
+    def _get_mounts(self):
+        # Group each recorder's storage tiers by the device they live on, one statvfs per device
+        mounts = {}
+        for recorder in self._recorders:
+            for tier in range(recorder.get_tier_count()):
+                dirpath = self._get_existing_dirpath(recorder.get_tier_storage_dirpath(tier))
+                device = os.stat(dirpath).st_dev
+
+                if device not in mounts:
+                    mounts[device] = (dirpath, [])
+
+                mounts[device][1].append((recorder, tier))
+
+        return list(mounts.values())
+
+    def _get_existing_dirpath(self, dirpath:str):
+        # Storage may not have been created yet, the closest existing parent is on the same mount
+        while not os.path.exists(dirpath):
+            parent = os.path.dirname(dirpath)
+            if parent == dirpath:
+                break
+
+            dirpath = parent
+
+        return dirpath
+
+    def _get_free_bytes(self, dirpath:str):
+        stat = os.statvfs(dirpath)
+
+        # Space available to unprivileged users, which is what FFmpeg runs as
+        return stat.f_bavail * stat.f_frsize
\ No newline at end of file
@@ -1,17 +1,37 @@
+import heapq
+
 from ..logger import Logger
 from ..recorder import Recorder
+from ..video import Video
+from ..migrator import TierMigrator
+from ..scheduling import Throttle
 from ..limit_manager import LimitManager
 
 class GlobalLimitManager(LimitManager):
-    def __init__(self, logger:Logger, recorders:list[Recorder], max_disk_bytes:int):
-        super().__init__(logger, max_disk_bytes=max_disk_bytes)
+    def __init__(self, logger:Logger, recorders:list[Recorder], max_disk_bytes:int|None, tier:int=0, max_age_sec:int|None=None, migrator:TierMigrator|None=None, unlink_throttle:Throttle|None=None):
+        super().__init__(logger, max_age_sec=max_age_sec, max_disk_bytes=max_disk_bytes, migrator=migrator, unlink_throttle=unlink_throttle)
 
-        self._recorders = recorders
+        # Every monitor's share of one storage tier, the recording tier by default
+        self._recorders = [ recorder for recorder in recorders if tier < recorder.get_tier_count() ]
+        self._tier = tier
     
+    def get_name(self):
+        return 'global' if self._tier == 0 else f'tier-{self._tier}'
+
+    def get_monitors(self):
+        return set(recorder.get_name() for recorder in self._recorders)
+
     def _get_videos(self):
-        unsorted_videos = []
-        for recorder in self._recorders:
-            for video in recorder.get_videos():
-                unsorted_videos.append(video)
+        return list(self._iter_videos())
+
+    def _iter_videos(self):
+        # Each recorder stream is already sorted, so a k-way merge yields the global order
+        return heapq.merge(*[ recorder.iter_videos(tier=self._tier) for recorder in self._recorders ], key=Video.get_timestamp)
+
+    def _get_oldest_video(self):
+        oldest = [ video for video in (recorder.get_oldest_video(tier=self._tier) for recorder in self._recorders) if video is not None ]
+
+        return min(oldest) if len(oldest) > 0 else None
 
-        return sorted(unsorted_videos)
\ No newline at end of file
+    def _get_total_bytes(self):
+        return sum(recorder.get_total_size(tier=self._tier) for recorder in self._recorders)
\ No newline at end of file
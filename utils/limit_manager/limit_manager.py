@@ -1,13 +1,37 @@
+import os, time, shutil, threading
+from datetime import datetime, timezone
+
 from ..logger import Logger
 from ..recorder import Recorder
+from ..video import Video
+from ..metrics import Registry
+from ..migrator import TierMigrator
+from ..scheduling import Throttle
+
+_METRICS = Registry.get_default()
+_RUN_SECONDS = _METRICS.histogram('nvr_limit_run_seconds', 'Duration of a limit check pass', [ 'checker' ])
+_DELETED_VIDEOS = _METRICS.counter('nvr_deleted_videos_total', 'Videos deleted by limit checks', [ 'monitor' ])
+_DELETED_BYTES = _METRICS.counter('nvr_deleted_bytes_total', 'Bytes deleted by limit checks', [ 'monitor' ])
 
 class LimitManager:
-    def __init__(self, logger:Logger, max_age_sec:int|None=None, max_disk_bytes:int|None=None):
+    # Max videos unlinked per batch, each batch gets one summary log line
+    _DELETE_BATCH_SIZE = 1000
+    def __init__(self, logger:Logger, max_age_sec:int|None=None, max_disk_bytes:int|None=None, migrator:TierMigrator|None=None, unlink_throttle:Throttle|None=None):
         self._logger = logger
         self._max_age_sec = max_age_sec
         self._max_disk_bytes = max_disk_bytes
 
+        # Moves videos to the next storage tier instead of deleting them, None to always delete
+        self._migrator = migrator
+
+        # Videos unlinked per second, shared by every limit checker so a catch up cannot flood the disk with
+        # metadata updates while FFmpeg is writing. None for no limit
+        self._unlink_throttle = unlink_throttle
+        self._stop_event = threading.Event()
+
     def run(self):
+        started = time.monotonic()
+
         try:
             # Check limits
             self._check_age_limit()
@@ -16,6 +40,38 @@ class LimitManager:
             message = f'Failed to check limits: {e}'
             self._log_error(message)
             raise Exception(message)
+        finally:
+            _RUN_SECONDS.observe(time.monotonic() - started, checker=self.get_name())
+
+    def get_name(self):
+        return type(self).__name__
+
+    def request_stop(self):
+        # Cuts a throttled pass short, from any thread. What was deleted so far is still removed from the indexes
+        self._stop_event.set()
+
+    def get_monitors(self):
+        raise Exception(f'LimitManager interface get_monitors needs an override!')
+
+    def is_over_storage_limit(self):
+        return self._max_disk_bytes is not None and self._get_total_bytes() > self._max_disk_bytes
+
+    def get_next_expiry(self):
+        # Unix time at which the oldest video goes over the age limit
+        if self._max_age_sec is None:
+            return None
+
+        oldest = self._get_oldest_video()
+
+        # Videos already waiting on a backlogged migrator expired long ago, counting them would wake the
+        # supervisor every second to queue them again. It hears from the migrator once they have moved
+        if oldest is not None and self._is_migrating(oldest):
+            oldest = next((video for video in self._iter_videos() if not self._is_migrating(video)), None)
+
+        if oldest is None:
+            return None
+
+        return oldest.get_timestamp() + self._max_age_sec
 
     def _log_info(self, message):
         self._logger.log_info(message)
@@ -29,62 +85,230 @@ class LimitManager:
     def _get_videos(self):
         raise Exception(f'LimitManager interface _get_videos needs an override!')
 
+    def _iter_videos(self):
+        # Oldest first, override when the videos can be streamed lazily
+        return iter(self._get_videos())
+
+    def _get_oldest_video(self):
+        return next(self._iter_videos(), None)
+
+    def _get_total_bytes(self):
+        return sum(video.get_size() for video in self._get_videos())
+
     def _check_storage_limit(self):
         if self._max_disk_bytes is None:
             return
 
         try:
-            # Calculate total size
-            videos = self._get_videos()
-            total_bytes = sum(video.get_size() for video in videos)
-
             # Calculate how many bytes to free up
-            bytes_over_limit = total_bytes - self._max_disk_bytes
+            bytes_over_limit = self._get_total_bytes() - self._max_disk_bytes
+            if bytes_over_limit <= 0:
+                return
 
-            # Delete videos until below limit
-            while bytes_over_limit > 0:
-                # If no videos to delete, then something is very wrong
-                if len(videos) == 0:
-                    raise Exception(f'Above disk limit, but no videos to delete!')
+            self._free_bytes(self._iter_videos(), bytes_over_limit, 'above disk limit')
+        except Exception as e:
+            raise Exception(f'Failed to handle disk limit: {e}')
 
-                # Get oldest video from list
-                oldest = videos.pop(0)
+    def _free_bytes(self, videos, bytes_to_free:int, reason:str):
+        # Delete the oldest videos until enough bytes are freed, only pulling as many as needed
+        while bytes_to_free > 0 and not self._stop_event.is_set():
+            batch = []
+            batch_bytes = 0
 
-                try:
-                    self._log_info(f'Deleting {oldest.get_filename()}, above disk limit!')
+            # Sizes come from the index, so picking the batch costs no syscalls
+            while batch_bytes < bytes_to_free and len(batch) < self._DELETE_BATCH_SIZE:
+                oldest = next(videos, None)
+                if oldest is None:
+                    break
 
-                    # Get its size
-                    size = oldest.get_size()
+                batch.append(oldest)
+                batch_bytes += oldest.get_size()
 
-                    # Delete video and update disk usage
-                    oldest.delete()
-                    bytes_over_limit -= size
-                except Exception as e:
-                    self._log_warning(f'Failed to delete {oldest.get_filename()}: {e}')
-        except Exception as e:
-            raise Exception(f'Failed to handle disk limit: {e}')
+            # If no videos to delete, then something is very wrong
+            if len(batch) == 0:
+                raise Exception(f'Still {bytes_to_free} bytes to free ({reason}), but no videos to delete!')
+
+            bytes_to_free -= self._delete_videos(batch, reason)
 
     def _check_age_limit(self):
         if self._max_age_sec is None:
             return
 
         try:
-            # Get list of all videos
-            videos = self._get_videos()
+            cutoff = time.time() - self._max_age_sec
+            reason = 'video is too old'
+
+            batches = {}
+            dropped_days = {}
+
+            # Oldest first, so iteration stops at the first video young enough
+            for video in self._iter_videos():
+                if video.get_timestamp() >= cutoff or self._stop_event.is_set():
+                    break
+
+                dirpath = video.get_dirpath()
+
+                # Whole day is past the limit, it goes in one rmtree instead of file by file. Not when unlinks
+                # are throttled though, an rmtree cannot be paced
+                if self._unlink_throttle is None and self._is_day_expired(dirpath, cutoff) and not self._can_migrate(video):
+                    (first, count, size) = dropped_days.get(dirpath, (video, 0, 0))
+                    dropped_days[dirpath] = (first, count + 1, size + video.get_size())
+                    continue
+
+                if dirpath not in batches:
+                    batches[dirpath] = []
+
+                batches[dirpath].append(video)
+
+                if len(batches[dirpath]) >= self._DELETE_BATCH_SIZE:
+                    self._evict_batch(dirpath, batches.pop(dirpath), reason)
+
+            for dirpath, (first, count, size) in dropped_days.items():
+                self._delete_day(dirpath, first, count, size, reason)
+
+            for dirpath, batch in batches.items():
+                self._evict_batch(dirpath, batch, reason)
+        except Exception as e:
+            raise Exception(f'Failed to age limit: {e}')
+
+    def _is_day_expired(self, dirpath:str, cutoff:float):
+        try:
+            day_start = datetime.fromisoformat(os.path.basename(dirpath)).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            # Not a day directory, never drop it wholesale
+            return False
 
+        return day_start + 86400 <= cutoff
+
+    def _delete_videos(self, videos:list[Video], reason:str):
+        # Batch per directory, returns the number of bytes freed
+        batches = {}
+        for video in videos:
+            dirpath = video.get_dirpath()
+
+            if dirpath not in batches:
+                batches[dirpath] = []
+
+            batches[dirpath].append(video)
+
+        return sum(self._evict_batch(dirpath, batch, reason) for dirpath, batch in batches.items())
+
+    def _is_migrating(self, video:Video):
+        return self._migrator is not None and self._migrator.is_pending(video)
+
+    def _can_migrate(self, video:Video):
+        return self._migrator is not None and self._migrator.can_migrate(video)
+
+    def _evict_batch(self, dirpath:str, videos:list[Video], reason:str):
+        # A directory only ever holds one tier of one monitor, so the whole batch goes the same way
+        if self._can_migrate(videos[0]):
+            return self._migrator.submit(videos, reason)
+
+        return self._delete_batch(dirpath, videos, reason)
+
+    def _delete_batch(self, dirpath:str, videos:list[Video], reason:str):
+        if self._stop_event.is_set():
+            return 0
+
+        deleted = []
+        errors = []
+
+        # Unlink relative to one open directory fd instead of resolving every full path
+        try:
+            dir_fd = os.open(dirpath, os.O_RDONLY | os.O_DIRECTORY)
+        except FileNotFoundError:
+            # Directory removed behind our back, its videos are gone but their rows are not
+            dir_fd = None
+
+        try:
             for video in videos:
+                # Nothing to unlink, so nothing to throttle either
+                if dir_fd is None:
+                    deleted.append(video)
+                    continue
+
+                if self._unlink_throttle is not None:
+                    self._unlink_throttle.acquire(1, stop_event=self._stop_event)
+
+                if self._stop_event.is_set():
+                    break
+
                 try:
-                    # Get age
-                    age_sec = video.get_age_seconds()
-
-                    if age_sec > self._max_age_sec:
-                        # If video is too old, delete it
-                        self._log_info(f'Deleting {video.get_filename()}, video is too old!')
-                        video.delete()
-                    else:
-                        # If not, stop checking. Further videos are even younger
-                        break
+                    os.unlink(video.get_filename(), dir_fd=dir_fd)
+                    deleted.append(video)
+                except FileNotFoundError:
+                    # Already gone, still drop it from the index
+                    deleted.append(video)
                 except Exception as e:
-                    self._log_warning(f'Failed to delete {video.get_filename()}: {e}')
+                    errors.append(f'{video.get_filename()}: {e}')
+                    continue
+
+                self._unlink_sidecar(video, dir_fd)
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+
+        self._remove_from_indexes(deleted)
+        self._remove_dir_if_empty(dirpath)
+
+        freed = sum(video.get_size() for video in deleted)
+        self._log_info(f'Deleted {len(deleted)} videos ({freed} bytes) from {dirpath}, {reason}!')
+
+        # A directory only ever holds one monitor's videos
+        if len(deleted) > 0 and deleted[0].get_monitor() is not None:
+            _DELETED_VIDEOS.inc(len(deleted), monitor=deleted[0].get_monitor())
+            _DELETED_BYTES.inc(freed, monitor=deleted[0].get_monitor())
+
+        if len(errors) > 0:
+            self._log_warning(f'Failed to delete {len(errors)} videos from {dirpath}: {"; ".join(errors[:5])}')
+
+        return freed
+
+    def _unlink_sidecar(self, video:Video, dir_fd:int):
+        try:
+            os.unlink(os.path.basename(video.get_sidecar_filepath()), dir_fd=dir_fd)
+        except OSError:
+            # Missing or not, the video itself is gone
+            pass
+
+    def _delete_day(self, dirpath:str, first:Video, count:int, size:int, reason:str):
+        try:
+            shutil.rmtree(dirpath)
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            raise Exception(f'Failed to age limit: {e}')
\ No newline at end of file
+            self._log_warning(f'Failed to drop {dirpath}: {e}')
+            return 0
+
+        if first.get_index() is not None:
+            first.get_index().remove_dirpath(dirpath)
+
+        self._log_info(f'Dropped {dirpath} with {count} videos ({size} bytes), {reason}!')
+
+        if first.get_monitor() is not None:
+            _DELETED_VIDEOS.inc(count, monitor=first.get_monitor())
+            _DELETED_BYTES.inc(size, monitor=first.get_monitor())
+
+        return size
+
+    def _remove_from_indexes(self, videos:list[Video]):
+        by_index = {}
+        for video in videos:
+            index = video.get_index()
+            if index is None:
+                continue
+
+            if id(index) not in by_index:
+                by_index[id(index)] = (index, [])
+
+            by_index[id(index)][1].append(video)
+
+        for (index, index_videos) in by_index.values():
+            index.remove_many(index_videos)
+
+    def _remove_dir_if_empty(self, dirpath:str):
+        try:
+            os.rmdir(dirpath)
+        except OSError:
+            # Not empty, or already gone
+            pass
\ No newline at end of file
@@ -0,0 +1,32 @@
+from ..logger import Logger
+from ..recorder import Recorder, RecorderOutput
+from ..scheduling import Throttle
+from ..limit_manager import LimitManager
+
+class OutputLimitManager(LimitManager):
+    def __init__(self, logger:Logger, recorder:Recorder, output:RecorderOutput, unlink_throttle:Throttle|None=None):
+        super().__init__(logger, max_age_sec=output.get_max_age_sec(), max_disk_bytes=output.get_max_disk_bytes(), unlink_throttle=unlink_throttle)
+
+        self._recorder = recorder
+        self._output = output
+
+    def get_name(self):
+        return f'{self._recorder.get_name()}/{self._output.get_name()}'
+
+    def get_monitors(self):
+        # Outputs grow alongside the main segments, so checking on those is often enough
+        return { self._recorder.get_name() }
+
+    def _get_videos(self):
+        # No monitor on these, deletion metrics only count recordings
+        return self._output.get_files()
+
+    def _get_total_bytes(self):
+        return self._output.get_total_size()
+
+    def _get_oldest_video(self):
+        return self._output.get_oldest_file()
+
+    def _remove_dir_if_empty(self, dirpath:str):
+        # FFmpeg keeps writing into the output directory, it has to stay
+        pass
@@ -1,12 +1,32 @@
 from ..logger import Logger
 from ..recorder import Recorder
+from ..migrator import TierMigrator
+from ..scheduling import Throttle
 from ..limit_manager import LimitManager
 
 class RecorderLimitManager(LimitManager):
-    def __init__(self, logger:Logger, recorder:Recorder, max_age_sec:int|None=None, max_disk_bytes:int|None=None):
-        super().__init__(logger, max_age_sec=max_age_sec, max_disk_bytes=max_disk_bytes)
+    # Limits apply to the recording tier, older tiers have their own
+    _TIER = 0
+
+    def __init__(self, logger:Logger, recorder:Recorder, max_age_sec:int|None=None, max_disk_bytes:int|None=None, migrator:TierMigrator|None=None, unlink_throttle:Throttle|None=None):
+        super().__init__(logger, max_age_sec=max_age_sec, max_disk_bytes=max_disk_bytes, migrator=migrator, unlink_throttle=unlink_throttle)
 
         self._recorder = recorder
     
+    def get_name(self):
+        return self._recorder.get_name()
+
+    def get_monitors(self):
+        return { self._recorder.get_name() }
+
     def _get_videos(self):
-        return self._recorder.get_videos()
\ No newline at end of file
+        return self._recorder.get_videos(tier=self._TIER)
+
+    def _iter_videos(self):
+        return self._recorder.iter_videos(tier=self._TIER)
+
+    def _get_total_bytes(self):
+        return self._recorder.get_total_size(tier=self._TIER)
+
+    def _get_oldest_video(self):
+        return self._recorder.get_oldest_video(tier=self._TIER)
\ No newline at end of file
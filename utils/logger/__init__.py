@@ -1,3 +1,4 @@
 from .logger import Logger
+from .log_writer import LogWriter
 
-__all__ = [ 'Logger' ]
\ No newline at end of file
+__all__ = [ 'Logger', 'LogWriter' ]
\ No newline at end of file
@@ -0,0 +1,247 @@
+import os, sys, time, queue, atexit, threading
+from datetime import datetime
+
+class _LogFile:
+    def __init__(self, filepath:str):
+        self.filepath = filepath
+        self.handle = None
+        self.size = 0
+        self.opened_at = 0.0
+
+        # Consecutive duplicate suppression
+        self.last_message = None
+        self.repeated = 0
+
+        # Per-second rate limiting
+        self.window_start = 0.0
+        self.window_count = 0
+        self.dropped = 0
+
+class LogWriter:
+    _default = None
+    _default_lock = threading.Lock()
+
+    _BATCH_SIZE = 512
+
+    # Never deduplicated or rate limited, throttling is for chatty INFO lines like FFmpeg's stderr
+    _UNTHROTTLED_PREFIXES = ( 'ERROR: ', 'WARNING: ' )
+
+    _OPTIONS = [ 'console', 'max_bytes', 'backups', 'rotate_interval_sec', 'flush_interval_sec', 'rate_limit_per_sec' ]
+
+    @classmethod
+    def get_default(cls):
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = LogWriter()
+
+            return cls._default
+
+    def __init__(self, console:bool=True, max_bytes:int|None=None, backups:int=5, rotate_interval_sec:float|None=None, flush_interval_sec:float=1.0, rate_limit_per_sec:int|None=None):
+        self.configure(console=console, max_bytes=max_bytes, backups=backups, rotate_interval_sec=rotate_interval_sec, flush_interval_sec=flush_interval_sec, rate_limit_per_sec=rate_limit_per_sec)
+
+        self._queue = queue.SimpleQueue()
+        self._files = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+        atexit.register(self.close)
+
+    def configure(self, **options):
+        # Only the options given change, the rest keep their current values
+        for name, value in options.items():
+            if name not in self._OPTIONS:
+                raise Exception(f'Unknown log option {name}!')
+
+            setattr(self, f'_{name}', value)
+
+    def write(self, logfile:str, message:str):
+        # Only a queue put on the caller's thread, everything else happens on the writer thread
+        if self._thread is None:
+            self._start()
+
+        self._queue.put((logfile, time.time(), message))
+
+    def flush(self):
+        if self._thread is None:
+            return
+
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+
+            self._queue.put(None)
+            thread.join()
+            self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        is_closing = False
+
+        while not is_closing:
+            try:
+                items = [ self._queue.get(timeout=self._flush_interval_sec) ]
+            except queue.Empty:
+                items = []
+
+            # Drain whatever else is already waiting so it goes out in one write
+            while len(items) < self._BATCH_SIZE:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = {}
+            flush_events = []
+            for item in items:
+                if item is None:
+                    is_closing = True
+                elif isinstance(item, threading.Event):
+                    flush_events.append(item)
+                else:
+                    self._handle(lines, *item)
+
+            should_flush = is_closing or len(flush_events) > 0 or time.monotonic() - last_flush >= self._flush_interval_sec
+            if should_flush:
+                self._flush_repeats(lines)
+
+            self._write(lines, should_flush)
+
+            if should_flush:
+                last_flush = time.monotonic()
+
+            for event in flush_events:
+                event.set()
+
+        for log_file in self._files.values():
+            if log_file.handle is not None:
+                log_file.handle.close()
+
+        self._files = {}
+
+    def _handle(self, lines:dict, logfile:str, timestamp:float, message:str):
+        log_file = self._files.get(logfile)
+        if log_file is None:
+            log_file = self._files[logfile] = _LogFile(logfile)
+
+        if message.startswith(self._UNTHROTTLED_PREFIXES):
+            # Whatever was held back comes first, so the file stays in order
+            self._flush_repeat(lines, log_file, timestamp)
+            log_file.last_message = None
+
+            self._append(lines, log_file, timestamp, message)
+            return
+
+        if message == log_file.last_message:
+            log_file.repeated += 1
+            return
+
+        if self._rate_limit_per_sec is not None:
+            if timestamp - log_file.window_start >= 1:
+                self._flush_dropped(lines, log_file, timestamp)
+
+                log_file.window_start = timestamp
+                log_file.window_count = 0
+
+            log_file.window_count += 1
+            if log_file.window_count > self._rate_limit_per_sec:
+                log_file.dropped += 1
+                return
+
+        self._flush_repeat(lines, log_file, timestamp)
+        log_file.last_message = message
+
+        self._append(lines, log_file, timestamp, message)
+
+    def _flush_repeats(self, lines:dict):
+        now = time.time()
+        for log_file in self._files.values():
+            self._flush_repeat(lines, log_file, now)
+
+            if now - log_file.window_start >= 1:
+                self._flush_dropped(lines, log_file, now)
+
+    def _flush_dropped(self, lines:dict, log_file:_LogFile, timestamp:float):
+        if log_file.dropped > 0:
+            self._append(lines, log_file, timestamp, f'WARNING: Suppressed {log_file.dropped} messages over rate limit')
+            log_file.dropped = 0
+
+    def _flush_repeat(self, lines:dict, log_file:_LogFile, timestamp:float):
+        if log_file.repeated > 0:
+            self._append(lines, log_file, timestamp, f'INFO: Last message repeated {log_file.repeated} times')
+            log_file.repeated = 0
+
+    def _append(self, lines:dict, log_file:_LogFile, timestamp:float, message:str):
+        line = f'{datetime.fromtimestamp(timestamp).isoformat()} - {message}\n'
+
+        if log_file.filepath not in lines:
+            lines[log_file.filepath] = []
+
+        lines[log_file.filepath].append(line)
+
+    def _write(self, lines:dict, should_flush:bool):
+        for filepath, file_lines in lines.items():
+            try:
+                log_file = self._files[filepath]
+                data = ''.join(file_lines)
+
+                if self._console:
+                    sys.stdout.write(data)
+
+                self._rotate_if_needed(log_file)
+                handle = self._open(log_file)
+                handle.write(data)
+                log_file.size += len(data.encode('utf-8'))
+            except Exception as e:
+                sys.stderr.write(f'Failed to write log {filepath}: {e}\n')
+
+        for log_file in self._files.values():
+            if log_file.handle is not None and should_flush:
+                log_file.handle.flush()
+
+        if self._console and len(lines) > 0:
+            sys.stdout.flush()
+
+    def _open(self, log_file:_LogFile):
+        if log_file.handle is None:
+            os.makedirs(os.path.dirname(log_file.filepath), exist_ok=True)
+
+            log_file.handle = open(log_file.filepath, 'a', encoding='utf-8')
+            log_file.size = log_file.handle.tell()
+            log_file.opened_at = time.time()
+
+        return log_file.handle
+
+    def _rotate_if_needed(self, log_file:_LogFile):
+        if log_file.handle is None:
+            return
+
+        too_big = self._max_bytes is not None and log_file.size >= self._max_bytes
+        too_old = self._rotate_interval_sec is not None and time.time() - log_file.opened_at >= self._rotate_interval_sec
+        if not too_big and not too_old:
+            return
+
+        log_file.handle.close()
+        log_file.handle = None
+
+        # logfile -> logfile.1 -> ... -> logfile.N, oldest falls off the end
+        for i in range(self._backups - 1, 0, -1):
+            source = f'{log_file.filepath}.{i}'
+            if os.path.exists(source):
+                os.replace(source, f'{log_file.filepath}.{i + 1}')
+
+        if self._backups > 0:
+            os.replace(log_file.filepath, f'{log_file.filepath}.1')
+        else:
+            os.remove(log_file.filepath)
\ No newline at end of file
@@ -1,21 +1,14 @@
-import os
-from datetime import datetime
+from .log_writer import LogWriter
 
 class Logger:
-    def __init__(self, logfile):
+    def __init__(self, logfile, writer:LogWriter|None=None):
         self._logfile = logfile
-        self._created = False
+        self._writer = writer
 
     def _log(self, message):
-        message = f'{datetime.now().isoformat()} - {message}'
-        print(message)
-
-        if not self._created:
-            os.makedirs(os.path.dirname(self._logfile), exist_ok=True)
-            self._created = True
-
-        with open(self._logfile, 'a') as f:
-            f.write(message + '\n')
+        # Queued, the writer thread timestamps, echoes and writes it
+        writer = self._writer if self._writer is not None else LogWriter.get_default()
+        writer.write(self._logfile, message)
 
     def log_info(self, message):
         self._log(f'INFO: {message}')
@@ -0,0 +1,4 @@
+from .metrics import Registry, Counter, Gauge, Histogram
+from .metrics_server import MetricsServer
+
+__all__ = [ 'Registry', 'Counter', 'Gauge', 'Histogram', 'MetricsServer' ]
\ No newline at end of file
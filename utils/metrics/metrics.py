@@ -0,0 +1,266 @@
+import math, threading
+
+class _Metric:
+    _TYPE = None
+
+    def __init__(self, name:str, description:str, labelnames:list[str]|None=None):
+        self._name = name
+        self._description = description
+        self._labelnames = tuple(labelnames) if labelnames is not None else ()
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def get_name(self):
+        return self._name
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def collect(self):
+        lines = [
+            f'# HELP {self._name} {self._description}',
+            f'# TYPE {self._name} {self._TYPE}',
+        ]
+
+        with self._lock:
+            items = list(self._values.items())
+
+        for key, value in items:
+            lines.extend(self._collect_value(key, value))
+
+        return lines
+
+    def _collect_value(self, key:tuple, value):
+        return [ f'{self._name}{self._format_labels(key)} {self._format_number(self._read(value))}' ]
+
+    def _read(self, value):
+        return value
+
+    def _key(self, labels:dict):
+        if set(labels) != set(self._labelnames):
+            raise Exception(f'Metric {self._name} expects labels {list(self._labelnames)}, got {list(labels)}')
+
+        return tuple(str(labels[name]) for name in self._labelnames)
+
+    def _format_labels(self, key:tuple, extra:dict|None=None):
+        pairs = list(zip(self._labelnames, key))
+        if extra is not None:
+            pairs.extend(extra.items())
+
+        if len(pairs) == 0:
+            return ''
+
+        escaped = [ (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for (name, value) in pairs ]
+
+        return '{' + ','.join(f'{name}="{value}"' for (name, value) in escaped) + '}'
+
+    def _format_number(self, value:float):
+        if value == math.inf:
+            return '+Inf'
+
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter(_Metric):
+    _TYPE = 'counter'
+
+    def inc(self, value:float=1, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+class Gauge(_Metric):
+    _TYPE = 'gauge'
+
+    def set(self, value:float, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, value:float=1, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set_function(self, function, **labels):
+        # Evaluated at collection time, for values that are cheap to read but costly to push
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = function
+
+    def _read(self, value):
+        if callable(value):
+            try:
+                return value()
+            except Exception:
+                return math.nan
+
+        return value
+
+class Histogram(_Metric):
+    _TYPE = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, name:str, description:str, labelnames:list[str]|None=None, buckets:tuple=DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+
+        self._buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value:float, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [ [ 0 ] * len(self._buckets), 0.0, 0 ]
+
+            state = self._values[key]
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+
+            state[1] += value
+            state[2] += 1
+
+    def _collect_value(self, key:tuple, value):
+        with self._lock:
+            (counts, total, count) = (list(value[0]), value[1], value[2])
+
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self._buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{self._name}_bucket{self._format_labels(key, { "le": self._format_number(bound) })} {cumulative}')
+
+        lines.append(f'{self._name}_sum{self._format_labels(key)} {self._format_number(total)}')
+        lines.append(f'{self._name}_count{self._format_labels(key)} {count}')
+
+        return lines
+
+class Registry:
+    _default = None
+    _default_lock = threading.Lock()
+
+    @classmethod
+    def get_default(cls):
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = Registry()
+
+            return cls._default
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+        # Functions returning another process' collected text, as (function, extra labels)
+        self._remotes = []
+
+    def counter(self, name:str, description:str, labelnames:list[str]|None=None):
+        return self._register(Counter, name, description, labelnames)
+
+    def gauge(self, name:str, description:str, labelnames:list[str]|None=None):
+        return self._register(Gauge, name, description, labelnames)
+
+    def histogram(self, name:str, description:str, labelnames:list[str]|None=None, buckets:tuple=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram, name, description, labelnames, buckets=buckets)
+
+    def add_remote(self, function, **labels):
+        # Merged in at collection time with the extra labels, e.g. the metrics of a worker process
+        with self._lock:
+            self._remotes.append((function, labels))
+
+    def remove_remote(self, function):
+        with self._lock:
+            self._remotes = [ (remote, labels) for (remote, labels) in self._remotes if remote is not function ]
+
+    def collect(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            remotes = list(self._remotes)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+
+        if len(remotes) > 0:
+            lines = self._merge_remotes(lines, remotes)
+
+        return '\n'.join(lines) + '\n'
+
+    def _merge_remotes(self, lines:list[str], remotes:list):
+        # Families as name -> (header lines, local samples, remote samples), each family must stay in one block
+        families = {}
+        self._parse_text(lines, families, None)
+
+        for (function, labels) in remotes:
+            try:
+                text = function()
+            except Exception:
+                continue
+
+            if text:
+                self._parse_text(text.splitlines(), families, labels)
+
+        merged = []
+        for (headers, local_samples, remote_samples) in families.values():
+            # A sample reported by another process is its own, the local copy of it is stale or empty
+            remote_names = set(name for (name, labelled, value) in remote_samples)
+
+            merged.extend(headers)
+            merged.extend(f'{name} {value}' for (name, value) in local_samples if name not in remote_names)
+            merged.extend(f'{labelled} {value}' for (name, labelled, value) in remote_samples)
+
+        return merged
+
+    def _parse_text(self, lines:list[str], families:dict, labels:dict|None):
+        family = None
+        for line in lines:
+            if line.startswith('#'):
+                parts = line.split(' ', 3)
+                if len(parts) < 3:
+                    continue
+
+                family = families.setdefault(parts[2], ([], [], []))
+                if parts[1] in [ 'HELP', 'TYPE' ] and not any(header.startswith(f'# {parts[1]} ') for header in family[0]):
+                    family[0].append(line)
+
+                continue
+
+            if family is None or not line.strip():
+                continue
+
+            (name, value) = line.rsplit(' ', 1)
+            if labels is None:
+                family[1].append((name, value))
+            else:
+                family[2].append((name, self._add_labels(name, labels), value))
+
+    def _add_labels(self, name:str, labels:dict):
+        extra = ','.join(f'{label}="{value}"' for (label, value) in labels.items())
+
+        if name.endswith('}'):
+            return f'{name[:-1]},{extra}}}'
+
+        return f'{name}{{{extra}}}'
+
+    def _register(self, metric_class, name:str, description:str, labelnames:list[str]|None, **kwargs):
+        with self._lock:
+            # Same name hands back the existing metric, so modules can declare what they use
+            if name in self._metrics:
+                metric = self._metrics[name]
+
+                if not isinstance(metric, metric_class):
+                    raise Exception(f'Metric {name} is already registered as a {type(metric).__name__}!')
+
+                return metric
+
+            metric = metric_class(name, description, labelnames, **kwargs)
+            self._metrics[name] = metric
+
+            return metric
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from ..logger import Logger
+from .metrics import Registry
+
+class MetricsServer:
+    def __init__(self, logger:Logger, registry:Registry, host:str|None=None, port:int|None=None, textfile:str|None=None, textfile_interval_sec:float=15):
+        self._logger = logger
+        self._registry = registry
+        self._host = host
+        self._port = port
+        self._textfile = textfile
+        self._textfile_interval_sec = textfile_interval_sec
+
+        self._server = None
+        self._threads = []
+        self._stop_event = threading.Event()
+
+    def start(self):
+        self._stop_event.clear()
+
+        if self._port is not None:
+            try:
+                self._server = ThreadingHTTPServer((self._host or '127.0.0.1', self._port), self._create_handler())
+            except OSError as e:
+                # Metrics are not worth failing to record over, e.g. when another exporter has the port
+                self._log_warning(f'Failed to serve metrics on {self._host or "127.0.0.1"}:{self._port}, carrying on without: {e}')
+
+        if self._server is not None:
+            self._server.daemon_threads = True
+            self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+
+            self._log_info(f'Serving metrics on http://{self._host or "127.0.0.1"}:{self._port}/metrics')
+
+        if self._textfile is not None:
+            self._threads.append(threading.Thread(target=self._run_textfile_writer, daemon=True))
+
+            self._log_info(f'Writing metrics to {self._textfile} every {self._textfile_interval_sec} seconds')
+
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+
+    def _log_info(self, message):
+        self._logger.log_info(f'Metrics: {message}')
+
+    def _log_warning(self, message):
+        self._logger.log_warning(f'Metrics: {message}')
+
+    def _run_textfile_writer(self):
+        while not self._stop_event.is_set():
+            try:
+                self._write_textfile()
+            except Exception as e:
+                self._log_warning(f'Failed to write {self._textfile}: {e}')
+
+            self._stop_event.wait(self._textfile_interval_sec)
+
+    def _write_textfile(self):
+        os.makedirs(os.path.dirname(self._textfile), exist_ok=True)
+
+        # Write then rename so collectors never read a half written file
+        temp_path = f'{self._textfile}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self._registry.collect())
+
+        os.replace(temp_path, self._textfile)
+
+    def _create_handler(self):
+        registry = self._registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = registry.collect().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes are too frequent to be worth logging
+                pass
+
+        return Handler
\ No newline at end of file
@@ -0,0 +1,3 @@
+from .tier_migrator import TierMigrator
+
+__all__ = [ 'TierMigrator' ]
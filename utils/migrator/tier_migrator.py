@@ -0,0 +1,233 @@
+import os, threading
+from collections import deque
+
+from ..logger import Logger
+from ..recorder import Recorder
+from ..video import Video
+from ..metrics import Registry
+from ..scheduling import SchedulingClass, Throttle
+
+_METRICS = Registry.get_default()
+_QUEUED = _METRICS.gauge('nvr_migration_queued', 'Videos waiting to be moved to the next storage tier')
+_MIGRATED_VIDEOS = _METRICS.counter('nvr_migrated_videos_total', 'Videos moved to the next storage tier', [ 'monitor' ])
+_MIGRATED_BYTES = _METRICS.counter('nvr_migrated_bytes_total', 'Bytes moved to the next storage tier', [ 'monitor' ])
+_FAILED = _METRICS.counter('nvr_migration_failed_total', 'Videos that failed to move to the next storage tier')
+
+class TierMigrator:
+    _CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, logger:Logger, recorders:list[Recorder], rate_limit_bytes_per_sec:int|None=None, scheduling_class:SchedulingClass|None=None):
+        self._logger = logger
+        self._recorders = { recorder.get_name(): recorder for recorder in recorders }
+
+        # Copies between filesystems are throttled so recording and playback keep their disk bandwidth
+        self._throttle = Throttle('migration', rate_limit_bytes_per_sec) if rate_limit_bytes_per_sec is not None else None
+
+        # Applied to the worker thread, migration is background work just like retention
+        self._scheduling_class = scheduling_class
+
+        self._condition = threading.Condition()
+        self._is_running = False
+        self._thread = None
+
+        # One worker, oldest first, deduplicated by path
+        self._queue = deque()
+        self._pending = set()
+
+        # Called with each video once it is on its new tier, from the worker thread
+        self._migration_listeners = []
+
+        _QUEUED.set_function(lambda: len(self._pending))
+
+    def start(self):
+        with self._condition:
+            if self._is_running:
+                raise Exception(f'Migrator is already running!')
+
+            self._is_running = True
+
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._is_running = False
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def set_recorders(self, recorders:list[Recorder]):
+        # After a reload, queued videos of removed monitors fail and are counted as such
+        self._recorders = { recorder.get_name(): recorder for recorder in recorders }
+
+    def add_migration_listener(self, listener):
+        self._migration_listeners.append(listener)
+
+    def remove_migration_listener(self, listener):
+        if listener in self._migration_listeners:
+            self._migration_listeners.remove(listener)
+
+    def can_migrate(self, video:Video):
+        recorder = self._recorders.get(video.get_monitor())
+
+        return recorder is not None and recorder.get_next_tier(video) is not None
+
+    def is_cross_device(self, video:Video):
+        # Whether moving the video frees space on its own filesystem, a move within one is only a rename
+        (video_dirpath, index) = self._recorders[video.get_monitor()].get_next_tier(video)
+
+        # The next tier may not have been created yet, its closest existing parent is on the same filesystem
+        while not os.path.exists(video_dirpath) and os.path.dirname(video_dirpath) != video_dirpath:
+            video_dirpath = os.path.dirname(video_dirpath)
+
+        return os.stat(video.get_dirpath()).st_dev != os.stat(video_dirpath).st_dev
+
+    def is_pending(self, video:Video):
+        # Queued or being moved right now
+        with self._condition:
+            return video.get_filepath() in self._pending
+
+    def submit(self, videos:list[Video], reason:str):
+        # Returns the bytes that will be freed from the current tier, already queued videos included
+        queued = 0
+        with self._condition:
+            for video in videos:
+                if video.get_filepath() not in self._pending:
+                    self._pending.add(video.get_filepath())
+                    self._queue.append(video)
+                    queued += 1
+
+            self._condition.notify()
+
+        if queued > 0:
+            self._log_info(f'Queued {queued} videos to move to the next tier, {reason}')
+
+        return sum(video.get_size() for video in videos)
+
+    def _log_info(self, message):
+        self._logger.log_info(f'Migrator: {message}')
+
+    def _log_warning(self, message):
+        self._logger.log_warning(f'Migrator: {message}')
+
+    def _work(self):
+        if self._scheduling_class is not None:
+            try:
+                self._scheduling_class.apply()
+            except Exception as e:
+                self._log_warning(f'{e}')
+
+        while True:
+            with self._condition:
+                while self._is_running and len(self._queue) == 0:
+                    self._condition.wait()
+
+                if not self._is_running:
+                    return
+
+                video = self._queue.popleft()
+
+            try:
+                self._migrate(video)
+            except Exception as e:
+                self._log_warning(f'Failed to move {video.get_filepath()}: {e}')
+                _FAILED.inc()
+            finally:
+                with self._condition:
+                    self._pending.discard(video.get_filepath())
+
+    def _migrate(self, video:Video):
+        recorder = self._recorders[video.get_monitor()]
+
+        next_tier = recorder.get_next_tier(video)
+        if next_tier is None:
+            raise Exception(f'Already on the last tier!')
+
+        (video_dirpath, index) = next_tier
+        target_path = os.path.join(video_dirpath, video.get_datetime().date().isoformat(), video.get_filename())
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+        sidecar_path = video.get_sidecar_filepath()
+        has_sidecar = os.path.exists(sidecar_path)
+        target_sidecar_path = os.path.splitext(target_path)[0] + os.path.splitext(sidecar_path)[1]
+
+        if os.stat(video.get_dirpath()).st_dev == os.stat(os.path.dirname(target_path)).st_dev:
+            # Same filesystem, nothing to copy
+            os.rename(video.get_filepath(), target_path)
+
+            if has_sidecar:
+                os.rename(sidecar_path, target_sidecar_path)
+        else:
+            self._copy(video.get_filepath(), target_path)
+
+            if has_sidecar:
+                self._copy(sidecar_path, target_sidecar_path)
+
+        # Index the new copy before forgetting the old one, so the video never drops out of the timeline
+        migrated = Video(target_path, index=index, timestamp=video.get_timestamp(), size=video.get_size(), monitor=video.get_monitor(), duration=video.get_duration())
+        index.add(migrated, duration=video.get_duration())
+        video.get_index().remove(video)
+
+        for path in [ video.get_filepath(), sidecar_path ]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        try:
+            os.rmdir(video.get_dirpath())
+        except OSError:
+            # Not empty, or already gone
+            pass
+
+        _MIGRATED_VIDEOS.inc(monitor=video.get_monitor())
+        _MIGRATED_BYTES.inc(video.get_size(), monitor=video.get_monitor())
+
+        for listener in list(self._migration_listeners):
+            try:
+                listener(migrated)
+            except Exception as e:
+                self._log_warning(f'Migration listener failed: {e}')
+
+    def _copy(self, source_path:str, target_path:str):
+        # Copy, fsync, then rename into place, so a crash never leaves a partial video on the next tier
+        temp_path = f'{target_path}.tmp'
+
+        try:
+            self._copy_file(source_path, temp_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+
+            raise
+
+        os.replace(temp_path, target_path)
+
+        dir_fd = os.open(os.path.dirname(target_path), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _copy_file(self, source_path:str, target_path:str):
+        with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+            while True:
+                # A throttled copy can take a while, do not hold up shutdown for it
+                if not self._is_running:
+                    raise Exception(f'Migrator is stopping!')
+
+                chunk = source.read(self._CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                target.write(chunk)
+
+                if self._throttle is not None:
+                    self._throttle.acquire(len(chunk))
+
+            target.flush()
+            os.fsync(target.fileno())
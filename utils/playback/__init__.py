@@ -0,0 +1,3 @@
+from .playback_server import PlaybackServer
+
+__all__ = [ 'PlaybackServer' ]
@@ -0,0 +1,392 @@
+import os, re, json, math, time, struct, threading, functools, subprocess
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from ..logger import Logger
+from ..recorder import Recorder
+from ..video import Video
+
+class PlaybackServer:
+    # Window served when a request names none, the last day
+    DEFAULT_WINDOW_SEC = 24 * 3600
+
+    # Longest window one request may ask for, so a single request cannot walk the whole archive
+    MAX_WINDOW_SEC = 31 * 24 * 3600
+
+    # Largest chunk handed to a single sendfile call, keeps slow clients from pinning a huge transfer
+    _SENDFILE_CHUNK_BYTES = 8 * 1024 * 1024
+
+    _RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+    def __init__(self, logger:Logger, recorders:dict[str, Recorder], host:str|None=None, port:int=8080, max_remuxes:int=2):
+        self._logger = logger
+        self._recorders = recorders
+        self._host = host
+        self._port = port
+
+        # Each non fragmented segment served over HLS costs an FFmpeg process, viewers beyond this get a 503
+        self._remux_slots = threading.BoundedSemaphore(max_remuxes) if max_remuxes is not None else None
+
+        self._server = None
+        self._thread = None
+
+    def set_recorders(self, recorders:dict[str, Recorder]):
+        # After a config reload, requests already running finish on the old ones
+        self._recorders = recorders
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self._host or '127.0.0.1', self._port), self._create_handler())
+        self._server.daemon_threads = True
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        self._log_info(f'Serving playback on http://{self._host or "127.0.0.1"}:{self._port}/monitors')
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def list_monitors(self):
+        monitors = []
+        for name, recorder in self._recorders.items():
+            oldest = recorder.get_oldest_video()
+
+            monitors.append({
+                'name': name,
+                'segment_duration_sec': recorder.get_segment_duration_sec(),
+                'oldest': oldest.get_timestamp() if oldest is not None else None,
+                'total_bytes': recorder.get_total_size(),
+                'videos': f'/monitors/{quote(name)}/videos',
+                'playlist': f'/monitors/{quote(name)}/playlist.m3u8',
+            })
+
+        return monitors
+
+    def get_window_start(self, start:float|None, end:float|None):
+        # The last day unless a start is asked for, an open end is now
+        window_end = end if end is not None else time.time()
+        start = start if start is not None else window_end - self.DEFAULT_WINDOW_SEC
+
+        if window_end - start > self.MAX_WINDOW_SEC:
+            raise ValueError(f'Window is longer than {self.MAX_WINDOW_SEC // 86400} days, ask for it in parts')
+
+        return start
+
+    def list_videos(self, recorder:Recorder, start:float, end:float|None):
+        videos = recorder.get_videos_between(start, end if end is not None else time.time())
+
+        return [
+            {
+                'timestamp': video.get_timestamp(),
+                'duration': video.get_duration(),
+                'size': video.get_size(),
+                'url': f'/monitors/{quote(recorder.get_name())}/segments/{video.get_timestamp()}.mp4',
+            }
+            for video in videos
+        ]
+
+    def list_activity(self, recorder:Recorder, start:float, end:float, sensitivity:float):
+        return [
+            {
+                'start_ms': range_start_ms,
+                'end_ms': range_end_ms,
+                'segments': [ f'/monitors/{quote(recorder.get_name())}/segments/{video.get_timestamp()}.mp4' for video in videos ],
+            }
+            for (range_start_ms, range_end_ms, videos) in recorder.get_activity(start, end, sensitivity=sensitivity)
+        ]
+
+    def find_video(self, recorder:Recorder, timestamp:int):
+        for video in recorder.get_videos_between(timestamp, timestamp + 1):
+            if video.get_timestamp() == timestamp:
+                return video
+
+        return None
+
+    def generate_playlist(self, recorder:Recorder, start:float, end:float|None):
+        # Open ended windows stay live, players keep reloading them for new segments
+        videos = recorder.get_videos_between(start, end if end is not None else time.time())
+        if len(videos) == 0:
+            return None
+
+        # Fragmented MP4 segments are served as they are, anything else is remuxed to MPEG-TS per request
+        init_sizes = [ _get_init_size(video.get_filepath(), video.get_size()) for video in videos ]
+        fragmented = all(init_size is not None for init_size in init_sizes)
+
+        durations = [ video.get_duration() or recorder.get_segment_duration_sec() for video in videos ]
+
+        lines = [
+            '#EXTM3U',
+            f'#EXT-X-VERSION:{7 if fragmented else 3}',
+            f'#EXT-X-TARGETDURATION:{math.ceil(max(durations))}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            f'#EXT-X-PLAYLIST-TYPE:{"VOD" if end is not None else "EVENT"}',
+        ]
+
+        for i, (video, init_size, duration) in enumerate(zip(videos, init_sizes, durations)):
+            # Every segment restarts its timestamps, and some follow a gap
+            if i > 0:
+                lines.append('#EXT-X-DISCONTINUITY')
+
+            lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{video.get_datetime().isoformat(timespec="milliseconds")}')
+
+            if fragmented:
+                # Each file carries its own init section ahead of the fragments
+                filename = f'segments/{video.get_timestamp()}.mp4'
+                lines.append(f'#EXT-X-MAP:URI="{filename}",BYTERANGE="{init_size}@0"')
+                lines.append(f'#EXTINF:{duration:.3f},')
+                lines.append(f'#EXT-X-BYTERANGE:{video.get_size() - init_size}@{init_size}')
+                lines.append(filename)
+            else:
+                lines.append(f'#EXTINF:{duration:.3f},')
+                lines.append(f'segments/{video.get_timestamp()}.ts')
+
+        if end is not None:
+            lines.append('#EXT-X-ENDLIST')
+
+        return '\n'.join(lines) + '\n'
+
+    def _log_info(self, message):
+        self._logger.log_info(f'Playback: {message}')
+
+    def _log_warning(self, message):
+        self._logger.log_warning(f'Playback: {message}')
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, players fetch many segments over one connection
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                self._handle(send_body=False)
+
+            def do_GET(self):
+                self._handle(send_body=True)
+
+            def _handle(self, send_body:bool):
+                try:
+                    url = urlsplit(self.path)
+                    parts = [ unquote(part) for part in url.path.strip('/').split('/') ]
+                    query = { key: values[-1] for key, values in parse_qs(url.query).items() }
+
+                    if parts == [ 'monitors' ]:
+                        return self._send_json(server.list_monitors(), send_body)
+
+                    if len(parts) < 3 or parts[0] != 'monitors' or parts[1] not in server._recorders:
+                        return self.send_error(404)
+
+                    recorder = server._recorders[parts[1]]
+                    end = Video.parse_time(query['end']) if 'end' in query else None
+                    start = server.get_window_start(Video.parse_time(query['start']) if 'start' in query else None, end)
+
+                    if parts[2:] == [ 'videos' ]:
+                        return self._send_json(server.list_videos(recorder, start, end), send_body)
+
+                    if parts[2:] == [ 'activity' ]:
+                        if not recorder.has_activity():
+                            return self.send_error(404, 'Activity is not recorded for this monitor')
+
+                        end = end if end is not None else time.time()
+                        sensitivity = float(query['sensitivity']) if 'sensitivity' in query else 4
+
+                        return self._send_json(server.list_activity(recorder, start, end, sensitivity), send_body)
+
+                    if parts[2:] == [ 'playlist.m3u8' ]:
+                        playlist = server.generate_playlist(recorder, start, end)
+                        if playlist is None:
+                            return self.send_error(404, 'No videos in this window')
+
+                        return self._send_bytes(playlist.encode('utf-8'), 'application/vnd.apple.mpegurl', send_body)
+
+                    if len(parts) == 4 and parts[2] == 'segments':
+                        (timestamp, extension) = os.path.splitext(parts[3])
+                        video = server.find_video(recorder, int(timestamp)) if timestamp.isdigit() else None
+
+                        if video is None or extension not in [ '.mp4', '.ts' ]:
+                            return self.send_error(404)
+
+                        if extension == '.mp4':
+                            return self._send_file(video, send_body)
+
+                        return self._send_remuxed(video, send_body)
+
+                    return self.send_error(404)
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                except (BrokenPipeError, ConnectionResetError):
+                    # Viewer seeked away or closed the player
+                    self.close_connection = True
+                except Exception as e:
+                    server._log_warning(f'Failed to serve {self.path}: {e}')
+                    self.close_connection = True
+
+            def _send_json(self, value, send_body:bool):
+                self._send_bytes(json.dumps(value).encode('utf-8'), 'application/json', send_body)
+
+            def _send_bytes(self, body:bytes, content_type:str, send_body:bool):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+
+                if send_body:
+                    self.wfile.write(body)
+
+            def _send_file(self, video:Video, send_body:bool):
+                try:
+                    f = open(video.get_filepath(), 'rb')
+                except FileNotFoundError:
+                    # Deleted or migrated by retention since the lookup
+                    return self.send_error(404)
+
+                with f:
+                    size = os.fstat(f.fileno()).st_size
+                    byte_range = self._parse_range(size)
+
+                    if byte_range is None:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+
+                    (offset, length) = byte_range
+                    partial = length != size
+
+                    self.send_response(206 if partial else 200)
+                    self.send_header('Content-Type', 'video/mp4')
+                    self.send_header('Content-Length', str(length))
+                    self.send_header('Accept-Ranges', 'bytes')
+                    if partial:
+                        self.send_header('Content-Range', f'bytes {offset}-{offset + length - 1}/{size}')
+
+                    # Segments never change once finalized
+                    self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+                    self.end_headers()
+
+                    if not send_body:
+                        return
+
+                    # Straight from the page cache to the socket, nothing is copied through Python
+                    self.wfile.flush()
+                    while length > 0:
+                        sent = os.sendfile(self.connection.fileno(), f.fileno(), offset, min(length, server._SENDFILE_CHUNK_BYTES))
+                        if sent == 0:
+                            raise BrokenPipeError('File shrank while being sent')
+
+                        offset += sent
+                        length -= sent
+
+            def _parse_range(self, size:int):
+                # (offset, length), the whole file unless a single satisfiable range is asked for, None if unsatisfiable
+                header = self.headers.get('Range')
+                match = server._RANGE_PATTERN.match(header.strip()) if header is not None else None
+
+                # Multiple ranges are rare for video, answering with the whole file is allowed
+                if match is None:
+                    return (0, size)
+
+                (first, last) = match.groups()
+                if first == '' and last == '':
+                    return (0, size)
+
+                if first == '':
+                    # Suffix range, the last N bytes
+                    length = min(int(last), size)
+                    return (size - length, length) if length > 0 else None
+
+                first = int(first)
+                last = min(int(last), size - 1) if last != '' else size - 1
+                if first >= size or last < first:
+                    return None
+
+                return (first, last - first + 1)
+
+            def _send_remuxed(self, video:Video, send_body:bool):
+                # Non fragmented MP4 cannot be an HLS segment, rewrap it without touching the streams
+                if not send_body:
+                    return self._send_remuxed_headers()
+
+                if server._remux_slots is not None and not server._remux_slots.acquire(blocking=False):
+                    # Players retry the segment, better than starving the recording FFmpeg processes of CPU
+                    self.send_response(503)
+                    self.send_header('Retry-After', '2')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                try:
+                    self._send_remuxed_headers()
+
+                    ffmpeg_cmd = [
+                        'ffmpeg', '-loglevel', 'error',
+                        '-i', video.get_filepath(),
+                        '-map', '0', '-c', 'copy',
+                        '-f', 'mpegts', 'pipe:1'
+                    ]
+
+                    proc = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                    try:
+                        while chunk := proc.stdout.read(64 * 1024):
+                            self.wfile.write(chunk)
+                    finally:
+                        proc.kill()
+                        proc.wait()
+                finally:
+                    if server._remux_slots is not None:
+                        server._remux_slots.release()
+
+            def _send_remuxed_headers(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'video/mp2t')
+                self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+
+                # Length is only known once remuxed, so stream it and close the connection after
+                self.send_header('Connection', 'close')
+                self.close_connection = True
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # Players fetch a segment every few seconds, far too many to log
+                pass
+
+        return Handler
+
+@functools.lru_cache(maxsize=4096)
+def _get_init_size(filepath:str, size:int):
+    # Bytes before the first fragment of a fragmented MP4, None if the file is not fragmented. Cached
+    # per path and size since finalized segments never change
+    try:
+        with open(filepath, 'rb') as f:
+            offset = 0
+            while offset + 8 <= size:
+                f.seek(offset)
+                (box_size, box_type) = struct.unpack('>I4s', f.read(8))
+
+                if box_type == b'moof':
+                    return offset
+
+                if box_type == b'mdat' or box_size == 0:
+                    # Media before any fragment, or a box running to the end of the file
+                    return None
+
+                if box_size == 1:
+                    (box_size,) = struct.unpack('>Q', f.read(8))
+
+                if box_size < 8:
+                    return None
+
+                offset += box_size
+    except (OSError, struct.error):
+        pass
+
+    return None
@@ -1,3 +1,5 @@
 from .recorder import Recorder
+from .ffmpeg_profile import FFmpegProfile
+from .recorder_output import RecorderOutput, ProxyOutput, ThumbnailOutput
 
-__all__ = [ 'Recorder' ]
\ No newline at end of file
+__all__ = [ 'Recorder', 'FFmpegProfile', 'RecorderOutput', 'ProxyOutput', 'ThumbnailOutput' ]
\ No newline at end of file
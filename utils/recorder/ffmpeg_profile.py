@@ -0,0 +1,87 @@
+import copy, functools, re, subprocess
+
+class FFmpegProfile:
+    AUDIO_CODECS = [ 'aac', 'copy' ]
+    RTSP_TRANSPORTS = [ 'tcp', 'udp', 'udp_multicast', 'http', 'https' ]
+
+    def __init__(self, audio_codec:str='aac', rtsp_transport:str|None='tcp', loglevel:str='error', timeout_sec:float|None=None, probesize:int|None=None, analyzeduration_sec:float|None=None, fflags:str|None=None, use_wallclock_as_timestamps:bool=False, input_args:list[str]|None=None, output_args:list[str]|None=None):
+        if audio_codec not in self.AUDIO_CODECS:
+            raise Exception(f'Audio codec must be one of {self.AUDIO_CODECS}!')
+
+        if rtsp_transport is not None and rtsp_transport not in self.RTSP_TRANSPORTS:
+            raise Exception(f'RTSP transport must be one of {self.RTSP_TRANSPORTS}!')
+
+        self._audio_codec = audio_codec
+        self._rtsp_transport = rtsp_transport
+        self._loglevel = loglevel
+        self._timeout_sec = timeout_sec
+        self._probesize = probesize
+        self._analyzeduration_sec = analyzeduration_sec
+        self._fflags = fflags
+        self._use_wallclock_as_timestamps = use_wallclock_as_timestamps
+        self._input_args = [ str(arg) for arg in input_args ] if input_args is not None else []
+        self._output_args = [ str(arg) for arg in output_args ] if output_args is not None else []
+
+    @staticmethod
+    @functools.cache
+    def get_ffmpeg_version():
+        # Major version of the FFmpeg on PATH, once per process. None if it cannot be told, e.g. a git snapshot
+        try:
+            proc = subprocess.run([ 'ffmpeg', '-version' ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError:
+            return None
+
+        match = re.match(rb'ffmpeg version n?(\d+)\.', proc.stdout)
+
+        return int(match.group(1)) if match is not None else None
+
+    def get_audio_codec(self):
+        return self._audio_codec
+
+    def with_audio_codec(self, audio_codec:str):
+        profile = copy.copy(self)
+        profile._audio_codec = audio_codec
+
+        return profile
+
+    def get_global_args(self):
+        return [ '-loglevel', self._loglevel ]
+
+    def get_input_args(self, source:str):
+        args = []
+
+        # Only meaningful for RTSP, FFmpeg refuses the option for other inputs
+        if self._rtsp_transport is not None and source.startswith('rtsp'):
+            args += [ '-rtsp_transport', self._rtsp_transport ]
+
+        if self._timeout_sec is not None:
+            # Socket timeout in microseconds. Before FFmpeg 5 RTSP called it -stimeout, and its -timeout put the input
+            # in listen mode instead
+            version = self.get_ffmpeg_version()
+            option = '-stimeout' if source.startswith('rtsp') and version is not None and version < 5 else '-timeout'
+
+            args += [ option, str(int(self._timeout_sec * 1e6)) ]
+
+        if self._probesize is not None:
+            args += [ '-probesize', str(self._probesize) ]
+
+        if self._analyzeduration_sec is not None:
+            args += [ '-analyzeduration', str(int(self._analyzeduration_sec * 1e6)) ]
+
+        if self._fflags is not None:
+            args += [ '-fflags', self._fflags ]
+
+        if self._use_wallclock_as_timestamps:
+            args += [ '-use_wallclock_as_timestamps', '1' ]
+
+        return args + self._input_args
+
+    def get_audio_args(self, record_audio:bool):
+        if not record_audio:
+            return [ '-an' ]
+
+        # Copy keeps the whole pipeline free of decoding, AAC transcodes for cameras whose audio MP4 cannot hold
+        return [ '-c:a', self._audio_codec ]
+
+    def get_output_args(self):
+        return list(self._output_args)
\ No newline at end of file
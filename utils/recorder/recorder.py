@@ -1,53 +1,273 @@
-import threading, subprocess, os, psutil, shutil
-from time import sleep
+import asyncio, threading, subprocess, os, psutil, shutil, time, heapq, random
 from datetime import datetime, timezone
 
 from ..logger import Logger
-from ..video import Video
+from ..video import Video, KeyframeSidecar
+from ..index import SegmentIndex, ActivityIndex
+from ..finalizer import Finalizer
+from ..watcher import DirectoryWatcher
+from ..metrics import Registry
+from ..scheduling import SchedulingClass
+from .ffmpeg_profile import FFmpegProfile
+from .recorder_output import RecorderOutput
+
+_METRICS = Registry.get_default()
+_SEGMENTS = _METRICS.counter('nvr_segments_total', 'Segments finalized', [ 'monitor' ])
+_SEGMENT_BYTES = _METRICS.counter('nvr_segment_bytes_total', 'Bytes of finalized segments, rate() of this is the ingest bitrate', [ 'monitor' ])
+_FINALIZE_SECONDS = _METRICS.histogram('nvr_finalize_seconds', 'Time to remux or rename a completed segment into place', [ 'monitor', 'mode' ])
+_FFMPEG_RESTARTS = _METRICS.counter('nvr_ffmpeg_restarts_total', 'FFmpeg recording processes started after the first', [ 'monitor' ])
+_FFMPEG_UP = _METRICS.gauge('nvr_ffmpeg_up', 'Whether the FFmpeg recording process is running', [ 'monitor' ])
+_TEMP_BACKLOG = _METRICS.gauge('nvr_temp_backlog', 'Completed segments in temp waiting to be finalized', [ 'monitor' ])
+_DISK_USAGE = _METRICS.gauge('nvr_disk_usage_bytes', 'Bytes of finalized segments on disk', [ 'monitor' ])
+_STARTUP_SECONDS = _METRICS.gauge('nvr_startup_seconds', 'Time from recorder start to the end of each startup phase, recovery and first segment', [ 'monitor', 'phase' ])
+_RECOVERED_SEGMENTS = _METRICS.counter('nvr_recovered_segments_total', 'Temp segments left behind by a previous run and finalized on startup', [ 'monitor' ])
+_FFMPEG_CPU = _METRICS.gauge('nvr_ffmpeg_cpu_percent', 'CPU used by the FFmpeg recording process since the previous scrape', [ 'monitor' ])
+_FFMPEG_UPTIME = _METRICS.gauge('nvr_ffmpeg_uptime_seconds', 'How long the current FFmpeg recording process has been running, 0 while down', [ 'monitor' ])
+_FFMPEG_STALLS = _METRICS.counter('nvr_ffmpeg_stalls_total', 'FFmpeg processes killed by the watchdog for not writing anything', [ 'monitor' ])
+_FFMPEG_BACKOFF = _METRICS.gauge('nvr_ffmpeg_restart_backoff_seconds', 'Current delay before FFmpeg is restarted, grows while the camera keeps failing', [ 'monitor' ])
+_WRITE_RATE = _METRICS.gauge('nvr_write_bytes_per_second', 'Rate at which FFmpeg writes the current temp segment, as seen by the watchdog', [ 'monitor' ])
+_RECORDING_GAPS = _METRICS.counter('nvr_recording_gaps_total', 'Outages from FFmpeg exiting or stalling until data was written again', [ 'monitor' ])
+_RECORDING_DOWNTIME = _METRICS.counter('nvr_recording_downtime_seconds_total', 'Time spent in those outages', [ 'monitor' ])
 
 class Recorder:
     _TEMP_EXTENSION = '.mkv'
     _FINAL_EXTENSION = '.mp4'
 
-    def __init__(self, logger:Logger, storage_dirpath:str, name:str, source:str, segment_duration_sec:int, record_audio:bool=True):
+    # Restart delay for FFmpeg, doubled on every failed run and reset once it records for long enough
+    _MIN_RESTART_BACKOFF_SEC = 5
+    _MAX_RESTART_BACKOFF_SEC = 300
+    _STABLE_RUN_SEC = 60
+
+    # Time a stalled FFmpeg gets to exit after being asked before it is killed
+    _TERMINATE_TIMEOUT_SEC = 5
+
+    def __init__(self, logger:Logger, storage_dirpath:str, name:str, source:str, segment_duration_sec:int, record_audio:bool=True, direct_mp4:bool=False, finalizer:Finalizer|None=None, remux_threads:int=2, profile:FFmpegProfile|None=None, outputs:list[RecorderOutput]|None=None, tier_dirpaths:list[str]|None=None, stall_timeout_sec:float|None=30, activity:bool=False, ingest_class:SchedulingClass|None=None):
         self._logger = logger
         self._storage_dirpath = storage_dirpath
         self._name = name
         self._source = source
         self._segment_duration_sec = segment_duration_sec
         self._record_audio = record_audio
+        self._profile = profile if profile is not None else FFmpegProfile()
+
+        # Proxies, thumbnails and the like, written by the same FFmpeg process so the camera sees one connection
+        self._outputs = outputs if outputs is not None else []
+
+        # Write fragmented MP4 segments straight away instead of remuxing MKV afterwards
+        self._direct_mp4 = direct_mp4
+        self._temp_extension = self._FINAL_EXTENSION if direct_mp4 else self._TEMP_EXTENSION
+
+        # Shared worker pool for finalization, None to finalize on the mover thread
+        self._finalizer = finalizer
+        self._remux_threads = remux_threads
+        self._temp_disk = None
         
         self._is_running = False
 
-        self._threads = [
-            threading.Thread(target=self._start_video_mover, daemon=True),
-            threading.Thread(target=self._start_ffmpeg, daemon=True),
-        ]
+        # Bound to the event loop the recorder runs on
+        self._loop = None
+        self._stop_event = None
+        self._stopped = threading.Event()
         self._ffmpeg = None
+        self._ffmpeg_process = None
+
+        # FFmpeg is restarted once nothing reaches the temp segment for this long, None to only restart when it exits
+        self._stall_timeout_sec = stall_timeout_sec
+        self._ffmpeg_started = None
+        self._last_progress = None
+        self._down_since = None
+
+        # Set on FFmpeg before it starts, so background work never gets ahead of the camera's packets
+        self._ingest_class = ingest_class
+        self._is_ingest_class_warned = False
+
+        # For time to recording, set when run() starts and cleared at the first new segment
+        self._startup_started = None
+        self._startup_time = None
+
+        # Called with each newly finalized video, from whichever thread finalized it
+        self._segment_listeners = []
 
         self._video_dirpath = os.path.join(storage_dirpath, 'videos')
         self._temp_dirpath = os.path.join(storage_dirpath, 'temp')
+        self._index = SegmentIndex(os.path.join(storage_dirpath, 'index.db'), monitor=name)
+
+        # Per second motion from the packet sizes the sidecar probe reads anyway, covers every tier
+        self._activity = ActivityIndex(os.path.join(storage_dirpath, 'events.db'), monitor=name) if activity else None
+
+        # Storage tiers as (storage dirpath, video dirpath, index), recording happens on the first, older videos migrate down
+        self._tiers = [ (storage_dirpath, self._video_dirpath, self._index) ]
+        for tier_dirpath in (tier_dirpaths if tier_dirpaths is not None else []):
+            self._tiers.append((tier_dirpath, os.path.join(tier_dirpath, 'videos'), SegmentIndex(os.path.join(tier_dirpath, 'index.db'), monitor=name)))
+
+        # Read at scrape time only
+        _TEMP_BACKLOG.set_function(self._count_temp_backlog, monitor=name)
+        _DISK_USAGE.set_function(self.get_total_size, monitor=name)
+        _FFMPEG_CPU.set_function(self._get_ffmpeg_cpu_percent, monitor=name)
+        _FFMPEG_UPTIME.set_function(self._get_ffmpeg_uptime_sec, monitor=name)
 
+    def get_name(self):
+        return self._name
+
+    def get_segment_duration_sec(self):
+        return self._segment_duration_sec
+
+    def get_profile(self):
+        return self._profile
+
+    def get_outputs(self):
+        return list(self._outputs)
+
+    def get_storage_dirpath(self):
+        return self._storage_dirpath
 
     def is_running(self):
         return self._is_running
 
-    def get_videos(self):
-        videos = []
+    def add_segment_listener(self, listener):
+        self._segment_listeners.append(listener)
 
-        # Walk over the files in output directory
-        for dirpath, dirnames, filenames in os.walk(self._video_dirpath):
-            for filename in filenames:
-                # Ignore non-video files
-                if not filename.endswith(self._FINAL_EXTENSION):
-                    continue
+    def remove_segment_listener(self, listener):
+        if listener in self._segment_listeners:
+            self._segment_listeners.remove(listener)
+
+    def get_tier_count(self):
+        return len(self._tiers)
+
+    def get_tier_storage_dirpath(self, tier:int):
+        return self._tiers[tier][0]
+
+    def get_next_tier(self, video:Video):
+        # Video dirpath and index of the tier below the video's own, None if it is on the last one
+        for i, (storage_dirpath, video_dirpath, index) in enumerate(self._tiers[:-1]):
+            if video.get_index() is index:
+                return self._tiers[i + 1][1:]
+
+        return None
+
+    def get_videos(self, tier:int|None=None):
+        # Videos ordered by date, straight from the index. All tiers as one timeline unless one is given
+        if tier is not None:
+            return self._tiers[tier][2].get_videos()
+
+        return list(self.iter_videos())
+
+    def iter_videos(self, tier:int|None=None):
+        # Same as get_videos, but lazily paged for callers that stop early
+        if tier is not None:
+            return self._tiers[tier][2].iter_videos()
 
-                videos.append(Video(os.path.join(dirpath, filename)))
+        # Each tier is sorted on its own, merging them keeps the order
+        return heapq.merge(*[ index.iter_videos() for (storage_dirpath, video_dirpath, index) in self._tiers ], key=Video.get_timestamp)
 
-        # Return videos ordered by date
-        return sorted(videos)
+    def get_videos_between(self, start:float, end:float, tier:int|None=None):
+        # Videos overlapping [start, end) ordered by date, a range scan rather than the whole archive
+        if tier is not None:
+            return self._tiers[tier][2].get_videos_between(start, end, self._segment_duration_sec)
+
+        return list(heapq.merge(*[ index.get_videos_between(start, end, self._segment_duration_sec) for (storage_dirpath, video_dirpath, index) in self._tiers ], key=Video.get_timestamp))
+
+    def has_activity(self):
+        return self._activity is not None
+
+    def get_activity(self, start:float, end:float, sensitivity:float=4, min_gap_sec:float=5):
+        # Busy stretches of [start, end) as (start ms, end ms, videos), from the activity index and segment index alone
+        if self._activity is None:
+            raise Exception(f'Activity is not recorded for {self._name}!')
+
+        ranges = self._activity.get_active_ranges(int(start * 1000), int(end * 1000), sensitivity=sensitivity, min_gap_ms=int(min_gap_sec * 1000))
+        videos = { video.get_timestamp(): video for video in self.get_videos_between(start, end) }
+
+        # Segments deleted since their activity was recorded are left out
+        return [ (range_start, range_end, [ videos[segment] for segment in segments if segment in videos ]) for (range_start, range_end, segments) in ranges ]
+
+    def get_oldest_video(self, tier:int|None=None):
+        if tier is not None:
+            return self._tiers[tier][2].get_oldest_video()
+
+        oldest = [ video for video in (index.get_oldest_video() for (storage_dirpath, video_dirpath, index) in self._tiers) if video is not None ]
+
+        return min(oldest) if len(oldest) > 0 else None
+
+    def get_total_size(self, tier:int|None=None):
+        if tier is not None:
+            return self._tiers[tier][2].get_total_size()
+
+        return sum(index.get_total_size() for (storage_dirpath, video_dirpath, index) in self._tiers)
+
+    def get_gaps(self, start:float, end:float, min_gap_sec:float=0):
+        # Camera outages and restarts as (start, end) pairs, answered from the indexes alone
+        gaps = [ (start, end) ]
+        for (storage_dirpath, video_dirpath, index) in self._tiers:
+            # Only time missing from every tier is a real gap
+            gaps = self._intersect_gaps(gaps, index.get_gaps(start, end, self._segment_duration_sec))
+
+        return [ (gap_start, gap_end) for (gap_start, gap_end) in gaps if gap_end - gap_start > min_gap_sec ]
+
+    def recover(self):
+        # Startup phase: verify the index and sort out temp, returns the orphaned segments still to finalize
+        try:
+            try:
+                self.reconcile_index()
+            except Exception as e:
+                # Temp is still sorted out against the index as it is, the next start reconciles again
+                self._log_error(str(e))
+
+            os.makedirs(self._temp_dirpath, exist_ok=True)
+            self._temp_disk = os.stat(self._temp_dirpath).st_dev
+
+            orphans = self._recover_temp_files()
+            if len(orphans) > 0:
+                self._log_info(f'Recovering {len(orphans)} segments left in temp by the previous run')
+                _RECOVERED_SEGMENTS.inc(len(orphans), monitor=self._name)
+
+            return orphans
+        except Exception as e:
+            raise Exception(f'Failed to recover: {e}')
+
+    def reconcile_index(self):
+        try:
+            self._log_info('Reconciling segment index...')
+
+            (added, removed) = (0, 0)
+            for (storage_dirpath, video_dirpath, index) in self._tiers:
+                (tier_added, tier_removed) = index.reconcile(video_dirpath, self._FINAL_EXTENSION)
+                added += tier_added
+                removed += tier_removed
+
+            self._log_info(f'Segment index reconciled, {added} added, {removed} removed')
+        except Exception as e:
+            raise Exception(f'Failed to reconcile segment index: {e}')
+
+    def close(self, remove_metrics:bool=True):
+        # Once stopped for good. Keep the metrics when a replacement recorder of the same name already registered its own
+        for (storage_dirpath, video_dirpath, index) in self._tiers:
+            index.close()
+
+        if self._activity is not None:
+            self._activity.close()
+
+        if remove_metrics:
+            for metric in [ _TEMP_BACKLOG, _DISK_USAGE, _FFMPEG_CPU, _FFMPEG_UP, _FFMPEG_UPTIME, _FFMPEG_BACKOFF, _WRITE_RATE ]:
+                metric.remove(monitor=self._name)
+
+            for phase in [ 'recovery', 'recording' ]:
+                _STARTUP_SECONDS.remove(monitor=self._name, phase=phase)
 
     def start(self):
+        # Blocking, runs the recorder on its own event loop. The supervisor awaits run() instead
+        asyncio.run(self.run())
+
+    def stop(self):
+        # Safe to call from any thread
+        loop = self._loop
+        if loop is None:
+            return
+
+        loop.call_soon_threadsafe(self.request_stop)
+        self._stopped.wait()
+
+    async def run(self):
         try:
             self._log_info('Starting recorder...')
 
@@ -55,43 +275,84 @@ class Recorder:
                 # Prevent multiple instances
                 raise Exception(f'Recorder is already running!')
 
-            # Set flag
+            self._startup_started = time.monotonic()
+            self._startup_time = time.time()
+
+            # Set flag, already during recovery so a stop requested meanwhile is not lost
             self._is_running = True
-            
-            for thread in self._threads:
-                thread.start()
+            self._loop = asyncio.get_running_loop()
+            self._stop_event = asyncio.Event()
+            self._stopped.clear()
+
+            # Repair whatever the previous run left behind before FFmpeg starts writing again, off the loop so monitors recover in parallel
+            try:
+                orphans = await asyncio.to_thread(self.recover)
+            except Exception as e:
+                # Recording never waits on a healthy index, the mover still picks up completed segments from temp
+                self._log_error(f'{e}, recording anyway')
+                orphans = []
+
+            _STARTUP_SECONDS.set(time.monotonic() - self._startup_started, monitor=self._name, phase='recovery')
+
+            if not self.is_running():
+                self._log_info('Recorder stopped before recording started')
+                return
+
+            # Claimed before FFmpeg starts, so the newest orphan is not mistaken for the segment being written
+            await self._run_mover_job(self._move_temp_videos, orphans)
+
+            tasks = [
+                asyncio.create_task(self._run_video_mover()),
+                asyncio.create_task(self._run_ffmpeg()),
+            ]
 
             self._log_info('Recorder started!')
 
-            for thread in self._threads:
-                thread.join()
+            await asyncio.gather(*tasks)
+
+            self._log_info('Recorder stopped!')
         except Exception as e:
-            message = f'Failed to start: {e}'
+            message = f'Failed to run: {e}'
             self._log_error(message)
             raise Exception(message)
+        finally:
+            self._is_running = False
+            self._loop = None
+            self._stopped.set()
 
-    def stop(self):
-        try:
-            self._log_info('Stopping recorder...')
+    def request_stop(self):
+        # Must be called on the recorder's event loop
+        if not self.is_running():
+            return
 
-            # Clear flag
-            self._is_running = False
+        self._log_info('Stopping recorder...')
+
+        # Clear flag and wake anything sleeping
+        self._is_running = False
+        self._stop_event.set()
+
+        if self._ffmpeg is not None and self._ffmpeg.returncode is None:
+            # Stop FFmpeg subprocess if it is running, its reader finishes once stderr closes
+            self._log_info('Terminating FFmpeg subprocess...')
 
-            if self._ffmpeg is not None:
-                # Stop FFmpeg subprocess if it is running
-                self._log_info('Terminating FFmpeg subprocess...')
+            try:
                 self._ffmpeg.terminate()
-                self._ffmpeg.wait()
+            except ProcessLookupError:
+                pass
 
-            self._log_info('Waiting for background threads to finish...')
-            for thread in self._threads:
-                thread.join()
+            # Its reader would wait forever on one that ignores SIGTERM
+            self._loop.call_later(self._TERMINATE_TIMEOUT_SEC, self._kill_ffmpeg, self._ffmpeg)
 
-            self._log_info('Recorder stopped!')
-        except Exception as e:
-            message = f'Failed to stop: {e}'
-            self._log_error(message)
-            raise Exception(message)
+    def _kill_ffmpeg(self, ffmpeg):
+        if ffmpeg.returncode is not None:
+            return
+
+        self._log_error(f'FFmpeg did not exit within {self._TERMINATE_TIMEOUT_SEC} seconds, killing it')
+
+        try:
+            ffmpeg.kill()
+        except ProcessLookupError:
+            pass
 
     def _log_info(self, message):
         self._logger.log_info(f'{self._name}: {message}')
@@ -99,47 +360,365 @@ class Recorder:
     def _log_error(self, message):
         self._logger.log_error(f'{self._name}: {message}')
 
-    def _start_video_mover(self):
+    def _log_warning(self, message):
+        self._logger.log_warning(f'{self._name}: {message}')
+
+    def _intersect_gaps(self, gaps:list[tuple], other_gaps:list[tuple]):
+        # Both lists are sorted and non overlapping, so one merge pass does it
+        (i, j) = (0, 0)
+        intersection = []
+
+        while i < len(gaps) and j < len(other_gaps):
+            gap_start = max(gaps[i][0], other_gaps[j][0])
+            gap_end = min(gaps[i][1], other_gaps[j][1])
+
+            if gap_start < gap_end:
+                intersection.append((gap_start, gap_end))
+
+            if gaps[i][1] < other_gaps[j][1]:
+                i += 1
+            else:
+                j += 1
+
+        return intersection
+
+    async def _run_video_mover(self):
         self._log_info(f'Starting video mover...')
 
         # Create directories if needed
         os.makedirs(self._temp_dirpath, exist_ok=True)
         os.makedirs(self._video_dirpath, exist_ok=True)
 
-        while self.is_running():
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+
+        with DirectoryWatcher(self._temp_dirpath) as watcher:
+            if watcher.is_polling():
+                self._log_info(f'inotify unavailable ({watcher.get_error()}), polling temp directory instead')
+            else:
+                loop.add_reader(watcher.fileno(), readable.set)
+
             try:
-                self._move_completed_temp_videos()
-            except Exception as e:
-                self._log_error(f'Failed to run mover: {e}')
+                # Pick up anything completed while we were not watching
+                events = None
+
+                while self.is_running():
+                    if self._startup_started is not None:
+                        self._check_recording_started()
+
+                    try:
+                        if events is None:
+                            await self._run_mover_job(self._move_completed_temp_videos)
+                        elif len(events) > 0:
+                            await self._run_mover_job(self._move_closed_temp_videos, events)
+                    except Exception as e:
+                        self._log_error(f'Failed to run mover: {e}')
+
+                    if watcher.is_polling():
+                        await self._sleep(5)
+                    else:
+                        await self._wait_for(readable, 5)
+                        readable.clear()
+                        events = watcher.read_events()
             finally:
-                sleep(5)
+                if not watcher.is_polling():
+                    loop.remove_reader(watcher.fileno())
+
+    async def _run_mover_job(self, job, *args):
+        if self._finalizer is not None:
+            # Only lists and submits, cheap enough to run on the loop
+            job(*args)
+        else:
+            # Finalizes inline, keep the remux off the loop
+            await asyncio.to_thread(job, *args)
 
-    def _start_ffmpeg(self):
+    async def _run_ffmpeg(self):
         ffmpeg_cmd = self._generate_ffmpeg_command()
         os.makedirs(self._temp_dirpath, exist_ok=True)
 
+        # FFmpeg does not create output directories itself
+        for output in self._outputs:
+            os.makedirs(output.get_dirpath(), exist_ok=True)
+        starts = 0
+        backoff_sec = self._MIN_RESTART_BACKOFF_SEC
+
         while self.is_running():
+            watchdog = None
+
             try:
                 self._log_info(f'Starting FFmpeg subprocess...')
 
-                self._ffmpeg = subprocess.Popen(ffmpeg_cmd, text=True, bufsize=1, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                self._ffmpeg = await asyncio.create_subprocess_exec(*ffmpeg_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                self._apply_ingest_class(self._ffmpeg.pid)
+
+                if starts > 0:
+                    _FFMPEG_RESTARTS.inc(monitor=self._name)
+
+                starts += 1
+                _FFMPEG_UP.set(1, monitor=self._name)
+                self._ffmpeg_process = self._track_process(self._ffmpeg.pid)
+                self._ffmpeg_started = time.monotonic()
+                self._last_progress = None
+
+                if self._stall_timeout_sec is not None:
+                    watchdog = asyncio.create_task(self._watch_ffmpeg(self._ffmpeg))
 
-                while self._ffmpeg.poll() is None:
-                    line = self._ffmpeg.stderr.readline().rstrip()
+                # Read stderr without blocking anything else on the loop
+                async for line in self._ffmpeg.stderr:
+                    line = line.decode('utf-8', errors='replace').rstrip()
                     if line:
                         self._log_info(f'FFmpeg: {line}')
+
+                await self._ffmpeg.wait()
             except Exception as e:
                 self._log_error(f'Failed to run FFmpeg subprocess: {e}')
             finally:
-                sleep(5)
+                if watchdog is not None:
+                    watchdog.cancel()
+                    await asyncio.gather(watchdog, return_exceptions=True)
+
+                # Never leave an orphan behind, also covers cancellation
+                await self._terminate_ffmpeg()
+                _FFMPEG_UP.set(0, monitor=self._name)
+                _WRITE_RATE.set(0, monitor=self._name)
+                self._ffmpeg_process = None
+
+            # Only a run that recorded for a while proves the camera is back, anything shorter keeps backing off.
+            # Without the watchdog nothing tracks progress, so staying up has to do
+            if self._stall_timeout_sec is not None:
+                healthy = self._last_progress is not None and self._last_progress - self._ffmpeg_started >= self._STABLE_RUN_SEC
+            else:
+                healthy = self._ffmpeg_started is not None and time.monotonic() - self._ffmpeg_started >= self._STABLE_RUN_SEC
+
+                if healthy and self._down_since is not None:
+                    # The outage ended when this run started
+                    _RECORDING_GAPS.inc(monitor=self._name)
+                    _RECORDING_DOWNTIME.inc(max(self._ffmpeg_started - self._down_since, 0), monitor=self._name)
+                    self._down_since = None
+
+            backoff_sec = self._MIN_RESTART_BACKOFF_SEC if healthy else backoff_sec
+
+            self._ffmpeg_started = None
+            if not self.is_running():
+                break
+
+            if self._down_since is None:
+                self._down_since = time.monotonic()
+
+            # Jitter keeps cameras that failed together, e.g. behind the same switch, from retrying in lockstep
+            delay_sec = backoff_sec * random.uniform(0.5, 1)
+            _FFMPEG_BACKOFF.set(backoff_sec, monitor=self._name)
+            self._log_info(f'FFmpeg exited, restarting in {delay_sec:.1f} seconds')
+
+            await self._sleep(delay_sec)
+            backoff_sec = min(backoff_sec * 2, self._MAX_RESTART_BACKOFF_SEC)
+
+    def _apply_ingest_class(self, pid:int):
+        # Set on FFmpeg from here once started, a preexec hook is unsafe with the finalizer and log threads running
+        if self._ingest_class is None:
+            return
+
+        try:
+            self._ingest_class.apply_to_process(pid)
+        except ProcessLookupError:
+            # Already exited, the next start tries again
+            pass
+        except Exception as e:
+            # Once, it fails the same way every start
+            if not self._is_ingest_class_warned:
+                self._is_ingest_class_warned = True
+                self._log_warning(f'FFmpeg is not running with scheduling class {self._ingest_class}, raising priority needs CAP_SYS_NICE: {e}')
+
+    async def _watch_ffmpeg(self, ffmpeg):
+        # Restarts FFmpeg once nothing reaches the temp segments for too long, e.g. a camera that hangs with the
+        # connection still open. Growth of the newest temp file is the only sign of life that does not depend on FFmpeg itself
+        interval_sec = min(max(self._stall_timeout_sec / 4, 1), 10)
+        last_checked = time.monotonic()
+
+        # Whatever the previous process left behind does not count as this one writing
+        last_written = self._get_temp_progress()
+
+        while ffmpeg.returncode is None:
+            await asyncio.sleep(interval_sec)
+
+            # Only a handful of files in temp, cheap enough to list on the loop
+            written = self._get_temp_progress()
+            now = time.monotonic()
+
+            if written[0] is not None and written != last_written:
+                # A new segment counts in full, the unseen tail of the previous one is lost to the rate
+                grown = written[1] - last_written[1] if written[0] == last_written[0] else written[1]
+                _WRITE_RATE.set(max(grown, 0) / (now - last_checked), monitor=self._name)
+
+                if self._down_since is not None:
+                    # Data flows again, whatever came before was an outage. Accurate to the check interval
+                    _RECORDING_GAPS.inc(monitor=self._name)
+                    _RECORDING_DOWNTIME.inc(now - self._down_since, monitor=self._name)
+                    self._down_since = None
+
+                self._last_progress = now
+            else:
+                _WRITE_RATE.set(0, monitor=self._name)
+
+            last_checked = now
+            last_written = written
+
+            if now - (self._last_progress if self._last_progress is not None else self._ffmpeg_started) < self._stall_timeout_sec:
+                continue
+
+            self._log_error(f'FFmpeg wrote nothing for {self._stall_timeout_sec} seconds, restarting it')
+            _FFMPEG_STALLS.inc(monitor=self._name)
+
+            if self._down_since is None:
+                self._down_since = self._last_progress if self._last_progress is not None else now
+
+            # A process stuck on a dead connection may not act on SIGTERM
+            try:
+                ffmpeg.terminate()
+                await asyncio.wait_for(ffmpeg.wait(), self._TERMINATE_TIMEOUT_SEC)
+            except asyncio.TimeoutError:
+                ffmpeg.kill()
+            except ProcessLookupError:
+                pass
+
+            return
+
+    def _get_temp_progress(self):
+        # Name and size of the temp segment FFmpeg is writing, the newest by name
+        newest = (None, 0)
+
+        try:
+            with os.scandir(self._temp_dirpath) as entries:
+                for entry in entries:
+                    if entry.name.endswith(self._temp_extension) and (newest[0] is None or entry.name > newest[0]):
+                        try:
+                            newest = (entry.name, entry.stat().st_size)
+                        except FileNotFoundError:
+                            pass
+        except FileNotFoundError:
+            pass
+
+        return newest
+
+    def _get_ffmpeg_uptime_sec(self):
+        started = self._ffmpeg_started
+
+        return time.monotonic() - started if started is not None else 0
+
+    async def _terminate_ffmpeg(self):
+        if self._ffmpeg is None or self._ffmpeg.returncode is not None:
+            return
+
+        # FFmpeg hung on a dead connection may ignore SIGTERM, it must not hold up stopping
+        try:
+            self._ffmpeg.terminate()
+        except ProcessLookupError:
+            pass
+
+        try:
+            await asyncio.wait_for(self._ffmpeg.wait(), self._TERMINATE_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            self._kill_ffmpeg(self._ffmpeg)
+            await self._ffmpeg.wait()
+
+    async def _sleep(self, seconds:float):
+        # Sleep that returns early once the recorder is asked to stop
+        await self._wait_for(self._stop_event, seconds)
+
+    async def _wait_for(self, event:asyncio.Event, timeout:float):
+        waiters = [ asyncio.create_task(event.wait()) ]
+        if event is not self._stop_event:
+            waiters.append(asyncio.create_task(self._stop_event.wait()))
+
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
 
-    def _generate_ffmpeg_command(self):
-        RTSP_ARGS = ['-rtsp_transport', 'tcp']
-        LOG_ARGS = ['-loglevel', 'error']
-        INPUT_ARGS = ['-i', self._source]
+    def _move_closed_temp_videos(self, events:list):
+        # Fall back to a full scan if the kernel dropped events
+        if any(mask & DirectoryWatcher.IN_Q_OVERFLOW for (mask, name) in events):
+            self._move_completed_temp_videos()
+            return
+
+        # FFmpeg closes a segment as soon as it is done with it
+        filenames = set(name for (mask, name) in events if mask & DirectoryWatcher.IN_CLOSE_WRITE and name.endswith(self._temp_extension))
+        filepaths = [ os.path.join(self._temp_dirpath, filename) for filename in filenames ]
+
+        # Skip anything already finalized by an earlier event
+        self._move_temp_videos(sorted(Video(filepath) for filepath in filepaths if os.path.exists(filepath)))
+
+    async def measure_ffmpeg_cost(self, seconds:float, temp_dirpath:str, profile:FFmpegProfile|None=None):
+        # Record into a scratch directory for a while and report what it cost
+        os.makedirs(temp_dirpath, exist_ok=True)
+
+        # Extra outputs go in subdirectories, so only the main segments are counted below
+        for output in self._outputs:
+            os.makedirs(os.path.join(temp_dirpath, output.get_name()), exist_ok=True)
+        ffmpeg_cmd = self._generate_ffmpeg_command(temp_dirpath=temp_dirpath, profile=profile)
+
+        ffmpeg = await asyncio.create_subprocess_exec(*ffmpeg_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        process = psutil.Process(ffmpeg.pid)
+        started = time.monotonic()
+
+        try:
+            await asyncio.wait_for(ffmpeg.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+        elapsed = time.monotonic() - started
+        exited = ffmpeg.returncode is not None
+
+        try:
+            cpu_times = process.cpu_times()
+            cpu_sec = cpu_times.user + cpu_times.system
+        except psutil.Error:
+            cpu_sec = None
+
+        if not exited:
+            ffmpeg.terminate()
+
+        stderr = (await ffmpeg.stderr.read()).decode('utf-8', errors='replace').strip()
+        await ffmpeg.wait()
+
+        output_bytes = sum(entry.stat().st_size for entry in os.scandir(temp_dirpath) if entry.is_file())
+
+        return {
+            'cpu_percent': cpu_sec / elapsed * 100 if cpu_sec is not None and elapsed > 0 else None,
+            'output_bytes': output_bytes,
+            'ok': not exited and output_bytes > 0,
+            'error': stderr.splitlines()[-1] if exited and stderr else None,
+        }
+
+    def _track_process(self, pid:int):
+        try:
+            process = psutil.Process(pid)
+
+            # Prime it, the first reading is always zero
+            process.cpu_percent(None)
+
+            return process
+        except psutil.Error:
+            return None
+
+    def _get_ffmpeg_cpu_percent(self):
+        process = self._ffmpeg_process
+        if process is None:
+            return 0
+
+        return process.cpu_percent(None)
+
+    def _generate_ffmpeg_command(self, temp_dirpath:str|None=None, profile:FFmpegProfile|None=None):
+        # A scratch temp directory also gets the extra outputs, so measuring never touches real recordings
+        scratch_dirpath = temp_dirpath
+        temp_dirpath = temp_dirpath if temp_dirpath is not None else self._temp_dirpath
+        profile = profile if profile is not None else self._profile
+
+        GLOBAL_ARGS = profile.get_global_args()
+        INPUT_ARGS = [ *profile.get_input_args(self._source), *self._get_decoder_args(), '-i', self._source ]
         VCODEC_ARGS = ['-c:v', 'copy']
-        ACODEC_ARGS = ['-c:a', 'aac']
-        NO_ACODEC_ARGS = ['-an']
+        ACODEC_ARGS = profile.get_audio_args(self._record_audio)
         SEGMENT_ARGS = [
             '-f', 'segment',
             '-segment_time', str(self._segment_duration_sec),
@@ -147,59 +726,210 @@ class Recorder:
             '-segment_atclocktime', '1',
             '-reset_timestamps', '1'
         ]
-        OUTPUT_ARGS = ['-y', os.path.join(self._temp_dirpath, '%s.mkv')]
+        # Fragmented so a segment cut short by a crash is still playable
+        DIRECT_MP4_ARGS = [
+            '-segment_format', 'mp4',
+            '-segment_format_options', 'movflags=+frag_keyframe+empty_moov+default_base_moof'
+        ]
+        MUXER_ARGS = profile.get_output_args()
+        OUTPUT_ARGS = ['-y', os.path.join(temp_dirpath, f'%s{self._temp_extension}')]
 
         cmd = ['ffmpeg']
 
-        for arg_list in [ RTSP_ARGS, LOG_ARGS, INPUT_ARGS, VCODEC_ARGS ]:
+        for arg_list in [ GLOBAL_ARGS, INPUT_ARGS, VCODEC_ARGS, ACODEC_ARGS, SEGMENT_ARGS ]:
             for arg in arg_list:
                 cmd.append(arg)
-        
-        if self._record_audio:
-            for arg in ACODEC_ARGS:
-                cmd.append(arg)
-        else:
-            for arg in NO_ACODEC_ARGS:
+
+        if self._direct_mp4:
+            for arg in DIRECT_MP4_ARGS:
                 cmd.append(arg)
 
-        for arg_list in [ SEGMENT_ARGS, OUTPUT_ARGS ]:
+        for arg_list in [ MUXER_ARGS, OUTPUT_ARGS ]:
             for arg in arg_list:
                 cmd.append(arg)
 
+        # Each extra output is encoded from the same demuxed input
+        for output in self._outputs:
+            output_dirpath = os.path.join(scratch_dirpath, output.get_name()) if scratch_dirpath is not None else None
+
+            for arg in output.get_ffmpeg_args(output_dirpath):
+                cmd.append(arg)
+
         return cmd
 
+    def _get_decoder_args(self):
+        # The main segments are copied, so only extra outputs ever decode. Skip everything but keyframes when none of them need more
+        if len(self._outputs) > 0 and all(output.is_keyframes_only() for output in self._outputs):
+            return [ '-skip_frame', 'nokey' ]
+
+        return []
+
     def _move_completed_temp_videos(self):
-        # For each completed .mkv file
-        for temp_mkv_video in self._get_completed_temp_videos():
+        self._move_temp_videos(self._get_completed_temp_videos())
+
+    def _move_temp_videos(self, temp_videos:list[Video]):
+        # For each completed temp file
+        for temp_video in temp_videos:
+            if self._finalizer is not None:
+                try:
+                    size = temp_video.get_size()
+                except FileNotFoundError:
+                    # Finalized since it was listed
+                    continue
+
+                # Queued jobs are deduplicated by path, so resubmitting on every pass is fine
+                self._finalizer.submit(self._name, temp_video.get_filepath(), self._temp_disk, lambda video=temp_video: self._move_temp_video(video), size=size)
+            else:
+                try:
+                    self._move_temp_video(temp_video)
+                except Exception:
+                    # Already logged, carry on with the next one
+                    pass
+
+    def _move_temp_video(self, temp_video:Video):
+        try:
+            self._log_info(f'Moving {temp_video.get_filename()}...')
+            self._finalize_temp_video(temp_video)
+        except Exception as e:
+            self._log_error(f'Failed to move {temp_video.get_filename()}: {e}')
+            raise
+
+    def _finalize_temp_video(self, temp_video:Video, remux:bool|None=None):
+        started = time.monotonic()
+        remux = not self._direct_mp4 if remux is None else remux
+
+        # Get all paths
+        date_str = temp_video.get_datetime().date().isoformat()
+
+        temp_path = temp_video.get_filepath()
+        final_mp4_path = os.path.join(self._video_dirpath, date_str, f'{temp_video.get_timestamp()}{self._FINAL_EXTENSION}')
+
+        # Make directory for final path
+        os.makedirs(os.path.dirname(final_mp4_path), exist_ok=True)
+
+        if not remux:
+            # Already in its final format, temp and videos share a filesystem so this is atomic
+            os.rename(temp_path, final_mp4_path)
+        else:
+            temp_mp4_path = temp_path.replace(self._TEMP_EXTENSION, self._FINAL_EXTENSION)
+
+            # Convert temp mkv to mp4
+            self._mkv_to_mp4(temp_path, temp_mp4_path)
+
+            # Move mp4 from temp to final directory
+            shutil.move(temp_mp4_path, final_mp4_path)
+
+        # Keyframes and real duration, so seeking and gap listing never have to open the video
+        sidecar = self._write_sidecar(final_mp4_path)
+        duration = sidecar.get_duration() if sidecar is not None else None
+
+        # Record it in the index
+        final_video = Video(final_mp4_path, monitor=self._name, duration=duration)
+        self._index.add(final_video, duration=duration if duration is not None else self._segment_duration_sec)
+
+        if self._activity is not None and sidecar is not None:
+            self._record_activity(temp_video.get_timestamp(), sidecar)
+
+        if remux:
+            # Delete original temp mkv
+            os.remove(temp_path)
+
+        _FINALIZE_SECONDS.observe(time.monotonic() - started, monitor=self._name, mode='remux' if remux else 'rename')
+        _SEGMENTS.inc(monitor=self._name)
+        _SEGMENT_BYTES.inc(final_video.get_size(), monitor=self._name)
+
+        for listener in list(self._segment_listeners):
             try:
-                self._log_info(f'Moving {temp_mkv_video.get_filename()}...')
-
-                # Get all paths
-                date_str = temp_mkv_video.get_datetime().date().isoformat()
-
-                temp_mkv_path = temp_mkv_video.get_filepath()
-                temp_mp4_path = temp_mkv_path.replace(self._TEMP_EXTENSION, self._FINAL_EXTENSION)
-                final_mp4_path = os.path.join(self._video_dirpath, date_str, os.path.basename(temp_mp4_path))
-
-                # Make directory for final path
-                os.makedirs(os.path.dirname(final_mp4_path), exist_ok=True)
-
-                # Convert temp mkv to mp4
-                self._mkv_to_mp4(temp_mkv_path, temp_mp4_path)
-                
-                # Move mp4 from temp to final directory
-                shutil.move(temp_mp4_path, final_mp4_path)
-                
-                # Delete original temp mkv
-                os.remove(temp_mkv_path)
+                listener(final_video)
             except Exception as e:
-                self._log_error(f'Failed to move {temp_mkv_video.get_filename()}: {e}')
+                self._log_error(f'Segment listener failed: {e}')
+
+    def _write_sidecar(self, video_filepath:str):
+        try:
+            sidecar = KeyframeSidecar.probe(video_filepath)
+            sidecar.write(KeyframeSidecar.get_filepath(video_filepath))
+
+            return sidecar
+        except Exception as e:
+            # The segment itself is fine, only seeking into it is slower
+            self._log_error(f'Failed to write keyframe sidecar: {e}')
+
+            return None
+
+    def _record_activity(self, segment_start:int, sidecar:KeyframeSidecar):
+        try:
+            self._activity.add(segment_start, sidecar.get_interframe_bytes())
+
+            # Nothing to search for once retention deleted the footage, this keeps the activity index bounded too
+            oldest = self.get_oldest_video()
+            if oldest is not None:
+                self._activity.remove_before(oldest.get_timestamp())
+        except Exception as e:
+            # The segment itself is fine, only searching it is not
+            self._log_error(f'Failed to record activity: {e}')
+
+    def _count_temp_backlog(self):
+        if not os.path.isdir(self._temp_dirpath):
+            return 0
+
+        with os.scandir(self._temp_dirpath) as entries:
+            count = sum(1 for entry in entries if entry.name.endswith(self._temp_extension))
+
+        # The newest one is still being written
+        return max(count - 1, 0)
+
+    def _check_recording_started(self):
+        # FFmpeg names segments after their start time, anything from before startup was recovered instead
+        started = any(
+            filename.endswith(self._temp_extension) and filename.split('.')[0].isdigit() and int(filename.split('.')[0]) >= int(self._startup_time)
+            for filename in os.listdir(self._temp_dirpath)
+        )
+
+        if not started:
+            return
+
+        elapsed = time.monotonic() - self._startup_started
+        self._startup_started = None
+
+        _STARTUP_SECONDS.set(elapsed, monitor=self._name, phase='recording')
+        self._log_info(f'Recording {elapsed:.2f} seconds after start')
+
+    def _recover_temp_files(self):
+        # Nothing is writing to temp yet, so every file in it is left over from the previous run
+        orphans = []
+
+        for filename in sorted(os.listdir(self._temp_dirpath)):
+            filepath = os.path.join(self._temp_dirpath, filename)
+            stem = filename.split('.')[0]
+
+            if not stem.isdigit() or not os.path.isfile(filepath):
+                continue
+
+            if os.path.getsize(filepath) == 0:
+                # Opened but never written to, there is nothing to save
+                self._log_info(f'Removing empty {filename}')
+                os.remove(filepath)
+                continue
+
+            if filename.endswith(self._temp_extension):
+                orphans.append(Video(filepath))
+            elif not self._direct_mp4 and filename.endswith(self._FINAL_EXTENSION):
+                if os.path.exists(os.path.join(self._temp_dirpath, f'{stem}{self._TEMP_EXTENSION}')):
+                    # Remux interrupted half way, it is redone from the MKV
+                    self._log_info(f'Removing partial remux {filename}')
+                    os.remove(filepath)
+                else:
+                    # Remuxed in full but never moved, the MKV is only removed after the move
+                    self._log_info(f'Finalizing remuxed {filename}')
+                    self._finalize_temp_video(Video(filepath), remux=False)
+
+        return orphans
 
     def _get_completed_temp_videos(self):
-        # List of files ending in .mkv
+        # List of files ending in the temp extension
         videos = []
         for filename in os.listdir(self._temp_dirpath):
-            if not filename.endswith(self._TEMP_EXTENSION):
+            if not filename.endswith(self._temp_extension):
                 continue
 
             videos.append(Video(os.path.join(self._temp_dirpath, filename)))
@@ -213,7 +943,7 @@ class Recorder:
         ffmpeg_cmd = [
             'ffmpeg',
             '-loglevel', 'error',
-            '-threads', '2',
+            '-threads', str(self._remux_threads),
             '-i', input_path,
             '-c', 'copy',
             '-y', output_path
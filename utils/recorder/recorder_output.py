@@ -0,0 +1,111 @@
+import os
+
+from ..index import OutputIndex
+
+class RecorderOutput:
+    # Extra output of the recording FFmpeg process, fed from the same input connection
+    def __init__(self, name:str, dirpath:str, extension:str, max_age_sec:int|None=None, max_disk_bytes:int|None=None):
+        self._name = name
+        self._dirpath = dirpath
+        self._extension = extension
+        self._max_age_sec = max_age_sec
+        self._max_disk_bytes = max_disk_bytes
+
+        # Asked for on every limit check, so the listing is kept rather than redone
+        self._index = OutputIndex(dirpath, extension)
+
+    def get_name(self):
+        return self._name
+
+    def get_dirpath(self):
+        return self._dirpath
+
+    def get_max_age_sec(self):
+        return self._max_age_sec
+
+    def get_max_disk_bytes(self):
+        return self._max_disk_bytes
+
+    def is_keyframes_only(self):
+        # Whether the output is happy with only keyframes being decoded
+        return False
+
+    def get_files(self):
+        # Files ordered by date, FFmpeg names them after their start time
+        return self._index.get_videos()
+
+    def get_oldest_file(self):
+        return self._index.get_oldest_video()
+
+    def get_total_size(self):
+        return self._index.get_total_size()
+
+    def get_ffmpeg_args(self, dirpath:str|None=None):
+        raise Exception(f'RecorderOutput interface get_ffmpeg_args needs an override!')
+
+    def _get_output_path(self, dirpath:str|None):
+        dirpath = dirpath if dirpath is not None else self._dirpath
+
+        return os.path.join(dirpath, f'%s{self._extension}')
+
+class ProxyOutput(RecorderOutput):
+    def __init__(self, dirpath:str, segment_duration_sec:int, height:int=360, bitrate_kbps:int=500, max_age_sec:int|None=None, max_disk_bytes:int|None=None):
+        super().__init__('proxy', dirpath, '.mp4', max_age_sec=max_age_sec, max_disk_bytes=max_disk_bytes)
+
+        if height <= 0 or bitrate_kbps <= 0:
+            raise Exception(f'Proxy height and bitrate cannot be negative or zero!')
+
+        self._segment_duration_sec = segment_duration_sec
+        self._height = height
+        self._bitrate_kbps = bitrate_kbps
+
+    def get_ffmpeg_args(self, dirpath:str|None=None):
+        return [
+            '-map', '0:v:0',
+            '-vf', f'scale=-2:{self._height}',
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',
+            '-b:v', f'{self._bitrate_kbps}k',
+            '-maxrate', f'{self._bitrate_kbps}k',
+            '-bufsize', f'{self._bitrate_kbps * 2}k',
+            # Keyframe on every boundary so proxy segments line up with the main ones
+            '-force_key_frames', f'expr:gte(t,n_forced*{self._segment_duration_sec})',
+            '-an',
+            '-f', 'segment',
+            '-segment_time', str(self._segment_duration_sec),
+            '-strftime', '1',
+            '-segment_atclocktime', '1',
+            '-reset_timestamps', '1',
+            # Playable while still being written, there is no finalize step for proxies
+            '-segment_format', 'mp4',
+            '-segment_format_options', 'movflags=+frag_keyframe+empty_moov+default_base_moof',
+            '-y', self._get_output_path(dirpath)
+        ]
+
+class ThumbnailOutput(RecorderOutput):
+    def __init__(self, dirpath:str, interval_sec:float=10, width:int=320, quality:int=5, max_age_sec:int|None=None, max_disk_bytes:int|None=None):
+        super().__init__('thumbnails', dirpath, '.jpg', max_age_sec=max_age_sec, max_disk_bytes=max_disk_bytes)
+
+        if interval_sec <= 0 or width <= 0:
+            raise Exception(f'Thumbnail interval and width cannot be negative or zero!')
+
+        if quality < 2 or quality > 31:
+            raise Exception(f'Thumbnail quality must be between 2 and 31!')
+
+        self._interval_sec = interval_sec
+        self._width = width
+        self._quality = quality
+
+    def is_keyframes_only(self):
+        # A thumbnail every few seconds does not need every frame decoded
+        return True
+
+    def get_ffmpeg_args(self, dirpath:str|None=None):
+        return [
+            '-map', '0:v:0',
+            '-vf', f'fps=1/{self._interval_sec},scale={self._width}:-2',
+            '-q:v', str(self._quality),
+            '-f', 'image2',
+            '-strftime', '1',
+            '-y', self._get_output_path(dirpath)
+        ]
@@ -0,0 +1,4 @@
+from .scheduling_class import SchedulingClass
+from .throttle import Throttle
+
+__all__ = [ 'SchedulingClass', 'Throttle' ]
@@ -0,0 +1,126 @@
+import ctypes, os, platform
+
+class SchedulingClass:
+    # Same names as ionice
+    IO_CLASSES = { 'realtime': 1, 'best-effort': 2, 'idle': 3 }
+
+    # Kernel default level within a class, lower is served first
+    _IO_LEVEL_DEFAULT = 4
+    _IOPRIO_CLASS_SHIFT = 13
+    _IOPRIO_WHO_PROCESS = 1
+
+    # (ioprio_set, ioprio_get), there is no Python binding for either
+    _IOPRIO_SYSCALLS = {
+        'x86_64': (251, 252),
+        'i686': (289, 290),
+        'i386': (289, 290),
+        'aarch64': (30, 31),
+        'riscv64': (30, 31),
+        'armv7l': (314, 315),
+        'armv6l': (314, 315),
+    }
+
+    _libc = None
+
+    def __init__(self, name:str, nice:int|None=None, io_class:str|None=None, io_level:int|None=None):
+        if nice is not None and not -20 <= nice <= 19:
+            raise Exception(f'Nice value must be between -20 and 19!')
+
+        if io_class is not None and io_class not in self.IO_CLASSES:
+            raise Exception(f'I/O class must be one of {list(self.IO_CLASSES)}!')
+
+        if io_level is not None and not 0 <= io_level <= 7:
+            raise Exception(f'I/O level must be between 0 and 7!')
+
+        self._name = name
+        self._nice = nice
+        self._io_class = io_class
+
+        # Idle has no levels
+        self._io_level = 0 if io_class == 'idle' else io_level if io_level is not None else self._IO_LEVEL_DEFAULT
+
+    def get_name(self):
+        return self._name
+
+    def get_nice(self):
+        return self._nice
+
+    def get_io_class(self):
+        return self._io_class
+
+    def __str__(self):
+        settings = []
+        if self._nice is not None:
+            settings.append(f'nice {self._nice}')
+
+        if self._io_class is not None:
+            settings.append(f'I/O {self._io_class}' + (f' {self._io_level}' if self._io_class != 'idle' else ''))
+
+        return f'{self._name} ({", ".join(settings) if len(settings) > 0 else "inherited"})'
+
+    def apply(self, pid:int=0):
+        # Nice value and I/O class of one thread, 0 for the calling one. Processes it starts afterwards inherit both.
+        # Raising priority needs CAP_SYS_NICE, lowering it never does, so each half is tried on its own
+        errors = []
+
+        if self._nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, pid, self._nice)
+            except ProcessLookupError:
+                raise
+            except OSError as e:
+                errors.append(f'nice {self._nice}: {e}')
+
+        if self._io_class is not None:
+            try:
+                self._call_ioprio(0, self._IOPRIO_WHO_PROCESS, pid, self._get_ioprio())
+            except ProcessLookupError:
+                raise
+            except Exception as e:
+                errors.append(f'I/O class {self._io_class}: {e}')
+
+        if len(errors) > 0:
+            raise Exception(f'Failed to apply scheduling class {self._name}: {"; ".join(errors)}!')
+
+    def apply_to_process(self, pid:int):
+        # Every thread of another process, both settings are per thread. The main thread goes first so any thread it
+        # starts from then on inherits the class. Raises ProcessLookupError once the process is gone
+        self.apply(pid)
+
+        try:
+            tids = [ int(tid) for tid in os.listdir(f'/proc/{pid}/task') ]
+        except FileNotFoundError:
+            raise ProcessLookupError(f'Process {pid} has exited')
+
+        for tid in tids:
+            if tid == pid:
+                continue
+
+            try:
+                self.apply(tid)
+            except ProcessLookupError:
+                # Thread exited in between
+                pass
+
+    def _get_ioprio(self):
+        return (self.IO_CLASSES[self._io_class] << self._IOPRIO_CLASS_SHIFT) | self._io_level
+
+    @classmethod
+    def _get_libc(cls):
+        if cls._libc is None:
+            cls._libc = ctypes.CDLL(None, use_errno=True)
+
+        return cls._libc
+
+    @classmethod
+    def _call_ioprio(cls, call:int, *args):
+        machine = platform.machine()
+        if machine not in cls._IOPRIO_SYSCALLS:
+            raise Exception(f'I/O classes are not supported on {machine}!')
+
+        result = cls._get_libc().syscall(cls._IOPRIO_SYSCALLS[machine][call], *args)
+        if result < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        return result
@@ -0,0 +1,62 @@
+import threading, time
+
+from ..metrics import Registry
+
+_METRICS = Registry.get_default()
+_DEFERRED = _METRICS.counter('nvr_deferred_total', 'Times background work was held back to stay under its rate limit', [ 'work' ])
+_DEFERRED_SECONDS = _METRICS.counter('nvr_deferred_seconds_total', 'Time background work was held back to stay under its rate limit', [ 'work' ])
+
+class Throttle:
+    # Token bucket shared by every thread doing one kind of work, bursts are capped at one second's worth
+    def __init__(self, name:str, rate_per_sec:float):
+        if rate_per_sec <= 0:
+            raise Exception(f'Throttle rate cannot be negative or zero!')
+
+        self._name = name
+        self._rate_per_sec = rate_per_sec
+
+        self._lock = threading.Lock()
+        self._tokens = rate_per_sec
+        self._updated = time.monotonic()
+
+        self._deferred_sec = 0.0
+
+    def get_name(self):
+        return self._name
+
+    def get_rate_per_sec(self):
+        return self._rate_per_sec
+
+    def get_deferred_sec(self):
+        return self._deferred_sec
+
+    def acquire(self, amount:float, stop_event:threading.Event|None=None):
+        # Blocks until the work fits under the rate, returns how long it was held back. The bucket may go into
+        # debt for work larger than a burst, whoever comes next waits it off, so callers are served in order.
+        # Setting the stop event ends the wait early, callers should check it before doing the work
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self._rate_per_sec, self._rate_per_sec)
+            self._updated = now
+
+            self._tokens -= amount
+            wait_sec = -self._tokens / self._rate_per_sec if self._tokens < 0 else 0.0
+
+        if wait_sec <= 0:
+            return 0.0
+
+        started = time.monotonic()
+        if stop_event is not None:
+            stop_event.wait(wait_sec)
+        else:
+            time.sleep(wait_sec)
+
+        waited_sec = time.monotonic() - started
+
+        with self._lock:
+            self._deferred_sec += waited_sec
+
+        _DEFERRED.inc(work=self._name)
+        _DEFERRED_SECONDS.inc(waited_sec, work=self._name)
+
+        return waited_sec
@@ -0,0 +1,3 @@
+from .shard_coordinator import ShardCoordinator, ShardWorker
+
+__all__ = [ 'ShardCoordinator', 'ShardWorker' ]
@@ -0,0 +1,288 @@
+import os, queue, signal, threading, time
+import multiprocessing
+
+from ..logger import Logger
+from ..video import Video
+from ..metrics import Registry
+
+_METRICS = Registry.get_default()
+_SHARD_UP = _METRICS.gauge('nvr_shard_up', 'Whether the worker process of a shard is running', [ 'shard' ])
+_SHARD_RESTARTS = _METRICS.counter('nvr_shard_restarts_total', 'Worker processes restarted after exiting unexpectedly', [ 'shard' ])
+_SHARD_SEGMENTS = _METRICS.counter('nvr_shard_segments_total', 'Segments reported by a shard', [ 'shard' ])
+_SHARD_BYTES = _METRICS.counter('nvr_shard_segment_bytes_total', 'Bytes of the segments reported by a shard', [ 'shard' ])
+
+class ShardCoordinator:
+    # Restart backoff for crashing workers, reset once a worker stays up long enough
+    _MIN_BACKOFF_SEC = 1
+    _MAX_BACKOFF_SEC = 60
+    _STABLE_SEC = 60
+
+    # How long a worker gets to stop its recorders and finalize before its process group is killed
+    _STOP_TIMEOUT_SEC = 30
+
+    _POLL_INTERVAL_SEC = 1
+
+    def __init__(self, logger:Logger, target, shards:list[list[str]], args:tuple=(), cpus:list[list[int]]|None=None):
+        # target(*args, shard, monitor names, cpus, events) runs a worker, in a fresh process
+        self._logger = logger
+        self._target = target
+        self._shards = shards
+        self._args = args
+        self._cpus = cpus
+
+        # Spawned rather than forked, the coordinator has threads that a fork would copy mid-flight
+        self._context = multiprocessing.get_context('spawn')
+        self._events = None
+
+        self._lock = threading.Lock()
+        self._is_running = False
+        self._stop_event = threading.Event()
+        self._watcher = None
+
+        # Events are read until every worker is gone, a worker blocks on exit until its queue is flushed
+        self._reader_stop_event = threading.Event()
+        self._reader = None
+
+        # Per shard: process, when it started, current backoff and when it may be restarted
+        self._processes = {}
+        self._started_at = {}
+        self._backoff_sec = {}
+        self._restart_at = {}
+
+        # Last metrics text each worker pushed, and the functions merging them into this process' registry
+        self._metrics_texts = {}
+        self._metrics_functions = {}
+
+        # Called with each video a worker finalized, from the event reader thread
+        self._segment_listeners = []
+
+    def get_shard_count(self):
+        return len(self._shards)
+
+    def get_monitors(self, shard:int):
+        return list(self._shards[shard])
+
+    def add_segment_listener(self, listener):
+        self._segment_listeners.append(listener)
+
+    def remove_segment_listener(self, listener):
+        if listener in self._segment_listeners:
+            self._segment_listeners.remove(listener)
+
+    def start(self):
+        with self._lock:
+            if self._is_running:
+                raise Exception(f'Shard coordinator is already running!')
+
+            self._is_running = True
+
+        self._stop_event.clear()
+        self._reader_stop_event.clear()
+        self._events = self._context.Queue()
+
+        for shard in range(len(self._shards)):
+            self._backoff_sec[shard] = self._MIN_BACKOFF_SEC
+            self._metrics_functions[shard] = self._get_metrics_function(shard)
+            _METRICS.add_remote(self._metrics_functions[shard], shard=str(shard))
+            self._start_worker(shard)
+
+        self._reader = threading.Thread(target=self._read_events, daemon=True)
+        self._reader.start()
+
+        self._watcher = threading.Thread(target=self._watch_workers, daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        with self._lock:
+            self._is_running = False
+
+        # No more restarts from here on
+        self._stop_event.set()
+
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+        # Ask every worker at once, they stop their recorders in parallel
+        for shard, process in self._processes.items():
+            if process.is_alive():
+                self._log_info(f'Stopping shard {shard}...')
+                process.terminate()
+
+        deadline = time.monotonic() + self._STOP_TIMEOUT_SEC
+        for shard, process in self._processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+
+            if process.is_alive():
+                self._log_warning(f'Shard {shard} did not stop in time, killing it')
+
+            self._kill_process_group(process)
+            _SHARD_UP.set(0, shard=str(shard))
+
+        self._reader_stop_event.set()
+
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+
+        for function in self._metrics_functions.values():
+            _METRICS.remove_remote(function)
+
+        self._processes = {}
+        self._restart_at = {}
+        self._metrics_texts = {}
+        self._metrics_functions = {}
+
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+
+    def _log_info(self, message):
+        self._logger.log_info(f'Shards: {message}')
+
+    def _log_warning(self, message):
+        self._logger.log_warning(f'Shards: {message}')
+
+    def _get_metrics_function(self, shard:int):
+        return lambda: self._metrics_texts.get(shard)
+
+    def _start_worker(self, shard:int):
+        cpus = self._cpus[shard] if self._cpus is not None else None
+
+        process = self._context.Process(target=self._target, args=(*self._args, shard, self._shards[shard], cpus, self._events), name=f'nvr-shard-{shard}', daemon=False)
+        process.start()
+
+        self._processes[shard] = process
+        self._started_at[shard] = time.monotonic()
+        self._metrics_texts.pop(shard, None)
+        _SHARD_UP.set(1, shard=str(shard))
+
+        self._log_info(f'Started shard {shard} as pid {process.pid} with {len(self._shards[shard])} monitors{f" on CPUs {cpus}" if cpus is not None else ""}')
+
+    def _watch_workers(self):
+        while not self._stop_event.wait(self._POLL_INTERVAL_SEC):
+            now = time.monotonic()
+
+            for shard, process in list(self._processes.items()):
+                if shard in self._restart_at:
+                    if now >= self._restart_at[shard] and not self._stop_event.is_set():
+                        del self._restart_at[shard]
+                        _SHARD_RESTARTS.inc(shard=str(shard))
+                        self._start_worker(shard)
+
+                    continue
+
+                if process.is_alive():
+                    # Stayed up long enough, the next crash starts from the shortest backoff again
+                    if now - self._started_at[shard] >= self._STABLE_SEC:
+                        self._backoff_sec[shard] = self._MIN_BACKOFF_SEC
+
+                    continue
+
+                # Only this shard's monitors are affected, the other workers keep recording
+                self._log_warning(f'Shard {shard} exited unexpectedly with code {process.exitcode}, restarting in {self._backoff_sec[shard]} seconds')
+
+                self._kill_process_group(process)
+                _SHARD_UP.set(0, shard=str(shard))
+
+                self._restart_at[shard] = now + self._backoff_sec[shard]
+                self._backoff_sec[shard] = min(self._backoff_sec[shard] * 2, self._MAX_BACKOFF_SEC)
+
+    def _kill_process_group(self, process):
+        # Workers lead their own process group, so FFmpeg processes orphaned by a crash go with it. Otherwise
+        # they would keep recording alongside the restarted worker's
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+        process.join()
+
+    def _read_events(self):
+        while not self._reader_stop_event.is_set():
+            try:
+                event = self._events.get(timeout=self._POLL_INTERVAL_SEC)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+
+            try:
+                self._handle_event(event)
+            except Exception as e:
+                self._log_warning(f'Failed to handle event {event[0]}: {e}')
+
+    def _handle_event(self, event:tuple):
+        if event[0] == ShardWorker.SEGMENT_EVENT:
+            (_, shard, monitor, filepath, size, duration) = event
+
+            _SHARD_SEGMENTS.inc(shard=str(shard))
+            _SHARD_BYTES.inc(size, shard=str(shard))
+
+            video = Video(filepath, size=size, monitor=monitor, duration=duration)
+            for listener in list(self._segment_listeners):
+                listener(video)
+        elif event[0] == ShardWorker.METRICS_EVENT:
+            (_, shard, text) = event
+
+            self._metrics_texts[shard] = text
+
+class ShardWorker:
+    # Runs inside a worker process, reports to the coordinator over its event queue
+    SEGMENT_EVENT = 'segment'
+    METRICS_EVENT = 'metrics'
+
+    def __init__(self, logger:Logger, shard:int, recorders:dict, events, metrics_interval_sec:float|None=None):
+        self._logger = logger
+        self._shard = shard
+        self._recorders = recorders
+        self._events = events
+        self._metrics_interval_sec = metrics_interval_sec
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def setup_process(cls, cpus:list[int]|None=None):
+        # First thing in a worker process. Leading its own process group lets the coordinator take the worker's
+        # FFmpeg processes down with it, and FFmpeg inherits the CPU affinity
+        os.setpgrp()
+
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+
+    def start(self):
+        for recorder in self._recorders.values():
+            recorder.add_segment_listener(self._on_segment_added)
+
+        self._stop_event.clear()
+
+        if self._metrics_interval_sec is not None:
+            self._thread = threading.Thread(target=self._run_metrics_reporter, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        for recorder in self._recorders.values():
+            recorder.remove_segment_listener(self._on_segment_added)
+
+    def _on_segment_added(self, video:Video):
+        # Called from finalizer threads, the coordinator's retention only needs to know which monitor grew and by how much
+        try:
+            self._events.put((self.SEGMENT_EVENT, self._shard, video.get_monitor(), video.get_filepath(), video.get_size(), video.get_duration()))
+        except Exception as e:
+            self._logger.log_warning(f'Failed to report segment to coordinator: {e}')
+
+    def _run_metrics_reporter(self):
+        while not self._stop_event.is_set():
+            try:
+                self._events.put((self.METRICS_EVENT, self._shard, Registry.get_default().collect()))
+            except Exception as e:
+                self._logger.log_warning(f'Failed to report metrics to coordinator: {e}')
+
+            self._stop_event.wait(self._metrics_interval_sec)
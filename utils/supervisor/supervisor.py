@@ -0,0 +1,382 @@
+import asyncio, os, signal, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from ..logger import Logger
+from ..recorder import Recorder
+from ..finalizer import Finalizer
+from ..migrator import TierMigrator
+from ..shard import ShardCoordinator
+from ..limit_manager import LimitManager
+from ..watcher import DirectoryWatcher
+from ..scheduling import SchedulingClass
+
+class Supervisor:
+    # Bounds on how long incremental retention sleeps, the minimum avoids spinning on a video that fails to delete
+    _MIN_IDLE_SEC = 1
+    _MAX_IDLE_SEC = 3600
+
+    # Editors often write a file in several steps, wait for them to settle before reloading
+    _RELOAD_SETTLE_SEC = 1
+
+    def __init__(self, logger:Logger, recorders:dict[str, Recorder], limit_checkers:list[LimitManager], finalizer:Finalizer|None=None, limit_interval_sec:float|None=None, migrator:TierMigrator|None=None, reloader=None, watch_filepath:str|None=None, coordinator:ShardCoordinator|None=None, retention_class:SchedulingClass|None=None):
+        self._logger = logger
+        self._recorders = recorders
+        self._limit_checkers = limit_checkers
+        self._finalizer = finalizer
+        self._migrator = migrator
+
+        # Worker processes recording the monitors of other shards, their segments count towards the limits here
+        self._coordinator = coordinator
+
+        # None for incremental retention, otherwise a full sweep every interval
+        self._limit_interval_sec = limit_interval_sec
+        self._limit_wake = None
+        self._dirty_monitors = set()
+        self._expiries = {}
+        self._force_limit_check = True
+
+        # Retry delay of checkers whose oldest video was still expired after a pass, e.g. one on a read only mount
+        self._expiry_backoffs = {}
+
+        # Limit checks get a thread of their own, so deletions can run in a lower scheduling class than the rest
+        self._retention_class = retention_class
+        self._limit_executor = None
+
+        # Called off the loop with the running recorders, returns the new recorders and limit checkers
+        # Recorders that are kept must be handed back as the same objects, None disables reloading
+        self._reloader = reloader
+        self._watch_filepath = watch_filepath
+        self._reload_wake = None
+
+        self._loop = None
+        self._stop_event = None
+        self._stopped = threading.Event()
+        self._recorder_tasks = {}
+
+    def is_running(self):
+        return self._loop is not None
+
+    def start(self):
+        # Blocking, every recorder and the limit checkers share this one event loop
+        asyncio.run(self.run())
+
+    def stop(self):
+        # Safe to call from any thread
+        loop = self._loop
+        if loop is None:
+            return
+
+        loop.call_soon_threadsafe(self.request_stop)
+        self._stopped.wait()
+
+    def request_stop(self):
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    def request_reload(self):
+        # Must be called on the supervisor's event loop
+        if self._reload_wake is not None:
+            self._reload_wake.set()
+
+    async def run(self):
+        try:
+            self._log_info('Starting NVR...')
+
+            if self.is_running():
+                raise Exception(f'NVR is already running!')
+
+            self._loop = asyncio.get_running_loop()
+            self._stop_event = asyncio.Event()
+            self._limit_wake = asyncio.Event()
+            self._reload_wake = asyncio.Event()
+            self._stopped.clear()
+
+            for sig in [ signal.SIGINT, signal.SIGTERM ]:
+                self._loop.add_signal_handler(sig, self.request_stop)
+
+            if self._reloader is not None:
+                self._loop.add_signal_handler(signal.SIGHUP, self.request_reload)
+
+            if self._finalizer is not None:
+                self._log_info('Starting finalizer...')
+                self._finalizer.start()
+
+            if self._migrator is not None:
+                # Videos landing on a tier count towards its limits just like new segments
+                self._log_info('Starting migrator...')
+                self._migrator.add_migration_listener(self._on_segment_added)
+                self._migrator.start()
+
+            if self._coordinator is not None:
+                self._log_info('Starting shards...')
+                self._coordinator.add_segment_listener(self._on_segment_added)
+                await asyncio.to_thread(self._coordinator.start)
+
+            self._log_info('Starting recorders...')
+            for name, recorder in self._recorders.items():
+                recorder.add_segment_listener(self._on_segment_added)
+                self._recorder_tasks[name] = asyncio.create_task(self._supervise_recorder(recorder))
+
+            self._log_info('Starting limit checkers...')
+            self._limit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='limit-checker', initializer=self._apply_retention_class)
+            limit_task = asyncio.create_task(self._run_limit_checkers())
+
+            reload_tasks = []
+            if self._reloader is not None:
+                reload_tasks.append(asyncio.create_task(self._run_reloads()))
+
+                if self._watch_filepath is not None:
+                    reload_tasks.append(asyncio.create_task(self._run_config_watcher()))
+
+            self._log_info('NVR has started!')
+
+            await self._stop_event.wait()
+
+            self._log_info('Stopping NVR...')
+
+            # Let a reload in progress finish, so no recorder it started is left behind
+            await asyncio.gather(*reload_tasks, return_exceptions=True)
+
+            self._log_info('Stopping recorders...')
+            for recorder in self._recorders.values():
+                recorder.request_stop()
+
+            await asyncio.gather(*self._recorder_tasks.values(), return_exceptions=True)
+            self._recorder_tasks = {}
+
+            for recorder in self._recorders.values():
+                recorder.remove_segment_listener(self._on_segment_added)
+
+            if self._coordinator is not None:
+                self._log_info('Stopping shards...')
+                await asyncio.to_thread(self._coordinator.stop)
+                self._coordinator.remove_segment_listener(self._on_segment_added)
+
+            if self._finalizer is not None:
+                self._log_info('Stopping finalizer...')
+                await asyncio.to_thread(self._finalizer.stop)
+
+            self._log_info('Waiting for limit checkers to stop...')
+            for limit_checker in self._limit_checkers:
+                limit_checker.request_stop()
+
+            await limit_task
+            self._limit_executor.shutdown()
+            self._limit_executor = None
+
+            if self._migrator is not None:
+                self._log_info('Stopping migrator...')
+                await asyncio.to_thread(self._migrator.stop)
+                self._migrator.remove_migration_listener(self._on_segment_added)
+
+            self._log_info('NVR has stopped!')
+        finally:
+            if self._loop is not None:
+                for sig in [ signal.SIGINT, signal.SIGTERM, signal.SIGHUP ]:
+                    self._loop.remove_signal_handler(sig)
+
+            self._loop = None
+            self._reload_wake = None
+            self._stopped.set()
+
+    def _log_info(self, message):
+        self._logger.log_info(message)
+
+    def _log_warning(self, message):
+        self._logger.log_warning(message)
+
+    async def _supervise_recorder(self, recorder:Recorder):
+        try:
+            await recorder.run()
+        except Exception as e:
+            # Already logged by the recorder, keep the others going
+            self._log_warning(f'Recorder stopped unexpectedly: {e}')
+
+    def _on_segment_added(self, video):
+        # Called from finalizer threads
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._mark_dirty, video.get_monitor())
+
+    def _mark_dirty(self, monitor:str):
+        self._dirty_monitors.add(monitor)
+        self._limit_wake.set()
+
+    async def _run_reloads(self):
+        while not self._stop_event.is_set():
+            await self._wait_for(self._reload_wake, None)
+            if self._stop_event.is_set():
+                return
+
+            self._reload_wake.clear()
+
+            try:
+                await self._reload()
+            except Exception as e:
+                self._log_warning(f'Failed to reload: {e}')
+
+    async def _reload(self):
+        self._log_info('Reloading config...')
+
+        try:
+            (recorders, limit_checkers) = await asyncio.to_thread(self._reloader, dict(self._recorders))
+        except Exception as e:
+            # Keep running on the old config
+            raise Exception(f'New config rejected: {e}')
+
+        # Anything not handed back as the same object is gone or changed
+        stopped = [ name for name, recorder in self._recorders.items() if recorders.get(name) is not recorder ]
+        started = [ name for name, recorder in recorders.items() if self._recorders.get(name) is not recorder ]
+
+        for name in stopped:
+            self._log_info(f'Stopping recorder {name}...')
+
+            recorder = self._recorders[name]
+            recorder.request_stop()
+            await asyncio.gather(self._recorder_tasks.pop(name), return_exceptions=True)
+
+            recorder.remove_segment_listener(self._on_segment_added)
+            recorder.close(remove_metrics=name not in recorders)
+
+        self._recorders = recorders
+
+        # Fresh limit checkers, with a full pass so the new limits apply straight away
+        self._limit_checkers = limit_checkers
+        self._expiries = {}
+        self._expiry_backoffs = {}
+        self._force_limit_check = True
+        self._limit_wake.set()
+
+        for name in started:
+            self._log_info(f'Starting recorder {name}...')
+
+            recorder = self._recorders[name]
+            recorder.add_segment_listener(self._on_segment_added)
+            self._recorder_tasks[name] = asyncio.create_task(self._supervise_recorder(recorder))
+
+        self._log_info(f'Config reloaded, {len(started)} recorders started, {len(stopped)} stopped, {len(recorders) - len(started)} untouched')
+
+    async def _run_config_watcher(self):
+        # Watch the directory rather than the file, editors and config management replace it with a rename
+        (dirpath, filename) = os.path.split(self._watch_filepath)
+        readable = asyncio.Event()
+
+        with DirectoryWatcher(dirpath, DirectoryWatcher.IN_CLOSE_WRITE | DirectoryWatcher.IN_MOVED_TO) as watcher:
+            if watcher.is_polling():
+                self._log_info(f'inotify unavailable ({watcher.get_error()}), polling {self._watch_filepath} instead')
+            else:
+                self._loop.add_reader(watcher.fileno(), readable.set)
+
+            try:
+                last_mtime = self._get_mtime(self._watch_filepath)
+
+                while not self._stop_event.is_set():
+                    if watcher.is_polling():
+                        await self._wait_for(None, 5)
+                    else:
+                        await self._wait_for(readable, None)
+                        readable.clear()
+
+                        if not any(name == filename for (mask, name) in watcher.read_events()):
+                            continue
+
+                    await self._wait_for(None, self._RELOAD_SETTLE_SEC)
+
+                    mtime = self._get_mtime(self._watch_filepath)
+                    if mtime is not None and mtime != last_mtime:
+                        last_mtime = mtime
+                        self.request_reload()
+            finally:
+                if not watcher.is_polling():
+                    self._loop.remove_reader(watcher.fileno())
+
+    def _get_mtime(self, filepath:str):
+        try:
+            return os.stat(filepath).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    async def _wait_for(self, event:asyncio.Event|None, timeout:float|None):
+        # Wait that returns early once the supervisor is asked to stop
+        waiters = [ asyncio.create_task(self._stop_event.wait()) ]
+        if event is not None:
+            waiters.append(asyncio.create_task(event.wait()))
+
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def _run_limit_checkers(self):
+        # Full pass on startup and after a reload, incremental mode then only acts on new segments and expiries
+        while not self._stop_event.is_set():
+            force = self._force_limit_check or self._limit_interval_sec is not None
+            self._force_limit_check = False
+
+            dirty = self._dirty_monitors
+            self._dirty_monitors = set()
+            self._limit_wake.clear()
+
+            # Deletions block on disk, keep them off the loop
+            await self._loop.run_in_executor(self._limit_executor, self._check_limits, dirty, force)
+
+            if self._limit_interval_sec is not None:
+                timeout = self._limit_interval_sec
+            else:
+                # Sleep until the next video expires, or until a new segment lands
+                expiries = [ self._expiries.get(limit_checker) for limit_checker in self._limit_checkers ]
+                expiries = [ expiry for expiry in expiries if expiry is not None ]
+                timeout = min(expiries) - time.time() if len(expiries) > 0 else self._MAX_IDLE_SEC
+                timeout = min(max(timeout, self._MIN_IDLE_SEC), self._MAX_IDLE_SEC)
+
+            await self._wait_for_limit_wake(timeout)
+
+    def _apply_retention_class(self):
+        if self._retention_class is None:
+            return
+
+        try:
+            self._retention_class.apply()
+            self._log_info(f'Limit checkers run with scheduling class {self._retention_class}')
+        except Exception as e:
+            self._log_warning(f'{e}')
+
+    def _check_limits(self, dirty:set, force:bool):
+        now = time.time()
+
+        for limit_checker in self._limit_checkers:
+            try:
+                touched = len(dirty & limit_checker.get_monitors()) > 0
+                expiry = self._expiries.get(limit_checker)
+                expired = expiry is not None and expiry <= now
+
+                ran = force or expired or (touched and limit_checker.is_over_storage_limit())
+                if ran:
+                    limit_checker.run()
+
+                if force or expired or touched:
+                    self._expiries[limit_checker] = self._get_next_expiry(limit_checker, ran)
+            except Exception as e:
+                self._log_warning(f'Failed to check limits: {e}')
+
+    def _get_next_expiry(self, limit_checker:LimitManager, ran:bool):
+        expiry = limit_checker.get_next_expiry()
+        now = time.time()
+
+        if expiry is None or expiry > now:
+            self._expiry_backoffs.pop(limit_checker, None)
+            return expiry
+
+        if not ran:
+            # Woken by a new segment while backing off, keep the retry where it was
+            return self._expiries.get(limit_checker) if limit_checker in self._expiry_backoffs else expiry
+
+        # The pass could not remove what had expired, retrying every second would only log the same failure
+        backoff = min(self._expiry_backoffs.get(limit_checker, self._MIN_IDLE_SEC) * 2, self._MAX_IDLE_SEC)
+        self._expiry_backoffs[limit_checker] = backoff
+
+        return now + backoff
+
+    async def _wait_for_limit_wake(self, timeout:float):
+        await self._wait_for(self._limit_wake if self._limit_interval_sec is None else None, timeout)
\ No newline at end of file
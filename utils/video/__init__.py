@@ -1,3 +1,4 @@
 from .video import Video
+from .keyframe_sidecar import KeyframeSidecar
 
-__all__ = [ 'Video' ]
\ No newline at end of file
+__all__ = [ 'Video', 'KeyframeSidecar' ]
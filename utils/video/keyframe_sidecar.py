@@ -0,0 +1,123 @@
+import bisect, os, struct, subprocess
+
+class KeyframeSidecar:
+    # Small binary file next to each segment: real duration plus PTS and byte offset of every video keyframe
+    EXTENSION = '.kfi'
+
+    _MAGIC = b'NVRK'
+    _VERSION = 1
+    _HEADER = struct.Struct('<4sB3xdI')
+    _ENTRY = struct.Struct('<dq')
+
+    def __init__(self, duration:float, keyframes:list[tuple[float, int]], interframe_bytes:list[int]|None=None):
+        self._duration = duration
+        self._keyframes = keyframes
+        self._pts = [ pts for (pts, pos) in keyframes ]
+
+        # Bytes of non keyframe packets in each second of the segment, they grow with motion. Only known
+        # straight after probing, it is not part of the file
+        self._interframe_bytes = interframe_bytes
+
+    @classmethod
+    def get_filepath(cls, video_filepath:str):
+        return os.path.splitext(video_filepath)[0] + cls.EXTENSION
+
+    @classmethod
+    def probe(cls, video_filepath:str):
+        # One ffprobe pass over the packet headers, nothing is decoded
+        ffprobe_cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,duration_time,size,pos,flags',
+            '-of', 'csv=p=0',
+            video_filepath
+        ]
+
+        proc = subprocess.run(ffprobe_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            stderr = proc.stderr.decode('utf-8', errors='replace').strip()
+            raise Exception(f'Failed to probe {video_filepath}: {stderr}')
+
+        keyframes = []
+        interframes = []
+        (first_pts, end_pts) = (None, None)
+
+        for line in proc.stdout.decode('utf-8', errors='replace').splitlines():
+            fields = line.split(',')
+            if len(fields) < 5 or fields[0] in ('', 'N/A'):
+                continue
+
+            (pts, duration, size, pos, flags) = (float(fields[0]), fields[1], fields[2], fields[3], fields[4])
+            duration = float(duration) if duration not in ('', 'N/A') else 0.0
+
+            first_pts = pts if first_pts is None else min(first_pts, pts)
+            end_pts = pts + duration if end_pts is None else max(end_pts, pts + duration)
+
+            if 'K' in flags:
+                if pos not in ('', 'N/A'):
+                    keyframes.append((pts, int(pos)))
+            elif size not in ('', 'N/A'):
+                interframes.append((pts, int(size)))
+
+        if first_pts is None:
+            raise Exception(f'No video packets in {video_filepath}!')
+
+        # Relative to the start of the segment, which is what the filename timestamp marks
+        keyframes = sorted((pts - first_pts, pos) for (pts, pos) in keyframes)
+
+        interframe_bytes = [ 0 ] * max(int(end_pts - first_pts) + 1, 1)
+        for (pts, size) in interframes:
+            interframe_bytes[min(int(pts - first_pts), len(interframe_bytes) - 1)] += size
+
+        return cls(end_pts - first_pts, keyframes, interframe_bytes=interframe_bytes)
+
+    @classmethod
+    def read(cls, filepath:str):
+        with open(filepath, 'rb') as f:
+            data = f.read()
+
+        (magic, version, duration, count) = cls._HEADER.unpack_from(data, 0)
+        if magic != cls._MAGIC or version != cls._VERSION:
+            raise Exception(f'{filepath} is not a keyframe sidecar!')
+
+        keyframes = list(cls._ENTRY.iter_unpack(data[cls._HEADER.size:cls._HEADER.size + count * cls._ENTRY.size]))
+
+        return cls(duration, keyframes)
+
+    @classmethod
+    def read_duration(cls, filepath:str):
+        # Header only, for callers that do not need the keyframes
+        with open(filepath, 'rb') as f:
+            (magic, version, duration, count) = cls._HEADER.unpack(f.read(cls._HEADER.size))
+
+        if magic != cls._MAGIC or version != cls._VERSION:
+            raise Exception(f'{filepath} is not a keyframe sidecar!')
+
+        return duration
+
+    def write(self, filepath:str):
+        data = bytearray(self._HEADER.pack(self._MAGIC, self._VERSION, self._duration, len(self._keyframes)))
+        for (pts, pos) in self._keyframes:
+            data += self._ENTRY.pack(pts, pos)
+
+        # Write then rename so readers never see a half written sidecar
+        temp_path = f'{filepath}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+
+        os.replace(temp_path, filepath)
+
+    def get_duration(self):
+        return self._duration
+
+    def get_interframe_bytes(self):
+        return list(self._interframe_bytes) if self._interframe_bytes is not None else None
+
+    def find_keyframe(self, offset_sec:float):
+        # Last keyframe at or before the offset into the segment, as (pts, byte offset)
+        i = bisect.bisect_right(self._pts, offset_sec) - 1
+        if i < 0:
+            return self._keyframes[0] if len(self._keyframes) > 0 else None
+
+        return self._keyframes[i]
@@ -1,11 +1,28 @@
 from __future__ import annotations
 
-import os, shutil
+import os, shutil, time
 from datetime import datetime, timezone
 
+from .keyframe_sidecar import KeyframeSidecar
+
 class Video:
-    def __init__(self, filepath):
+    # Many thousands of these are held at once by the index and limit managers
+    __slots__ = ('_filepath', '_index', '_timestamp', '_size', '_mtime', '_monitor', '_duration')
+
+    def __init__(self, filepath, index=None, timestamp:int|None=None, size:int|None=None, mtime:float|None=None, monitor:str|None=None, duration:float|None=None):
         self._filepath = filepath
+        self._index = index
+        self._monitor = monitor
+
+        # Real duration from the keyframe sidecar, None when not known
+        self._duration = duration
+
+        # Parse the epoch once, everything else compares on the integer
+        self._timestamp = timestamp if timestamp is not None else int(os.path.basename(filepath).split('.')[0])
+
+        # Filled lazily by a single stat if not known up front
+        self._size = size
+        self._mtime = mtime
 
     def get_filepath(self):
         return self._filepath
@@ -16,13 +33,35 @@ class Video:
     def get_filename(self):
         return os.path.basename(self._filepath)
 
+    def get_index(self):
+        return self._index
+
+    def get_monitor(self):
+        return self._monitor
+
     def get_size(self):
-        return os.path.getsize(self._filepath)
+        if self._size is None:
+            self._stat()
 
-    def get_datetime(self):
-        unix_timestamp = int(self.get_filename().split('.')[0])
+        return self._size
+
+    def get_duration(self):
+        return self._duration
+
+    def get_sidecar_filepath(self):
+        return os.path.splitext(self._filepath)[0] + KeyframeSidecar.EXTENSION
+
+    def get_mtime(self):
+        if self._mtime is None:
+            self._stat()
 
-        return datetime.fromtimestamp(unix_timestamp, tz=timezone.utc)
+        return self._mtime
+
+    def get_timestamp(self):
+        return self._timestamp
+
+    def get_datetime(self):
+        return datetime.fromtimestamp(self.get_timestamp(), tz=timezone.utc)
 
     def get_age(self):
         now = datetime.now(tz=timezone.utc)
@@ -30,19 +69,50 @@ class Video:
         return now - self.get_datetime()
 
     def get_age_seconds(self):
-        return self.get_age().total_seconds()
+        return time.time() - self._timestamp
+
+    @staticmethod
+    def parse_time(value:str):
+        # Unix time, or an ISO 8601 date and time which is taken as local time unless it has an offset
+        try:
+            return float(value)
+        except ValueError:
+            pass
+
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            raise ValueError(f'"{value}" is neither unix time nor an ISO 8601 date and time')
 
     def exists(self):
         return os.path.exists(self._filepath)
 
     def delete(self):
         if not self.exists():
+            # Drop stale entry so the index does not keep pointing at it
+            if self._index is not None:
+                self._index.remove(self)
+
             raise Exception(f'Video does not exist at current location!')
 
         os.remove(self._filepath)
 
+        try:
+            os.remove(self.get_sidecar_filepath())
+        except FileNotFoundError:
+            pass
+
+        if self._index is not None:
+            self._index.remove(self)
+
     def __lt__(self, v:Video):
         if not isinstance(v, Video):
             raise Exception(f'Cannot compare {type(self)} to {type(v)}')
 
-        return self.get_datetime() < v.get_datetime()
\ No newline at end of file
+        return self._timestamp < v._timestamp
+
+    def _stat(self):
+        stat = os.stat(self._filepath)
+
+        self._size = stat.st_size
+        self._mtime = stat.st_mtime
\ No newline at end of file
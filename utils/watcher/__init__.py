@@ -0,0 +1,3 @@
+from .directory_watcher import DirectoryWatcher
+
+__all__ = [ 'DirectoryWatcher' ]
\ No newline at end of file
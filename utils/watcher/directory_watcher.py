@@ -0,0 +1,77 @@
+import os, struct, ctypes, ctypes.util
+
+class DirectoryWatcher:
+    # From <sys/inotify.h>
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+
+    _EVENT = struct.Struct('iIII')
+    _READ_SIZE = 64 * 1024
+
+    def __init__(self, dirpath:str, mask:int=IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+        self._dirpath = dirpath
+        self._mask = mask
+        self._fd = None
+
+        try:
+            self._fd = self._init_inotify()
+        except Exception as e:
+            # Not Linux, or inotify exhausted, callers fall back to polling
+            self._error = e
+        else:
+            self._error = None
+
+    def is_polling(self):
+        return self._fd is None
+
+    def get_error(self):
+        return self._error
+
+    def fileno(self):
+        return self._fd
+
+    def read_events(self):
+        try:
+            data = os.read(self._fd, self._READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            (wd, mask, cookie, length) = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', errors='replace')
+            offset += length
+
+            events.append((mask, name))
+
+        return events
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _init_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        if libc.inotify_add_watch(fd, os.fsencode(self._dirpath), self._mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f'inotify_add_watch failed for {self._dirpath}')
+
+        return fd
\ No newline at end of file